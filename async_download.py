@@ -2,128 +2,1167 @@
 This module provides functionality to download images asynchronously from a list of URLs.
 
 It includes:
+- The `fetch_image` function to request and save a single image, raising on failure.
 - The `download_image` function to download a single image.
+- The `download_stream` async generator yielding results as downloads finish.
 - The `main` function to handle the download process for multiple URLs.
 """
 import asyncio
 import logging
 import os
-from typing import List, Optional
+import threading
+import time
+from collections import deque
+from contextlib import aclosing, suppress
+from typing import (AsyncIterable, AsyncIterator, Awaitable, Callable,
+                    Iterable, List, Optional, Tuple, Union)
 
-import aiofiles
+import aiofiles.os
 import aiohttp
 
-from utils import (Counter, content_type_to_extension, generate_unique_name,
-                   load_credentials, setup_logging)
+from cache import HttpCache
+from deadlines import DeadlinePolicy, Hedger, remaining
+from dedup import PENDING, Deduplicator
+from formats import SNIFF_SIZE, FormatRegistry
+from limits import (OVERLOAD_STATUSES, AIMDController, BodyReservation, ByteBudget,
+                    HostLimiter, HostScheduler)
+from retry import RetryPolicy, parse_retry_after
+from manifest import Manifest
+from metrics import MeteredStorage, Metrics
+from pool import PoolConfig, PoolStats
+from postprocess import PostProcessor
+from ranges import PartialFile, RangePolicy, if_range, parse_content_range
+from storage import FileStorage, Storage, StorageWriter, stored_size
+from utils import (CHUNK_SIZE, QUEUE_SIZE_FACTOR, DownloadError, Progress,
+                   UrlSource, count_urls, iter_urls, load_credentials,
+                   remove_file, setup_logging, url_host)
+
+# Синхронные операции хранилища выполняются в пуле потоков
+in_thread = aiofiles.os.wrap
+
+# Сетевые ошибки, после которых имеет смысл повторить запрос
+TRANSIENT_ERRORS = (
+    aiohttp.ClientConnectionError,
+    aiohttp.ClientPayloadError,
+    asyncio.TimeoutError,
+)
+
+
+async def fetch_image(
+    url: str,
+    session: aiohttp.ClientSession,
+    folder: str,
+    chunk_size: int = CHUNK_SIZE,
+    preallocate_file: bool = False,
+    storage: Optional[Storage] = None,
+    cache: Optional[HttpCache] = None,
+    ranges: Optional[RangePolicy] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    host_limiter: Optional[HostLimiter] = None,
+    hedger: Optional[Hedger] = None,
+    formats: Optional[FormatRegistry] = None,
+    budget: Optional[ByteBudget] = None,
+) -> str:
+    """
+    Request a single URL and stream the image into the folder.
+
+    Args:
+        url (str): The URL of the file to download.
+        session (aiohttp.ClientSession): Aiohttp session to make HTTP requests.
+        folder (str): The folder where the downloaded file will be saved.
+        chunk_size (int, optional): Size of the chunks the body is read and written in.
+        preallocate_file (bool, optional): Reserve disk space from `Content-Length` before writing.
+        storage (Storage, optional): Backend the body is written to. Defaults to `FileStorage(folder)`.
+        cache (HttpCache, optional): Validator cache: the request is made conditional and `304` returns the cached file.
+        ranges (RangePolicy, optional): Fetch large bodies as parallel byte ranges into a preallocated file, resuming partial files.
+        semaphore (asyncio.Semaphore, optional): Global limit extra range connections take free slots from; unlimited if omitted.
+        host_limiter (HostLimiter, optional): Per-host limits extra range and hedged connections take free slots from.
+        hedger (Hedger, optional): Send a duplicate request if the response is slower than usual; the first one wins.
+        formats (FormatRegistry, optional): Accepted formats, detected from the first bytes, and the maximum body size. Defaults to `FormatRegistry()`.
+        budget (ByteBudget, optional): Global budget of body bytes in flight; the body is not read until its bytes are reserved.
+
+    Returns:
+        str: The file path where the downloaded file is saved.
+
+    Raises:
+        DownloadError: If the server answered with a non-200 status, a non-image body or a body over the size limit.
+        aiohttp.ClientError: If the request itself failed.
+    """  # noqa: E501
+    if storage is None:
+        storage = FileStorage(folder)
+    if formats is None:
+        formats = FormatRegistry()
+    # Выполняем GET запрос на URL
+    entry = cache.lookup(url) if cache is not None else None
+    headers = HttpCache.conditional_headers(entry)
+    partial = None
+    if ranges is not None and hasattr(storage, 'adopt'):
+        partial = PartialFile(folder, url)
+        # Продолжаем с первого недокачанного диапазона, если прогресс сохранился
+        resume = partial.resume_header()
+        headers['Range'] = resume or ranges.first_range()
+        if resume is not None:
+            headers['If-Range'] = partial.validator()
+    response = await _request(url, session, headers, hedger, host_limiter)
+    async with response:
+        # Файл не изменился с прошлого запуска: отдаем сохраненный
+        if response.status == 304 and entry is not None:
+            cache.hit(url)
+            return entry.path
+        if response.status == 416 and partial is not None:
+            # Пустое тело нельзя запросить диапазоном
+            await in_thread(partial.discard)()
+            return await fetch_image(
+                url, session, folder, chunk_size, preallocate_file, storage, cache,
+                formats=formats,
+            )
+        if response.status not in (200, 206) or (
+            response.status == 206 and partial is None
+        ):
+            raise DownloadError(
+                url, f'{response.status} ERROR', status=response.status,
+                retry_after=parse_retry_after(response.headers.get('Retry-After')),
+            )
+
+        content_range = None
+        if response.status == 206:
+            content_range = parse_content_range(response.headers.get('Content-Range'))
+            if content_range is None:
+                raise DownloadError(url, 'Invalid Content-Range')
+        # Тип и размер проверяем до чтения тела: у диапазона размер всего тела
+        content_type = response.headers.get('Content-Type')
+        total = content_range[2] if content_range is not None else response.content_length
+        formats.check_headers(url, content_type, total)
+
+        reservation = budget.reservation(total) if budget is not None else None
+        try:
+            if reservation is not None:
+                # Пока бюджет байтов исчерпан, тело не читается
+                await reservation.grow_async(total or 0)
+            chunks = response.content.iter_chunked(chunk_size)
+            if content_range is not None and content_range[:2] != (
+                0, content_range[2] - 1,
+            ):
+                # Тело пришло не целиком: остальные диапазоны качаются параллельно
+                file_path = await _fetch_ranges(
+                    url, session, response, chunks, partial, ranges, content_range,
+                    formats, chunk_size, storage, semaphore, host_limiter,
+                )
+                if file_path is None:
+                    # Тело изменилось с прошлой попытки: начинаем с чистого листа
+                    if reservation is not None:
+                        reservation.release()
+                    return await fetch_image(
+                        url, session, folder, chunk_size, preallocate_file, storage,
+                        cache, ranges, semaphore, host_limiter, hedger, formats, budget,
+                    )
+            else:
+                # Сервер отдал тело целиком: диапазоны не поддерживаются или тело мало
+                if partial is not None and partial.state is not None:
+                    await in_thread(partial.discard)()
+                # Формат определяем по первым байтам: не-изображение обрывается сразу
+                head = await _read_head(chunks)
+                extension = formats.detect(url, content_type, head)
+                size = response.content_length if preallocate_file else None
+                writer = await in_thread(storage.open)(url, extension, size)
+
+                # Пишем тело по частям, не блокируя выполнение
+                file_path = await _stream_to_writer(
+                    url, head, chunks, writer, formats, reservation,
+                )
+        finally:
+            if reservation is not None:
+                reservation.release()
+        if cache is not None:
+            cache.update(
+                url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                file_path,
+            )
+        return file_path
 
 
 async def download_image(
     url: str,
     semaphore: asyncio.Semaphore,
     session: aiohttp.ClientSession,
-    counter: Counter,
-    total_urls: int,
+    counter: Progress,
+    total_urls: Optional[int],
     folder: str,
-) -> str:
+    chunk_size: int = CHUNK_SIZE,
+    preallocate_file: bool = False,
+    retry_policy: Optional[RetryPolicy] = None,
+    host_limiter: Optional[HostLimiter] = None,
+    storage: Optional[Storage] = None,
+    cache: Optional[HttpCache] = None,
+    ranges: Optional[RangePolicy] = None,
+    hedger: Optional[Hedger] = None,
+    timeout: Optional[float] = None,
+    formats: Optional[FormatRegistry] = None,
+    postprocess: Optional[PostProcessor] = None,
+    budget: Optional[ByteBudget] = None,
+) -> Optional[str]:
     """
     Asynchronously downloads a file from the given URL and saves it to the specified folder.
 
+    The body is streamed to a temporary `.part` file chunk by chunk and atomically renamed
+    once complete, so memory use does not depend on the file size.
+
     Args:
         url (str): The URL of the file to download.
         semaphore (asyncio.Semaphore): Semaphore to limit the number of concurrent tasks.
         session (aiohttp.ClientSession): Aiohttp session to make HTTP requests.
-        counter (Counter): Counter object for tracking the number of downloaded files.
-        total_urls (int): Total number of URLs to download.
+        counter (Progress): Shared progress of the run: successes, failures, bytes, in-flight.
+        total_urls (int, optional): Total number of URLs to download, if known.
         folder (str): The folder where the downloaded file will be saved.
+        chunk_size (int, optional): Size of the chunks the body is read and written in.
+        preallocate_file (bool, optional): Reserve disk space from `Content-Length` before writing.
+        retry_policy (RetryPolicy, optional): Retry transient failures; the semaphore is released while waiting.
+        host_limiter (HostLimiter, optional): Per-host concurrency and rate limits applied to every attempt.
+        storage (Storage, optional): Backend the body is written to. Defaults to `FileStorage(folder)`.
+        cache (HttpCache, optional): Validator cache: the request is made conditional and `304` returns the cached file.
+        ranges (RangePolicy, optional): Fetch large bodies as parallel byte ranges within the semaphore and host limits.
+        hedger (Hedger, optional): Send a duplicate request if the response is slower than usual; the first one wins.
+        timeout (float, optional): Seconds the download may take, including retries and the waits between them.
+        formats (FormatRegistry, optional): Accepted formats, detected from the first bytes, and the maximum body size.
+        postprocess (PostProcessor, optional): Run its steps over the saved file in a worker process and wait for them.
+        budget (ByteBudget, optional): Global budget of body bytes in flight the body waits for.
 
     Returns:
-        str: The file path where the downloaded file is saved.
+        str, optional: The file path where the downloaded file is saved, `None` on failure. With `postprocess` it is a `ProcessedPath` holding the step results.
     """  # noqa: E501
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    result = await _download(
+        url, semaphore, session, counter, total_urls, folder,
+        chunk_size, preallocate_file, retry_policy, host_limiter, storage, cache,
+        ranges, hedger, deadline, formats, budget=budget,
+    )
+    if postprocess is not None and not isinstance(result, Exception):
+        result = await postprocess.run_async(url, result)
+    # Файл засчитывается только после постобработки, как в многопоточном режиме
+    _report(url, result, counter, total_urls, budget)
+    return None if isinstance(result, Exception) else result
+
+
+async def _download(
+    url: str,
+    semaphore: asyncio.Semaphore,
+    session: aiohttp.ClientSession,
+    counter: Progress,
+    total_urls: Optional[int],
+    folder: str,
+    chunk_size: int,
+    preallocate_file: bool,
+    retry_policy: Optional[RetryPolicy],
+    host_limiter: Optional[HostLimiter],
+    storage: Optional[Storage],
+    cache: Optional[HttpCache],
+    ranges: Optional[RangePolicy],
+    hedger: Optional[Hedger] = None,
+    deadline: Optional[float] = None,
+    formats: Optional[FormatRegistry] = None,
+    host_held: bool = False,
+    budget: Optional[ByteBudget] = None,
+) -> Union[str, Exception]:
+    """
+    Download one URL and return either the file path or the error that stopped it.
+
+    The outcome is left for `_report`, so a file is only counted once its
+    post-processing is done.
+    """
+    counter.start()
     try:
-        # Контролируем кол-во активных задач
-        async with semaphore:
-            # Выполняем GET запрос на URL
-            async with session.get(url) as response:
-                if response.status == 200:
-                    # Получаем Content-Type из Headers
-                    content_type = response.headers.get('Content-Type')
-                    # Проверка валидного расширение (jpg, png, gif)
-                    extension = content_type_to_extension.get(content_type)
-                    if extension is None:
-                        logging.warning(
-                            f'Unsupported  Content-Type: {content_type} | URL => {url}',
-                        )
-                        return
-
-                    # Генерируем уникальное имя для файла
-                    unique_name = generate_unique_name()
-                    file_path = os.path.join(folder, f'{unique_name}.{extension}')
-
-                    # Сохраняем полученные данные в файл, не блокируя выполнение
-                    data = await response.read()
-                    async with aiofiles.open(file_path, 'wb') as file:
-                        await file.write(data)
-
-                    logging.info(
-                        f'200 OK | {url[:30]}...{url[-10:]} => {file_path} | '
-                        f'{counter} / {total_urls}',
-                    )
-                    # Увеличиваем счетчик
-                    counter.increment()
-                    return file_path
-                else:
-                    logging.warning(f'{response.status} ERORR | URL => {url}')
-    except aiohttp.ClientError as error:
-        logging.error(f'Aiohttp client error occurred for URL: {url}. Error: {error}')
+        if deadline is None:
+            file_path = await _attempts(
+                url, semaphore, session, folder, chunk_size, preallocate_file,
+                retry_policy, host_limiter, storage, cache, ranges, hedger, None,
+                formats, host_held, budget,
+            )
+        else:
+            if time.monotonic() >= deadline:
+                # После дедлайна задания оставшиеся URL завершаются без запроса
+                if host_held:
+                    host_limiter.release(url_host(url))
+                raise DownloadError(url, 'Deadline exceeded')
+            file_path = await _until(_attempts(
+                url, semaphore, session, folder, chunk_size, preallocate_file,
+                retry_policy, host_limiter, storage, cache, ranges, hedger, deadline,
+                formats, host_held, budget,
+            ), url, deadline)
     except Exception as error:
-        logging.error(f'An unknown error occurred for URL: {url}. Error: {error}')
+        return error
+    return file_path
 
 
-async def main(
-    urls: list[str],
-    max_active_tasks: int,
-    cred_json_path: Optional[str] = 'credentials.json',
-    folder: Optional[str] = 'downloads/',
-) -> List[Optional[str]]:
+async def _attempts(
+    url: str,
+    semaphore: asyncio.Semaphore,
+    session: aiohttp.ClientSession,
+    folder: str,
+    chunk_size: int,
+    preallocate_file: bool,
+    retry_policy: Optional[RetryPolicy],
+    host_limiter: Optional[HostLimiter],
+    storage: Optional[Storage],
+    cache: Optional[HttpCache],
+    ranges: Optional[RangePolicy],
+    hedger: Optional[Hedger],
+    deadline: Optional[float],
+    formats: Optional[FormatRegistry],
+    host_held: bool,
+    budget: Optional[ByteBudget] = None,
+) -> str:
+    """Make download attempts until one succeeds; raise the error of the last one."""
+    host = url_host(url)
+    attempt = 1
+    while True:
+        try:
+            if host_limiter is not None and not host_held:
+                await host_limiter.acquire_async(host)
+            host_held = False
+            try:
+                # Контролируем кол-во активных задач
+                async with semaphore:
+                    return await fetch_image(
+                        url, session, folder, chunk_size, preallocate_file, storage,
+                        cache, ranges, semaphore, host_limiter, hedger, formats, budget,
+                    )
+            finally:
+                if host_limiter is not None:
+                    host_limiter.release(host)
+        except Exception as error:
+            delay = None
+            if retry_policy is not None:
+                delay = retry_policy.delay_for(attempt, error, TRANSIENT_ERRORS)
+            # Повтор, который не успеет начаться до дедлайна, не планируем
+            if delay is None or (
+                deadline is not None and time.monotonic() + delay >= deadline
+            ):
+                raise
+
+        # Ждем вне семафора и слота хоста, чтобы их получили другие задачи
+        logging.info(f'Retry #{attempt} in {delay:.2f}s | URL => {url}')
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+async def _until(awaitable: Awaitable[str], url: str, deadline: float) -> str:
+    """Await a download, cancelling it and raising `DownloadError` at the deadline."""
+    task = asyncio.ensure_future(awaitable)
+    try:
+        done, _ = await asyncio.wait([task], timeout=remaining(deadline))
+    except BaseException:
+        task.cancel()
+        raise
+    if not done:
+        # Отмена закрывает соединение и удаляет недописанный файл
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+        raise DownloadError(url, 'Deadline exceeded')
+    return task.result()
+
+
+def _report(
+    url: str,
+    result: Union[str, Exception],
+    counter: Progress,
+    total_urls: Optional[int],
+    budget: Optional[ByteBudget] = None,
+) -> None:
+    """Log the final outcome of a URL and account it in the progress."""
+    if isinstance(result, Exception):
+        counter.fail()
+    if isinstance(result, DownloadError):
+        logging.warning(f'{result} | URL => {url}')
+    elif isinstance(result, aiohttp.ClientError):
+        logging.error(f'Aiohttp client error occurred for URL: {url}. Error: {result}')
+    elif isinstance(result, Exception):
+        logging.error(f'An unknown error occurred for URL: {url}. Error: {result}')
+    else:
+        # Номер выдается атомарно, поэтому в логе не бывает повторов и пропусков
+        ordinal = counter.succeed(stored_size(result))
+        logging.info(
+            f'200 OK | {url[:30]}...{url[-10:]} => {result} | '
+            f'{ordinal} / {total_urls or "?"}'
+            + (f' | budget {budget}' if budget is not None else ''),
+        )
+
+
+async def _request(
+    url: str,
+    session: aiohttp.ClientSession,
+    headers: dict,
+    hedger: Optional[Hedger],
+    host_limiter: Optional[HostLimiter],
+) -> aiohttp.ClientResponse:
     """
-    Start the download process for the given list of URLs.
+    Send a GET request, hedged if a `Hedger` is given, and return the first response.
 
-    Args:
-        urls (list[str]): List of URLs to download.
-        max_active_tasks (int): Maximum number of concurrent tasks.
-        cred_json_path (str, optional): Path to the credentials file. Defaults to 'credentials.json'.
-        folder (str, optional): Folder to save downloaded files. Defaults to 'downloads/'.
+    The duplicate is sent only within the hedging budget and only if the host has a free
+    slot right now; the losing request is cancelled or its response closed.
+    """
+    if hedger is None:
+        return await session.get(url, headers=headers)
+
+    async def get() -> aiohttp.ClientResponse:
+        return await session.get(url, headers=headers)
+
+    started = time.monotonic()
+    host = url_host(url)
+    tasks = [asyncio.create_task(get())]
+    hedge_held = False
+    response = None
+    try:
+        delay = hedger.delay()
+        while delay is not None and len(tasks) == 1:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                break
+            if host_limiter is None or host_limiter.try_acquire(host) == 0:
+                if hedger.try_hedge():
+                    hedge_held = host_limiter is not None
+                    tasks.append(asyncio.create_task(get()))
+                elif host_limiter is not None:
+                    host_limiter.release(host)
+            # Бюджет и слоты хоста освобождаются со временем: пробуем снова
+            delay = hedger.delay()
+        pending = set(tasks)
+        while pending and response is None:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in tasks:
+                if task in done and task.exception() is None and response is None:
+                    response = task.result()
+                    if task is not tasks[0]:
+                        hedger.won()
+        if response is None:
+            # Оба запроса упали: пробрасываем ошибку основного
+            return tasks[0].result()
+        hedger.record(time.monotonic() - started)
+        return response
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for task in tasks:
+            # Проигравший запрос мог успеть получить ответ: закрываем его соединение
+            if not task.cancelled() and task.exception() is None and (
+                task.result() is not response
+            ):
+                task.result().close()
+        if hedge_held:
+            host_limiter.release(host)
+
+
+async def _read_head(chunks: AsyncIterator[bytes]) -> bytes:
+    """Read chunks of the body until at least `SNIFF_SIZE` bytes are buffered."""
+    head = b''
+    async for chunk in chunks:
+        head += chunk
+        if len(head) >= SNIFF_SIZE:
+            break
+    return head
+
+
+async def _stream_to_writer(
+    url: str,
+    head: bytes,
+    chunks: AsyncIterator[bytes],
+    writer: StorageWriter,
+    formats: FormatRegistry,
+    reservation: Optional[BodyReservation] = None,
+) -> str:
+    """Write the already read `head` and the rest of the body into a writer and commit it."""  # noqa: E501
+    try:
+        # Первый чанк может оказаться и всем телом
+        size = len(head)
+        formats.check_size(url, size)
+        await in_thread(writer.write)(head)
+        async for chunk in chunks:
+            # Без Content-Length лимит размера проверяется по мере чтения
+            size += len(chunk)
+            formats.check_size(url, size)
+            if reservation is not None:
+                # Резерв тела без Content-Length растет, пока его читают
+                await reservation.grow_async(size)
+            await in_thread(writer.write)(chunk)
+        # Файл появляется в хранилище только целиком
+        return await in_thread(writer.commit)()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+async def _fetch_ranges(
+    url: str,
+    session: aiohttp.ClientSession,
+    response: aiohttp.ClientResponse,
+    chunks: AsyncIterator[bytes],
+    partial: PartialFile,
+    ranges: RangePolicy,
+    content_range: Tuple[int, int, int],
+    formats: FormatRegistry,
+    chunk_size: int,
+    storage: Storage,
+    semaphore: Optional[asyncio.Semaphore],
+    host_limiter: Optional[HostLimiter],
+) -> Optional[str]:
+    """
+    Download a body as byte ranges, the first one being the already open `response`.
+
+    A new body is checked by its first bytes before the file is preallocated; a resumed
+    one, whose first bytes were checked by an earlier attempt, once it is complete.
+
+    Extra connections only take slots that are free right now, so they never wait and
+    never hold up other URLs; ranges left without a connection are fetched one after
+    another by the busy ones. A failed range does not cancel the others; once they are
+    done the progress is saved for the next attempt.
 
     Returns:
-        List[Optional[str]]: A list of file paths where the downloaded files are saved. If a file could not be downloaded, its entry in the list will be `None`.
+        str, optional: The stored file, or `None` if the saved progress belongs to another version of the body.
     """  # noqa: E501
+    first, last, total = content_range
+    content_type = response.headers.get('Content-Type')
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    extension = None
+    if partial.matches(total, etag, last_modified) and partial.missing() and (
+        partial.ranges[partial.missing()[0]][2] == first
+    ):
+        await in_thread(partial.open)()
+        first_index = partial.missing()[0]
+    elif first == 0:
+        head = await _read_head(chunks)
+        extension = formats.detect(url, content_type, head)
+        plan = [(0, last), *ranges.split(last + 1, total)]
+        await in_thread(partial.begin)(total, etag, last_modified, plan)
+        await in_thread(partial.write)(0, head)
+        first_index = 0
+    else:
+        await in_thread(partial.discard)()
+        return None
+
+    host = url_host(url)
+    validator = if_range(etag, last_modified)
+    waiting = deque(index for index in partial.missing() if index != first_index)
+
+    async def read(index: int, body: AsyncIterator[bytes]) -> None:
+        async for chunk in body:
+            await in_thread(partial.write)(index, chunk)
+        start, end, next_ = partial.ranges[index]
+        if next_ <= end:
+            raise DownloadError(url, f'Range {start}-{end} ended at {next_}')
+        await in_thread(partial.save)()
+
+    async def fetch(index: int) -> None:
+        _, end, next_ = partial.ranges[index]
+        headers = {'Range': f'bytes={next_}-{end}'}
+        if validator is not None:
+            headers['If-Range'] = validator
+        async with session.get(url, headers=headers) as part:
+            received = parse_content_range(part.headers.get('Content-Range'))
+            if part.status != 206 or received is None or received[:2] != (next_, end):
+                message = f'{part.status} ERROR for range {next_}-{end}'
+                raise DownloadError(url, message, status=part.status)
+            await read(index, part.content.iter_chunked(chunk_size))
+
+    async def drain() -> None:
+        while waiting:
+            await fetch(waiting.popleft())
+
+    async def first_lane() -> None:
+        await read(first_index, chunks)
+        await drain()
+
+    async def extra_lane() -> None:
+        # Лишнее соединение берет только свободные сейчас слоты, не дожидаясь их
+        if semaphore is not None and semaphore.locked():
+            return
+        if host_limiter is not None and host_limiter.try_acquire(host) != 0:
+            return
+        try:
+            if semaphore is None:
+                await drain()
+            else:
+                async with semaphore:
+                    await drain()
+        finally:
+            if host_limiter is not None:
+                host_limiter.release(host)
+
+    lanes = [first_lane()]
+    lanes += [extra_lane() for _ in range(min(len(waiting), ranges.parts - 1))]
+    tasks = [asyncio.create_task(lane) for lane in lanes]
+    try:
+        # Ошибка одной части не отменяет остальные: докачанные ими байты сохранятся
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Прогресс сохраняется: следующая попытка докачает только недостающее
+        await in_thread(partial.suspend)()
+        raise
+    path = await in_thread(partial.commit)()
+    if extension is None:
+        try:
+            extension = formats.detect(url, content_type, await in_thread(_head_of)(path))
+        except DownloadError:
+            await in_thread(remove_file)(path)
+            raise
+    return await in_thread(storage.adopt)(url, extension, path)
+
+
+def _head_of(path: str) -> bytes:
+    with open(path, 'rb') as file:
+        return file.read(SNIFF_SIZE)
+
+
+class _AdaptiveSemaphore:
+    """Semaphore sized by an `AIMDController` that reports every attempt back to it."""
+
+    def __init__(self, controller: AIMDController):
+        self.controller = controller
+        self.active = 0
+        self._started = {}
+        self._changed = asyncio.Event()
+
+    def locked(self) -> bool:
+        return self.active >= self.controller.limit
+
+    async def __aenter__(self) -> None:
+        while self.active >= self.controller.limit:
+            await self._changed.wait()
+        self.active += 1
+        self._started[asyncio.current_task()] = time.monotonic()
+
+    async def __aexit__(self, exc_type, error, traceback) -> None:
+        latency = time.monotonic() - self._started.pop(asyncio.current_task())
+        self.active -= 1
+        self.controller.record(latency, overloaded=_is_overload(error))
+        # Лимит мог вырасти или освободился слот: будим ожидающих
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+def _is_overload(error: Optional[BaseException]) -> bool:
+    if isinstance(error, DownloadError):
+        return error.status in OVERLOAD_STATUSES
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class _HostQueue:
+    """Bounded asyncio queue that hands out only URLs whose host has free capacity."""
+
+    def __init__(
+        self, limiter: HostLimiter, maxsize: int, deadline: Optional[float] = None,
+    ):
+        self._scheduler = HostScheduler(limiter, maxsize)
+        self._changed = asyncio.Event()
+        self._closed = False
+        self._deadline = deadline
+
+    def _notify(self) -> None:
+        # Будим всех ожидающих и заводим новое событие для следующего ожидания
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _wait(self, timeout: Optional[float]) -> None:
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._changed.wait(), timeout)
+
+    async def put(self, host: str, item: Tuple[int, str]) -> None:
+        while self._scheduler.full():
+            await self._wait(None)
+        self._scheduler.push(host, item)
+        self._notify()
+
+    def __len__(self) -> int:
+        return len(self._scheduler)
+
+    def close(self) -> None:
+        self._closed = True
+        self._notify()
+
+    async def get(self) -> Optional[Tuple[Optional[str], Tuple[int, str]]]:
+        """
+        Return `(host, item)` with the host slot taken, or `None` once drained.
+
+        After the deadline items are handed out without waiting for their hosts, as
+        `(None, item)`: they are only failed, so they must not hold up the run.
+        """
+        while True:
+            ready, delay = self._scheduler.pop_ready()
+            if ready is None and self._deadline is not None:
+                left = remaining(self._deadline)
+                if left == 0 and self._scheduler:
+                    _, item = self._scheduler.pop_any()
+                    ready = None, item
+                delay = left if delay is None else min(delay, left)
+            if ready is not None:
+                self._notify()
+                return ready
+            if self._closed and not self._scheduler:
+                return None
+            await self._wait(delay)
+
+    def watch(self, limiter: HostLimiter) -> int:
+        """Wake up waiting workers whenever a host slot is released."""
+        loop = asyncio.get_running_loop()
+        return limiter.subscribe(lambda: loop.call_soon_threadsafe(self._notify))
+
+
+async def _read_in_thread(
+    urls: Iterable[str], buffer_size: int = 1024,
+) -> AsyncIterator[str]:
+    """
+    Yield URLs of a blocking iterable, e.g. a file or stdin, read in a daemon thread.
+
+    A slow pipe blocks only the reading thread, so the downloads already queued keep
+    running; at most `buffer_size` URLs are read ahead.
+    """
+    loop = asyncio.get_running_loop()
+    lines = asyncio.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+    end = object()
+
+    def read() -> None:
+        item = end
+        try:
+            for url in urls:
+                if stop.is_set():
+                    return
+                asyncio.run_coroutine_threadsafe(lines.put(url), loop).result()
+        except Exception as error:
+            item = error
+        with suppress(RuntimeError):
+            # Цикл событий уже закрыт: читать результат некому
+            asyncio.run_coroutine_threadsafe(lines.put(item), loop).result()
+
+    # Поток-демон не держит выход из программы, если stdin так и не закроется
+    threading.Thread(target=read, name='url-reader', daemon=True).start()
+    try:
+        while (item := await lines.get()) is not end:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Освобождаем место в очереди, чтобы поток не остался ждать в put()
+        while not lines.empty():
+            lines.get_nowait()
+
+
+async def _produce(
+    urls: Union[Iterable[str], AsyncIterable[str]],
+    queue: _HostQueue,
+    accept: Optional[Callable[[int, str], Awaitable[bool]]] = None,
+) -> None:
+    """Feed `(index, url)` pairs accepted by `accept` into the queue and close it at the end."""  # noqa: E501
+    async def put(index: int, url: str) -> None:
+        if accept is None or await accept(index, url):
+            await queue.put(url_host(url), (index, url))
+
+    index = 0
+    try:
+        if isinstance(urls, AsyncIterable):
+            async for url in urls:
+                await put(index, url)
+                index += 1
+        else:
+            for url in urls:
+                await put(index, url)
+                index += 1
+    finally:
+        queue.close()
+
+
+async def _worker(
+    queue: _HostQueue,
+    handle: Callable[[int, str, Optional[str]], Awaitable[None]],
+) -> None:
+    """Take URLs of hosts with free capacity until the queue is drained."""
+    while (item := await queue.get()) is not None:
+        host, (index, url) = item
+        await handle(index, url, host)
+
+
+async def _run_pool(
+    urls: Union[Iterable[str], AsyncIterable[str]],
+    queue: _HostQueue,
+    workers_count: int,
+    handle: Callable[[int, str, Optional[str]], Awaitable[None]],
+    accept: Optional[Callable[[int, str], Awaitable[bool]]] = None,
+) -> None:
+    """Run one producer and `workers_count` workers until every URL is handled."""
+    tasks = [asyncio.create_task(_produce(urls, queue, accept))]
+    tasks += [
+        asyncio.create_task(_worker(queue, handle))
+        for _ in range(workers_count)
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # Если продюсер или воркер упал, не оставляем висящих задач
+        for task in tasks:
+            task.cancel()
+
+
+async def _iter_results(
+    urls: UrlSource,
+    max_active_tasks: int,
+    cred_json_path: Optional[str],
+    folder: Optional[str],
+    chunk_size: int,
+    preallocate_file: bool,
+    retry_policy: Optional[RetryPolicy],
+    host_limiter: Optional[HostLimiter],
+    adaptive: Optional[AIMDController],
+    storage: Optional[Storage],
+    manifest: Optional[Manifest],
+    cache: Optional[HttpCache],
+    metrics: Optional[Metrics],
+    ranges: Optional[RangePolicy],
+    pool: Optional[PoolConfig],
+    deadlines: Optional[DeadlinePolicy],
+    hedger: Optional[Hedger],
+    formats: Optional[FormatRegistry],
+    dedup: Optional[Deduplicator],
+    postprocess: Optional[PostProcessor],
+    budget: Optional[ByteBudget],
+    counter: Optional[Progress] = None,
+) -> AsyncIterator[Tuple[int, str, Union[str, Exception]]]:
+    """Download URLs with a bounded worker pool, yielding `(index, url, result)` as they finish."""  # noqa: E501
     logging.info(' Async Downloading '.center(80, '#'))
 
     # Проверяем наличие папки для загрузки файлов, если ее нет, то создаем
     if not os.path.exists(folder):
         os.makedirs(folder)
+    if storage is None:
+        # С манифестом повторная загрузка после сбоя перезаписывает тот же файл
+        storage = FileStorage(folder, stable_names=manifest is not None)
+    if metrics is not None:
+        storage = MeteredStorage(storage, metrics)
 
-    counter = Counter()  # Счетчик для лога
-    total_urls = len(urls)
+    if counter is None:
+        counter = Progress()  # Прогресс для лога и сводки
+    if dedup is not None:
+        dedup.begin()
+    total_urls = count_urls(urls)
+    if not isinstance(urls, AsyncIterable):
+        urls = iter_urls(urls)
+        if total_urls is None:
+            # Файл, stdin или генератор читаются вне цикла событий: медленный
+            # источник не останавливает идущие загрузки
+            urls = _read_in_thread(urls)
 
     # Загружаем все креды для отправки запросов
     cred = load_credentials(cred_json_path)
+    job_end = deadlines.job_end() if deadlines is not None else None
+
+    # Создаем ограничитель активных задач: фиксированный или подстраиваемый под нагрузку
+    if adaptive is not None:
+        adaptive.begin(max_active_tasks)
+        semaphore = _AdaptiveSemaphore(adaptive)
+        workers_count = adaptive.max_limit
+    else:
+        semaphore = asyncio.Semaphore(max_active_tasks)
+        workers_count = max_active_tasks
+    # Пул соединений рассчитан на наибольшее число одновременных запросов
+    if pool is None:
+        pool = PoolConfig()
+    pool_stats = PoolStats()
+    # Дубли хеджирования (не больше одного на запрос) идут сверх семафора, а лишние
+    # диапазоны тела - сверх лимита на хост: запас в пуле, чтобы они не ждали соединения
+    extra = 0
+    if hedger is not None:
+        extra += workers_count
+    if ranges is not None:
+        extra += ranges.parts - 1
+    connector = pool.connector(workers_count, extra)
 
-    # Создаем ограничитель активных задач
-    semaphore = asyncio.Semaphore(max_active_tasks)
+    # Пока часть воркеров ждет повтора вне семафора, остальные берут новые URL
+    if retry_policy is not None:
+        workers_count *= QUEUE_SIZE_FACTOR
+
+    # Без явных ограничений по хостам планировщик работает как обычная очередь
+    if host_limiter is None:
+        host_limiter = HostLimiter()
+
+    # Ограниченные очереди: в памяти не больше пары URL и результатов на воркер
+    queue = _HostQueue(
+        host_limiter, maxsize=workers_count * QUEUE_SIZE_FACTOR, deadline=job_end,
+    )
+    done = asyncio.Queue(maxsize=workers_count * QUEUE_SIZE_FACTOR)
+    watch_key = queue.watch(host_limiter)
+    postprocess_tasks = set()
+    if postprocess is not None:
+        postprocess_slots = asyncio.Semaphore(postprocess.max_pending)
 
     # Создаем сессию в Aiohttp для последующей отправки запросов
-    async with aiohttp.ClientSession(headers=cred['headers']) as session:
-        # Под каждую ссылку создаем задачу
-        tasks = [
-            download_image(url, semaphore, session, counter, total_urls, folder)
-            for url in urls
-        ]
-        # Запускаем задачи параллельно
-        result = await asyncio.gather(*tasks)
+    trace_configs = [pool.trace_config(pool_stats)]
+    if metrics is not None:
+        trace_configs.append(metrics.trace_config())
+    async with aiohttp.ClientSession(
+        headers=cred['headers'], connector=connector, timeout=pool.client_timeout(),
+        trace_configs=trace_configs,
+    ) as session:
+        async def handle(index: int, url: str, host: Optional[str]) -> None:
+            if metrics is not None:
+                metrics.set('download_queue_depth', len(queue))
+                metrics.add('download_in_flight', 1)
+            deadline = deadlines.url_end(job_end) if deadlines is not None else None
+            # Слот хоста уже занят очередью при выдаче URL, кроме выданных после
+            # дедлайна задания
+            result = await _download(
+                url, semaphore, session, counter, total_urls, folder,
+                chunk_size, preallocate_file, retry_policy, host_limiter, storage,
+                cache, ranges, hedger, deadline, formats, host_held=host is not None,
+                budget=budget,
+            )
+            if metrics is not None:
+                metrics.add('download_in_flight', -1)
+            if postprocess is not None and not isinstance(result, Exception):
+                # Пока CPU-этап не догнал загрузки, воркер не берет новых URL
+                await postprocess_slots.acquire()
+                task = asyncio.create_task(process(index, url, result))
+                postprocess_tasks.add(task)
+                task.add_done_callback(postprocess_tasks.discard)
+                return
+            await complete(index, url, result)
+
+        async def process(index: int, url: str, path: str) -> None:
+            try:
+                result = await postprocess.run_async(url, path)
+            finally:
+                postprocess_slots.release()
+            await complete(index, url, result)
 
+        async def complete(index: int, url: str, result: Union[str, Exception]) -> None:
+            # Файл засчитывается только после постобработки, как в многопоточном режиме
+            _report(url, result, counter, total_urls, budget)
+            if metrics is not None:
+                metrics.record_result(result)
+            if manifest is not None:
+                manifest.record(url, result)
+            await done.put((index, url, result))
+
+        async def accept(index: int, url: str) -> bool:
+            if dedup is not None:
+                duplicate_of = dedup.claim(index, url)
+                if duplicate_of is not None:
+                    # Дубликат получает результат первого URL с тем же ключом
+                    if duplicate_of is not PENDING:
+                        await done.put((index, url, duplicate_of))
+                    return False
+            if manifest is None:
+                return True
+            # Завершенные в прошлом запуске URL сразу уходят в результаты
+            path = manifest.finished_path(url)
+            if path is None:
+                manifest.mark_pending(url)
+                return True
+            logging.info(f'Already downloaded | URL => {url}')
+            await done.put((index, url, path))
+            return False
+
+        async def run() -> None:
+            # Фиксированный набор воркеров разбирает очередь, которую наполняет продюсер
+            try:
+                await _run_pool(
+                    urls, queue, workers_count, handle,
+                    accept if manifest is not None or dedup is not None else None,
+                )
+                # Файлы, еще обрабатываемые пулом процессов, тоже должны дойти до выхода
+                await asyncio.gather(*postprocess_tasks)
+            except Exception:
+                await done.put(None)
+                raise
+            # Сообщаем потребителю, что результатов больше не будет
+            await done.put(None)
+
+        runner = asyncio.create_task(run())
+        try:
+            while (item := await done.get()) is not None:
+                yield item
+                if dedup is not None:
+                    # Дождавшиеся этого результата дубликаты отдаются следом
+                    for duplicate in dedup.resolve(*item):
+                        yield duplicate
+            # Пробрасываем ошибку продюсера, если она была
+            await runner
+        finally:
+            runner.cancel()
+            with suppress(asyncio.CancelledError):
+                await runner
+            for task in list(postprocess_tasks):
+                task.cancel()
+            if postprocess is not None:
+                await in_thread(postprocess.close)()
+            host_limiter.unsubscribe(watch_key)
+            storage.close()
+            if manifest is not None:
+                manifest.flush()
+            if cache is not None:
+                cache.flush()
+            if metrics is not None:
+                metrics.record_connections(pool_stats.new, pool_stats.reused)
+
+    counter.log_summary()
+    host_limiter.log_stats()
+    pool_stats.log_stats()
+    if hedger is not None:
+        hedger.log_stats()
+    if dedup is not None:
+        dedup.log_stats()
+    if postprocess is not None:
+        postprocess.log_stats()
+    if budget is not None:
+        budget.log_stats()
+    if cache is not None:
+        cache.log_stats()
+    if metrics is not None:
+        metrics.log_summary()
+    if manifest is not None:
+        manifest.log_summary()
+    if adaptive is not None:
+        adaptive.log_summary()
     logging.info('The script has finished its work'.center(80, '-'))
-    return result
+
+
+async def download_stream(
+    urls: UrlSource,
+    max_active_tasks: int,
+    cred_json_path: Optional[str] = 'credentials.json',
+    folder: Optional[str] = 'downloads/',
+    chunk_size: int = CHUNK_SIZE,
+    preallocate_file: bool = False,
+    retry_policy: Optional[RetryPolicy] = None,
+    host_limiter: Optional[HostLimiter] = None,
+    adaptive: Optional[AIMDController] = None,
+    storage: Optional[Storage] = None,
+    manifest: Optional[Manifest] = None,
+    cache: Optional[HttpCache] = None,
+    metrics: Optional[Metrics] = None,
+    ranges: Optional[RangePolicy] = None,
+    pool: Optional[PoolConfig] = None,
+    deadlines: Optional[DeadlinePolicy] = None,
+    hedger: Optional[Hedger] = None,
+    formats: Optional[FormatRegistry] = None,
+    dedup: Optional[Deduplicator] = None,
+    postprocess: Optional[PostProcessor] = None,
+    budget: Optional[ByteBudget] = None,
+) -> AsyncIterator[Tuple[str, Union[str, Exception]]]:
+    """
+    Download URLs and yield `(url, path_or_error)` as soon as each download finishes.
+
+    Results come in completion order and are not accumulated, so the caller can pipe them
+    downstream while the rest of the batch is still running.
+
+    Args:
+        urls (UrlSource): URLs as an (async) iterable, a file path, or '-' for stdin.
+        max_active_tasks (int): Maximum number of concurrent tasks (and worker tasks).
+        cred_json_path (str, optional): Path to the credentials file. Defaults to 'credentials.json'.
+        folder (str, optional): Folder to save downloaded files. Defaults to 'downloads/'.
+        chunk_size (int, optional): Size of the chunks response bodies are streamed in.
+        preallocate_file (bool, optional): Reserve disk space from `Content-Length` before writing.
+        retry_policy (RetryPolicy, optional): Retry transient failures with backoff. Defaults to no retries.
+        host_limiter (HostLimiter, optional): Per-host concurrency and rate limits; its `stats()` expose per-host counters.
+        adaptive (AIMDController, optional): Tune the concurrency limit at runtime, starting from `max_active_tasks`.
+        storage (Storage, optional): Backend bodies are written to, e.g. `ContentAddressedStorage`. Defaults to `FileStorage(folder)`.
+        manifest (Manifest, optional): Job manifest: URLs finished in an earlier run are skipped and every result is recorded.
+        cache (HttpCache, optional): Validator cache for repeat crawls; hit/miss ratios are logged at the end.
+        metrics (Metrics, optional): Registry for phase timings, bytes, statuses, errors, in-flight and queue depth.
+        ranges (RangePolicy, optional): Split large bodies into byte ranges fetched in parallel, resuming partial files.
+        pool (PoolConfig, optional): Connection pool sizes, keep-alive, DNS cache TTL and per-phase timeouts. Defaults to `PoolConfig()`.
+        deadlines (DeadlinePolicy, optional): Limits for one URL including its retries and for the whole run; late URLs fail with `DownloadError`.
+        hedger (Hedger, optional): Duplicate requests slower than a percentile of observed response times, within an extra-load budget.
+        formats (FormatRegistry, optional): Accepted image formats, detected from the first bytes, and the maximum body size. Defaults to `FormatRegistry()`.
+        dedup (Deduplicator, optional): Download URLs equal after normalization once; every duplicate gets the result of that download.
+        postprocess (PostProcessor, optional): Run CPU-bound steps over every saved file in a process pool; results carry them as `ProcessedPath.processed`.
+        budget (ByteBudget, optional): Global budget of response body bytes in flight; reads wait while it is used up. Usage is shown in the progress log.
+
+    Yields:
+        Tuple[str, str | Exception]: The URL and either its file path or the error it failed with.
+    """  # noqa: E501
+    results = _iter_results(
+        urls, max_active_tasks, cred_json_path, folder, chunk_size, preallocate_file,
+        retry_policy, host_limiter, adaptive, storage, manifest, cache,
+        metrics, ranges, pool, deadlines, hedger, formats, dedup, postprocess, budget,
+    )
+    async with aclosing(results):
+        async for _, url, result in results:
+            yield url, result
+
+
+async def main(
+    urls: UrlSource,
+    max_active_tasks: int,
+    cred_json_path: Optional[str] = 'credentials.json',
+    folder: Optional[str] = 'downloads/',
+    chunk_size: int = CHUNK_SIZE,
+    preallocate_file: bool = False,
+    retry_policy: Optional[RetryPolicy] = None,
+    host_limiter: Optional[HostLimiter] = None,
+    adaptive: Optional[AIMDController] = None,
+    storage: Optional[Storage] = None,
+    manifest: Optional[Manifest] = None,
+    cache: Optional[HttpCache] = None,
+    metrics: Optional[Metrics] = None,
+    ranges: Optional[RangePolicy] = None,
+    pool: Optional[PoolConfig] = None,
+    deadlines: Optional[DeadlinePolicy] = None,
+    hedger: Optional[Hedger] = None,
+    formats: Optional[FormatRegistry] = None,
+    dedup: Optional[Deduplicator] = None,
+    postprocess: Optional[PostProcessor] = None,
+    budget: Optional[ByteBudget] = None,
+) -> List[Optional[str]]:
+    """
+    Start the download process for the given list of URLs.
+
+    A fixed pool of `max_active_tasks` workers pulls URLs from a bounded queue, so memory
+    stays proportional to the concurrency rather than to the number of URLs.
+
+    Args:
+        urls (UrlSource): URLs as an (async) iterable, a file path, or '-' for stdin.
+        max_active_tasks (int): Maximum number of concurrent tasks (and worker tasks).
+        cred_json_path (str, optional): Path to the credentials file. Defaults to 'credentials.json'.
+        folder (str, optional): Folder to save downloaded files. Defaults to 'downloads/'.
+        chunk_size (int, optional): Size of the chunks response bodies are streamed in.
+        preallocate_file (bool, optional): Reserve disk space from `Content-Length` before writing.
+        retry_policy (RetryPolicy, optional): Retry transient failures with backoff. Defaults to no retries.
+        host_limiter (HostLimiter, optional): Per-host concurrency and rate limits; its `stats()` expose per-host counters.
+        adaptive (AIMDController, optional): Tune the concurrency limit at runtime, starting from `max_active_tasks`.
+        storage (Storage, optional): Backend bodies are written to, e.g. `ContentAddressedStorage`. Defaults to `FileStorage(folder)`.
+        manifest (Manifest, optional): Job manifest: URLs finished in an earlier run are skipped and every result is recorded.
+        cache (HttpCache, optional): Validator cache for repeat crawls; hit/miss ratios are logged at the end.
+        metrics (Metrics, optional): Registry for phase timings, bytes, statuses, errors, in-flight and queue depth.
+        ranges (RangePolicy, optional): Split large bodies into byte ranges fetched in parallel, resuming partial files.
+        pool (PoolConfig, optional): Connection pool sizes, keep-alive, DNS cache TTL and per-phase timeouts. Defaults to `PoolConfig()`.
+        deadlines (DeadlinePolicy, optional): Limits for one URL including its retries and for the whole run; late URLs fail with `DownloadError`.
+        hedger (Hedger, optional): Duplicate requests slower than a percentile of observed response times, within an extra-load budget.
+        formats (FormatRegistry, optional): Accepted image formats, detected from the first bytes, and the maximum body size. Defaults to `FormatRegistry()`.
+        dedup (Deduplicator, optional): Download URLs equal after normalization once; every duplicate gets the result of that download.
+        postprocess (PostProcessor, optional): Run CPU-bound steps over every saved file in a process pool; results carry them as `ProcessedPath.processed`.
+        budget (ByteBudget, optional): Global budget of response body bytes in flight; reads wait while it is used up. Usage is shown in the progress log.
+
+    Returns:
+        List[Optional[str]]: A list of file paths where the downloaded files are saved. If a file could not be downloaded, its entry in the list will be `None`.
+    """  # noqa: E501
+    results = {}
+    async for index, _, result in _iter_results(
+        urls, max_active_tasks, cred_json_path, folder, chunk_size, preallocate_file,
+        retry_policy, host_limiter, adaptive, storage, manifest, cache,
+        metrics, ranges, pool, deadlines, hedger, formats, dedup, postprocess, budget,
+    ):
+        results[index] = None if isinstance(result, Exception) else result
+
+    return [results[index] for index in range(len(results))]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,390 @@
+"""
+This module provides a reproducible benchmark of the async, multithreaded and multiprocess downloaders.
+
+It includes:
+- The `HostProfile` class describing how the stand-in server answers for one host.
+- The `ImageServer` class, a local aiohttp server with configurable image sizes, latency,
+  jitter, error rate, stalled requests and per-host behaviour (hosts are distinct 127.0.0.x addresses).
+- The `run_benchmark` function sweeping modes, concurrency levels, URL counts and, for
+  the multiprocess mode, process counts.
+
+Every case runs in a fresh process, so peak RSS and CPU time belong to that case alone
+(worker processes of the multiprocess mode included).
+Latency is measured per file from the moment the downloader takes the URL from its input
+to the moment its result is yielded.
+
+Usage:
+    python benchmark.py --concurrency 4 16 64 --urls 200 1000 --json bench.json --csv bench.csv
+    python benchmark.py --modes multiprocess --processes 1 2 4 8 --concurrency 64 --urls 5000
+"""  # noqa: E501
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from aiohttp import web
+
+import async_download
+import multiprocess_download
+import multithreaded_download
+from storage import stored_size
+
+CRED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'credentials.json')
+MODES = ('async', 'multithreaded', 'multiprocess')
+
+# Начало JPEG, чтобы ответ выглядел как настоящее изображение
+JPEG_MAGIC = b'\xff\xd8\xff\xe0'
+
+
+@dataclass(frozen=True)
+class HostProfile:
+    """
+    Behaviour of the stand-in server for one host.
+
+    Attributes:
+        image_size (int): Average body size in bytes.
+        size_jitter (float): Body size varies uniformly by this fraction of `image_size`.
+        latency (float): Seconds before the response starts.
+        latency_jitter (float): Latency varies uniformly by up to this many seconds.
+        error_rate (float): Share of URLs answered with `503 Service Unavailable`.
+        stall_rate (float): Share of requests, not URLs, that stall, so a repeated request usually does not.
+        stall (float): Extra seconds a stalled request waits before the response starts.
+    """  # noqa: E501
+    image_size: int = 64 * 1024
+    size_jitter: float = 0.0
+    latency: float = 0.02
+    latency_jitter: float = 0.0
+    error_rate: float = 0.0
+    stall_rate: float = 0.0
+    stall: float = 1.0
+
+
+class ImageServer:
+    """
+    Local HTTP server serving fake images at `/img/<n>.jpg`, run in a background thread.
+
+    Sizes, latencies and errors are derived from `seed` and the URL, so every run of the
+    benchmark sees exactly the same responses.
+
+    Args:
+        default (HostProfile, optional): Behaviour of hosts without their own entry.
+        hosts (Dict[str, HostProfile], optional): Behaviour of specific hosts, e.g. '127.0.0.2'.
+        addresses (Sequence[str], optional): Loopback addresses to listen on, one per host.
+        seed (int, optional): Seed of the response generator. Defaults to 0.
+    """  # noqa: E501
+
+    def __init__(
+        self,
+        default: Optional[HostProfile] = None,
+        hosts: Optional[Dict[str, HostProfile]] = None,
+        addresses: Sequence[str] = ('127.0.0.1',),
+        seed: int = 0,
+    ):
+        self.default = default or HostProfile()
+        self.hosts = hosts or {}
+        self.addresses = list(dict.fromkeys([*addresses, *self.hosts]))
+        self.seed = seed
+        self.port = None
+        self.requests = 0
+        self._seen: Dict[str, int] = {}
+        profiles = [self.default, *self.hosts.values()]
+        max_size = max(int(p.image_size * (1 + p.size_jitter)) for p in profiles)
+        self._payload = JPEG_MAGIC + random.Random(seed).randbytes(max_size)
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        host = request.host.rsplit(':', 1)[0]
+        profile = self.hosts.get(host, self.default)
+        rng = random.Random(f'{self.seed}:{host}:{request.match_info["n"]}')
+
+        latency = profile.latency + rng.uniform(0, profile.latency_jitter)
+        if profile.stall_rate:
+            # Задержка зависит от номера запроса к URL, а не только от самого URL
+            key = f'{host}:{request.match_info["n"]}'
+            self._seen[key] = self._seen.get(key, 0) + 1
+            stall_rng = random.Random(f'{self.seed}:{key}:{self._seen[key]}')
+            if stall_rng.random() < profile.stall_rate:
+                latency += profile.stall
+        await asyncio.sleep(latency)
+        if rng.random() < profile.error_rate:
+            return web.Response(status=503)
+
+        jitter = profile.image_size * profile.size_jitter
+        size = int(profile.image_size + rng.uniform(-jitter, jitter))
+        size = max(len(JPEG_MAGIC), size)
+        return web.Response(body=self._payload[:size], content_type='image/jpeg')
+
+    def start(self) -> 'ImageServer':
+        """Start serving on one free port of every address."""
+        started = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        async def serve() -> None:
+            app = web.Application()
+            app.router.add_get('/img/{n}.jpg', self._handle)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            # Linux принимает весь диапазон 127.0.0.0/8 на loopback, так что каждый
+            # адрес для клиента - отдельный хост со своими соединениями и лимитами
+            first, *others = self.addresses
+            site = web.TCPSite(self._runner, first, 0)
+            await site.start()
+            self.port = site._server.sockets[0].getsockname()[1]
+            for address in others:
+                await web.TCPSite(self._runner, address, self.port).start()
+
+        def run() -> None:
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(serve())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    async def _shutdown(self) -> None:
+        await self._runner.cleanup()
+        # Обработчики зависших запросов, брошенных клиентом, не переживают сервер
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self) -> 'ImageServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def urls(self, count: int) -> List[str]:
+        """Return `count` distinct image URLs spread round-robin over the addresses."""
+        hosts = self.addresses
+        return [
+            f'http://{hosts[n % len(hosts)]}:{self.port}/img/{n}.jpg'
+            for n in range(count)
+        ]
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile, `q` in 0..100; 0 for an empty sequence."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _timed(urls: List[str], taken: Dict[str, float]) -> Iterator[str]:
+    # Отмечаем момент, когда загрузчик забрал URL из входа
+    for url in urls:
+        taken[url] = time.perf_counter()
+        yield url
+
+
+def _run_case(
+    mode: str, urls: List[str], concurrency: int, processes: int, results,
+) -> None:
+    """Download `urls` in the given mode and put the measurements into `results`."""
+    # Лог каждого файла в stderr измерял бы скорость терминала, а не загрузчика
+    logging.disable(logging.CRITICAL)
+    taken, latencies, sizes = {}, [], []
+    failed = 0
+
+    def account(url: str, result) -> None:
+        nonlocal failed
+        latencies.append(time.perf_counter() - taken[url])
+        if isinstance(result, Exception):
+            failed += 1
+        else:
+            sizes.append(stored_size(result))
+
+    with tempfile.TemporaryDirectory() as folder:
+        cpu_start = os.times()
+        start = time.perf_counter()
+        if mode == 'async':
+            async def consume() -> None:
+                async for url, result in async_download.download_stream(
+                    _timed(urls, taken), concurrency, CRED_PATH, folder,
+                ):
+                    account(url, result)
+
+            asyncio.run(consume())
+        elif mode == 'multiprocess':
+            for url, result in multiprocess_download.download_stream(
+                _timed(urls, taken), concurrency, CRED_PATH, folder, processes,
+            ):
+                account(url, result)
+        else:
+            for url, result in multithreaded_download.download_stream(
+                _timed(urls, taken), concurrency, CRED_PATH, folder,
+            ):
+                account(url, result)
+        elapsed = time.perf_counter() - start
+        cpu_end = os.times()
+
+    # ru_maxrss в Linux измеряется в килобайтах; у воркеров берем самый большой
+    peak_rss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    ) / 1024
+    megabytes = sum(sizes) / 1024 / 1024
+    results.put({
+        'mode': mode,
+        'concurrency': concurrency,
+        'processes': processes,
+        'urls': len(urls),
+        'files': len(sizes),
+        'failed': failed,
+        'seconds': round(elapsed, 3),
+        'files_per_s': round(len(sizes) / elapsed, 2),
+        'mb_per_s': round(megabytes / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'peak_rss_mb': round(peak_rss, 1),
+        # Процессорное время завершившихся воркеров входит в children_*
+        'cpu_s': round(sum(
+            end - start for end, start in zip(cpu_end[:4], cpu_start[:4])
+        ), 3),
+    })
+
+
+def run_benchmark(
+    server: ImageServer,
+    modes: Sequence[str] = MODES,
+    concurrency_levels: Sequence[int] = (4, 16, 64),
+    url_counts: Sequence[int] = (200,),
+    process_counts: Sequence[int] = (os.cpu_count() or 1,),
+) -> List[dict]:
+    """
+    Run every combination of mode, concurrency level and URL count against a started server.
+
+    The multiprocess mode runs once per entry of `process_counts`; with the concurrency
+    fixed, its rows show how throughput scales with the number of cores.
+
+    Returns:
+        List[dict]: One row of measurements per case.
+    """  # noqa: E501
+    # spawn: каждый прогон начинается с чистого процесса без унаследованной памяти
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    rows = []
+    for count in url_counts:
+        urls = server.urls(count)
+        for concurrency in concurrency_levels:
+            cases = [
+                (mode, processes) for mode in modes
+                for processes in (process_counts if mode == 'multiprocess' else (1,))
+            ]
+            for mode, processes in cases:
+                process = context.Process(
+                    target=_run_case, args=(mode, urls, concurrency, processes, results),
+                )
+                process.start()
+                row = results.get()
+                process.join()
+                rows.append(row)
+                print(
+                    f'{mode:>13} | {processes:>3} proc | {concurrency:>4} tasks | '
+                    f'{count:>6} urls | '
+                    f'{row["files_per_s"]:>8} files/s | {row["mb_per_s"]:>7} MB/s | '
+                    f'p95 {row["p95_ms"]:>7} ms | rss {row["peak_rss_mb"]:>6} MB | '
+                    f'cpu {row["cpu_s"]:>6} s',
+                    file=sys.stderr,
+                )
+    return rows
+
+
+def write_json(rows: List[dict], path: str) -> None:
+    with open(path, 'w') as file:
+        json.dump(rows, file, indent=2)
+
+
+def write_csv(rows: List[dict], path: str) -> None:
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark the downloaders locally.')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[4, 16, 64])
+    parser.add_argument('--urls', nargs='+', type=int, default=[200])
+    parser.add_argument(
+        '--processes', nargs='+', type=int, default=[os.cpu_count() or 1],
+        help='Process counts of the multiprocess mode. Defaults to the number of cores.',
+    )
+    parser.add_argument('--hosts', type=int, default=1, help='Number of 127.0.0.x hosts.')
+    parser.add_argument('--image-size', type=int, default=64 * 1024)
+    parser.add_argument('--size-jitter', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument(
+        '--stall-rate', type=float, default=0.0,
+        help='Share of requests delayed by --stall seconds, to model tail latency.',
+    )
+    parser.add_argument('--stall', type=float, default=1.0)
+    parser.add_argument(
+        '--slow-host-latency', type=float,
+        help='Give the last host this latency to see how one slow host affects the rest.',
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Write the results as JSON to this file.')
+    parser.add_argument('--csv', help='Write the results as CSV to this file.')
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    default = HostProfile(
+        image_size=args.image_size, size_jitter=args.size_jitter, latency=args.latency,
+        latency_jitter=args.latency_jitter, error_rate=args.error_rate,
+        stall_rate=args.stall_rate, stall=args.stall,
+    )
+    hosts = [f'127.0.0.{n + 1}' for n in range(args.hosts)]
+    overrides = {}
+    if args.slow_host_latency is not None:
+        overrides[hosts[-1]] = replace(default, latency=args.slow_host_latency)
+
+    with ImageServer(default, overrides, hosts, seed=args.seed) as server:
+        rows = run_benchmark(
+            server, args.modes, args.concurrency, args.urls, args.processes,
+        )
+
+    if args.json:
+        write_json(rows, args.json)
+    if args.csv:
+        write_csv(rows, args.csv)
+    if not args.json and not args.csv:
+        json.dump(rows, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
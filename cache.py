@@ -0,0 +1,196 @@
+"""
+This module provides the HTTP validator cache used for repeat crawls.
+
+It includes:
+- The `CacheEntry` class holding the validators and local file of a URL.
+- The `HttpCache` class storing entries in SQLite, sending conditional requests and
+  evicting entries by age and by count (least recently used first).
+
+A URL whose entry is still valid is requested with `If-None-Match`/`If-Modified-Since`;
+a `304 Not Modified` answer is a hit and returns the file saved by the earlier run.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from storage import stored_exists
+
+
+@dataclass(frozen=True)
+class CacheEntry:
+    """
+    Validators and local file of a cached URL.
+
+    Attributes:
+        etag (str, optional): `ETag` header of the cached response.
+        last_modified (str, optional): `Last-Modified` header of the cached response.
+        path (str): The file the body was saved to.
+    """
+    etag: Optional[str]
+    last_modified: Optional[str]
+    path: str
+
+
+class HttpCache:
+    """
+    URL -> (ETag, Last-Modified, path) cache persisted in SQLite.
+
+    Args:
+        path (str): Database file, e.g. `downloads/http_cache.sqlite`.
+        max_entries (int, optional): Keep at most this many entries, evicting the least recently used.
+        max_age (float, optional): Drop entries stored more than this many seconds ago.
+        batch_size (int, optional): Number of updates committed at once. Defaults to 100.
+    """  # noqa: E501
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: Optional[int] = None,
+        max_age: Optional[float] = None,
+        batch_size: int = 100,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self._pending_writes = 0
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # Соединение используется и из пула потоков, доступ защищен блокировкой
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            ' url TEXT PRIMARY KEY,'
+            ' etag TEXT,'
+            ' last_modified TEXT,'
+            ' path TEXT NOT NULL,'
+            ' stored REAL NOT NULL,'
+            ' used REAL NOT NULL)',
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+        self._db.commit()
+        self.evict()
+
+    def lookup(self, url: str) -> Optional[CacheEntry]:
+        """Return the entry of a URL if it is fresh enough and its file still exists."""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT etag, last_modified, path, stored FROM entries WHERE url = ?',
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, path, stored = row
+        if self.max_age is not None and time.time() - stored > self.max_age:
+            return None
+        if not stored_exists(path):
+            return None
+        return CacheEntry(etag, last_modified, path)
+
+    @staticmethod
+    def conditional_headers(entry: Optional[CacheEntry]) -> Dict[str, str]:
+        """Build `If-None-Match`/`If-Modified-Since` headers for a cached entry."""
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def hit(self, url: str) -> None:
+        """Account a `304 Not Modified` answer and mark the entry as recently used."""
+        with self._lock:
+            self.hits += 1
+            self._db.execute(
+                'UPDATE entries SET used = ? WHERE url = ?', (time.time(), url),
+            )
+            self._written()
+
+    def update(
+        self,
+        url: str,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        path: str,
+    ) -> None:
+        """Account a full download and remember its validators, if the server sent any."""
+        with self._lock:
+            self.misses += 1
+            if not etag and not last_modified:
+                # Без валидаторов проверить свежесть нельзя: старая запись больше не нужна
+                self._db.execute('DELETE FROM entries WHERE url = ?', (url,))
+                self._written()
+                return
+            now = time.time()
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries'
+                ' (url, etag, last_modified, path, stored, used)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (url, etag, last_modified, path, now, now),
+            )
+            self._written()
+
+    def _written(self) -> None:
+        self._pending_writes += 1
+        if self._pending_writes >= self.batch_size:
+            self._commit()
+
+    def _commit(self) -> None:
+        self._db.commit()
+        self._pending_writes = 0
+
+    def evict(self) -> int:
+        """Remove expired entries and trim the cache to `max_entries`; returns the count removed."""  # noqa: E501
+        removed = 0
+        with self._lock:
+            if self.max_age is not None:
+                cursor = self._db.execute(
+                    'DELETE FROM entries WHERE stored < ?', (time.time() - self.max_age,),
+                )
+                removed += cursor.rowcount
+            if self.max_entries is not None:
+                # Вытесняем давно не использованные записи
+                cursor = self._db.execute(
+                    'DELETE FROM entries WHERE url NOT IN'
+                    ' (SELECT url FROM entries ORDER BY used DESC LIMIT ?)',
+                    (self.max_entries,),
+                )
+                removed += cursor.rowcount
+            self._commit()
+        return removed
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def flush(self) -> None:
+        """Apply eviction limits and commit pending updates."""
+        self.evict()
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+    def log_stats(self) -> None:
+        logging.info(
+            f'HTTP cache | hits {self.hits} | misses {self.misses} | '
+            f'hit ratio {self.hit_ratio():.0%}',
+        )
@@ -0,0 +1,154 @@
+"""
+This module provides deadlines and hedged requests that bound the tail latency of a run.
+
+It includes:
+- The `DeadlinePolicy` class limiting how long one URL, including its retries, and the
+  whole run may take.
+- The `Hedger` class deciding when a slow request gets a duplicate and capping the extra
+  load hedging adds.
+- The `check_deadline` function failing a download whose deadline has passed.
+
+Deadlines are absolute `time.monotonic()` values, so they are shared by the attempts of a
+URL and by the asyncio and threaded code alike.
+"""  # noqa: E501
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+from utils import DownloadError
+
+
+@dataclass(frozen=True)
+class DeadlinePolicy:
+    """
+    Time limits of a download run.
+
+    Attributes:
+        request (float, optional): Seconds one URL may take, including retries and the waits between them.
+        job (float, optional): Seconds the whole run may take; running URLs are cut off and the rest fail without a request.
+    """  # noqa: E501
+    request: Optional[float] = None
+    job: Optional[float] = None
+
+    def job_end(self) -> Optional[float]:
+        """Return the monotonic time the run must end by; call once when it starts."""
+        return time.monotonic() + self.job if self.job is not None else None
+
+    def url_end(self, job_end: Optional[float]) -> Optional[float]:
+        """Return the monotonic time a URL starting now must end by."""
+        ends = [] if job_end is None else [job_end]
+        if self.request is not None:
+            ends.append(time.monotonic() + self.request)
+        return min(ends) if ends else None
+
+
+def check_deadline(url: str, deadline: Optional[float]) -> None:
+    """Raise `DownloadError` if the deadline of the URL has passed."""
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DownloadError(url, 'Deadline exceeded')
+
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left before the deadline, never negative; `None` without a deadline."""
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+class Hedger:
+    """
+    Hedged requests: a request without a response after the usual time gets a duplicate.
+
+    The delay is a percentile of the latest times to the response headers, so only the
+    slowest requests are hedged; the first response wins and the other request is
+    cancelled. Hedging starts once enough times are observed and stops while the
+    duplicates exceed `max_extra` of all requests.
+
+    Args:
+        percentile (float): Percentile of observed times after which a request is hedged.
+        max_extra (float): Maximum duplicates as a fraction of all requests.
+        min_delay (float): Never hedge a request younger than this many seconds.
+        min_samples (int): Observed requests needed before hedging starts.
+        window (int): Number of the latest times the percentile is taken over.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        max_extra: float = 0.05,
+        min_delay: float = 0.05,
+        min_samples: int = 20,
+        window: int = 1000,
+    ):
+        self.percentile = percentile
+        self.max_extra = max_extra
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.requests = 0
+        self.hedged = 0
+        self.wins = 0
+        self._samples = deque(maxlen=window)
+        self._sorted = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # В процесс-воркер передаются только настройки, наблюдения у него свои
+        return {
+            'percentile': self.percentile, 'max_extra': self.max_extra,
+            'min_delay': self.min_delay, 'min_samples': self.min_samples,
+            'window': self.window,
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def record(self, seconds: float) -> None:
+        """Account a request and the time its first response took."""
+        with self._lock:
+            self.requests += 1
+            if len(self._samples) == self.window:
+                # Самое старое наблюдение вытесняется из окна
+                oldest = self._samples[0]
+                del self._sorted[bisect.bisect_left(self._sorted, oldest)]
+            self._samples.append(seconds)
+            bisect.insort(self._sorted, seconds)
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging a request, `None` while too few are observed."""
+        with self._lock:
+            if len(self._sorted) < self.min_samples:
+                return None
+            count = len(self._sorted)
+            rank = min(count - 1, int(count * self.percentile / 100))
+            return max(self.min_delay, self._sorted[rank])
+
+    def try_hedge(self) -> bool:
+        """Take a duplicate from the budget; `False` if it is spent."""
+        with self._lock:
+            if self.hedged + 1 > self.max_extra * max(self.requests, 1):
+                return False
+            self.hedged += 1
+            return True
+
+    def won(self) -> None:
+        """Account a duplicate that answered before the original request."""
+        with self._lock:
+            self.wins += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'requests': self.requests, 'hedged': self.hedged, 'wins': self.wins}
+
+    def log_stats(self) -> None:
+        stats = self.stats()
+        delay = self.delay()
+        logging.info(
+            f'Hedging | requests {stats["requests"]} | hedged {stats["hedged"]} | '
+            f'won {stats["wins"]} | delay '
+            f'{"-" if delay is None else f"{delay * 1000:.0f} ms"}',
+        )
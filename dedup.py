@@ -0,0 +1,242 @@
+"""
+This module provides URL normalization and the deduplication of inputs before scheduling.
+
+It includes:
+- The `normalize_url` function mapping trivially equivalent URLs to one key.
+- The `BloomFilter` class: a memory-bounded set with false positives but no false negatives.
+- The `Deduplicator` class letting only the first input of every key be downloaded and
+  answering the duplicates with the result of that download.
+
+A duplicate keeps its own position in the results, so `main` still returns one entry per
+input. By default the keys and results of a run are kept in memory; with a `path` only a
+Bloom filter is, and the exact keys and results live in a scratch SQLite table that is
+read only when the filter reports a key as seen.
+"""  # noqa: E501
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlsplit, urlunsplit
+
+from utils import DownloadError
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Ответ claim(): дубликат ждет, пока скачается первый URL с тем же ключом
+PENDING = object()
+
+
+def normalize_url(url: str) -> str:
+    """
+    Return the key of a URL: URLs with the same key are downloaded once.
+
+    The scheme and host are lower-cased, the default port and the fragment are dropped,
+    an empty path becomes '/' and query parameters are sorted by name (repeated names
+    keep their order). Paths and values are compared as they are.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        # Некорректный порт: такой URL сравнивается как есть
+        return url
+    host = (parts.hostname or '').lower()
+    netloc = f'[{host}]' if ':' in host else host
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        netloc = f'{netloc}:{port}'
+    if '@' in parts.netloc:
+        netloc = f'{parts.netloc.rsplit("@", 1)[0]}@{netloc}'
+    params = [param for param in parts.query.split('&') if param]
+    query = '&'.join(sorted(params, key=lambda param: param.split('=', 1)[0]))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+class BloomFilter:
+    """
+    Set of strings in a fixed bit array: `in` may be wrong for a new key, never for an added one.
+
+    Args:
+        capacity (int): Number of keys the false positive rate is sized for; more keys are allowed but raise it.
+        error_rate (float): False positive rate at `capacity` keys.
+    """  # noqa: E501
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str) -> List[int]:
+        # Двойное хеширование: k позиций из двух независимых 64-битных хешей
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + n * second) % self.size for n in range(self.hashes)]
+
+    def add(self, key: str) -> bool:
+        """Add a key; returns whether it may have been added before."""
+        seen = True
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self._bits[byte] & (1 << bit):
+                seen = False
+                self._bits[byte] |= 1 << bit
+        return seen
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self._bits[position // 8] & (1 << position % 8)
+            for position in self._positions(key)
+        )
+
+    def clear(self) -> None:
+        self._bits = bytearray(len(self._bits))
+
+
+class Deduplicator:
+    """
+    In-batch deduplication of URLs by their normalized key.
+
+    The pipelines call `claim` for every input before scheduling it and `resolve` for
+    every result of a first input. Both are called from the single thread that
+    schedules URLs, so the class takes no locks.
+
+    Args:
+        path (str, optional): Scratch SQLite file for the keys and results; only a Bloom filter stays in memory. Defaults to keeping everything in memory.
+        capacity (int, optional): Expected number of distinct URLs the Bloom filter is sized for. Defaults to 1,000,000.
+        error_rate (float, optional): Bloom filter false positive rate; a false positive costs one SQLite lookup, never a URL.
+        normalize (Callable[[str], str], optional): Function mapping a URL to its key. Defaults to `normalize_url`.
+    """  # noqa: E501
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        capacity: int = 1_000_000,
+        error_rate: float = 0.001,
+        normalize: Callable[[str], str] = normalize_url,
+    ):
+        self.path = path
+        self.normalize = normalize
+        self.inputs = 0
+        self.duplicates = 0
+        # Дубликаты, чей первый URL еще скачивается: ключ -> [(позиция, URL)]
+        self._waiting: Dict[str, List[Tuple[int, str]]] = {}
+        # В памяти: ключ -> [позиция первого URL, результат или PENDING]
+        self._seen: Dict[str, list] = {}
+        self._bloom = None
+        self._db = None
+        if path is not None:
+            self._bloom = BloomFilter(capacity, error_rate)
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            # Таблица нужна только на время прогона: журнал и fsync не нужны
+            self._db = sqlite3.connect(path, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=OFF')
+            self._db.execute('PRAGMA synchronous=OFF')
+        self.begin()
+
+    def begin(self) -> None:
+        """Forget the previous run; called by the pipelines when a run starts."""
+        self.inputs = 0
+        self.duplicates = 0
+        self._waiting.clear()
+        self._seen.clear()
+        if self._db is not None:
+            self._bloom.clear()
+            self._db.execute('DROP TABLE IF EXISTS seen')
+            self._db.execute(
+                'CREATE TABLE seen ('
+                ' key TEXT PRIMARY KEY,'
+                ' position INTEGER NOT NULL,'
+                ' done INTEGER NOT NULL DEFAULT 0,'
+                ' path TEXT,'
+                ' error TEXT,'
+                ' status INTEGER)',
+            )
+
+    def claim(self, index: int, url: str) -> Union[None, object, str, Exception]:
+        """
+        Register the input at position `index`.
+
+        Returns:
+            `None` if the URL must be downloaded, `PENDING` if it duplicates a URL still in work (it is then returned by `resolve`), or the path or error of the URL it duplicates.
+        """  # noqa: E501
+        self.inputs += 1
+        key = self.normalize(url)
+        if self._db is None:
+            entry = self._seen.get(key)
+            if entry is None:
+                self._seen[key] = [index, PENDING]
+                return None
+            result = entry[1]
+        else:
+            row = None
+            # Отрицательный ответ фильтра точен: SQLite читается только для «видели»
+            if self._bloom.add(key):
+                row = self._db.execute(
+                    'SELECT done, path, error, status FROM seen WHERE key = ?', (key,),
+                ).fetchone()
+            if row is None:
+                self._db.execute(
+                    'INSERT INTO seen (key, position) VALUES (?, ?)', (key, index),
+                )
+                return None
+            result = PENDING if not row[0] else self._from_row(url, *row[1:])
+        self.duplicates += 1
+        if result is PENDING:
+            self._waiting.setdefault(key, []).append((index, url))
+        return result
+
+    def resolve(
+        self, index: int, url: str, result: Union[str, Exception],
+    ) -> List[Tuple[int, str, Union[str, Exception]]]:
+        """
+        Record the result of an input and return the duplicates waiting for it.
+
+        Results of duplicates themselves are ignored, so every result can be passed.
+        """
+        key = self.normalize(url)
+        if self._db is None:
+            entry = self._seen.get(key)
+            if entry is None or entry[0] != index:
+                return []
+            entry[1] = result
+        else:
+            row = self._db.execute(
+                'SELECT position FROM seen WHERE key = ?', (key,),
+            ).fetchone()
+            if row is None or row[0] != index:
+                return []
+            error = str(result) or repr(result) if isinstance(result, Exception) else None
+            self._db.execute(
+                'UPDATE seen SET done = 1, path = ?, error = ?, status = ? WHERE key = ?',
+                (
+                    None if error is not None else result, error,
+                    getattr(result, 'status', None), key,
+                ),
+            )
+        waiting = self._waiting.pop(key, [])
+        return [(position, duplicate, result) for position, duplicate in waiting]
+
+    @staticmethod
+    def _from_row(
+        url: str, path: Optional[str], error: Optional[str], status: Optional[int],
+    ) -> Union[str, Exception]:
+        # Ошибка восстанавливается из SQLite без исходного типа
+        return path if error is None else DownloadError(url, error, status)
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+
+    def log_stats(self) -> None:
+        share = self.duplicates / self.inputs * 100 if self.inputs else 0.0
+        logging.info(
+            f'Deduplication | inputs {self.inputs} | '
+            f'duplicates {self.duplicates} ({share:.1f}%)',
+        )
@@ -0,0 +1,145 @@
+"""
+This module provides the image formats the downloaders accept and how they are recognized.
+
+It includes:
+- The `ImageFormat` class describing a format: its extension, MIME types and magic bytes.
+- The `FormatRegistry` class checking response headers, detecting the real format from the
+  first bytes of the body and enforcing a maximum body size.
+- The `parse_content_type` function normalizing a `Content-Type` header.
+
+The first bytes decide: a body labeled `image/png` that starts like a JPEG is saved as
+`.jpg`, an HTML error page labeled `image/jpeg` is rejected, and an image sent as
+`application/octet-stream` is accepted. Bodies are rejected after their first chunk, so a
+non-image is never downloaded in full.
+"""  # noqa: E501
+import re
+from dataclasses import dataclass, field
+from typing import Iterable, Optional, Tuple
+
+from utils import DownloadError
+
+# Сколько первых байт тела нужно, чтобы распознать любой формат из таблицы
+SNIFF_SIZE = 32
+
+# Типы, которыми серверы помечают любые двоичные данные: формат решают первые байты
+GENERIC_TYPES = frozenset({
+    'application/octet-stream',
+    'binary/octet-stream',
+    'application/binary',
+    'application/unknown',
+})
+
+
+@dataclass(frozen=True)
+class ImageFormat:
+    """
+    An image format the downloaders accept.
+
+    Attributes:
+        extension (str): File extension the body is stored with, without the dot.
+        mime_types (Tuple[str, ...]): Lower-case MIME types servers label the format with.
+        magic (bytes): Regular expression the first bytes of the body must match.
+    """
+    extension: str
+    mime_types: Tuple[str, ...]
+    magic: bytes
+    _pattern: re.Pattern = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # В сигнатурах встречаются произвольные байты (размер блока RIFF или ftyp)
+        object.__setattr__(self, '_pattern', re.compile(self.magic, re.DOTALL))
+
+    def matches(self, head: bytes) -> bool:
+        return self._pattern.match(head) is not None
+
+
+DEFAULT_FORMATS = (
+    ImageFormat('jpg', ('image/jpeg', 'image/jpg', 'image/pjpeg'), rb'\xff\xd8\xff'),
+    ImageFormat('png', ('image/png', 'image/x-png'), rb'\x89PNG\r\n\x1a\n'),
+    ImageFormat('gif', ('image/gif',), rb'GIF8[79]a'),
+    ImageFormat('webp', ('image/webp',), rb'RIFF.{4}WEBP'),
+    ImageFormat('avif', ('image/avif',), rb'.{4}ftypavi[fs]'),
+    ImageFormat('bmp', ('image/bmp', 'image/x-ms-bmp'), rb'BM'),
+    ImageFormat('tiff', ('image/tiff',), rb'II\*\x00|MM\x00\*'),
+)
+
+
+def parse_content_type(value: Optional[str]) -> Optional[str]:
+    """Return the lower-case MIME type of a `Content-Type` header without parameters."""
+    if not value:
+        return None
+    mime_type = value.split(';', 1)[0].strip().lower()
+    return mime_type or None
+
+
+class FormatRegistry:
+    """
+    Accepted image formats and the maximum body size.
+
+    Args:
+        formats (Iterable[ImageFormat], optional): Accepted formats. Defaults to `DEFAULT_FORMATS`.
+        max_size (int, optional): Bodies larger than this many bytes are rejected, from `Content-Length` or while streaming.
+        generic_types (Iterable[str], optional): MIME types whose bodies are accepted if their bytes are a known format.
+    """  # noqa: E501
+
+    def __init__(
+        self,
+        formats: Iterable[ImageFormat] = DEFAULT_FORMATS,
+        max_size: Optional[int] = None,
+        generic_types: Iterable[str] = GENERIC_TYPES,
+    ):
+        self.formats = []
+        self.max_size = max_size
+        self.generic_types = frozenset(generic_types)
+        self._by_type = {}
+        for image_format in formats:
+            self.register(image_format)
+
+    def register(self, image_format: ImageFormat) -> None:
+        """Accept one more format; a format registered later wins its MIME types."""
+        self.formats.append(image_format)
+        for mime_type in image_format.mime_types:
+            self._by_type[mime_type] = image_format
+
+    def by_content_type(self, content_type: Optional[str]) -> Optional[ImageFormat]:
+        return self._by_type.get(parse_content_type(content_type))
+
+    def sniff(self, head: bytes) -> Optional[ImageFormat]:
+        """Return the format the first bytes of a body belong to, if it is accepted."""
+        for image_format in self.formats:
+            if image_format.matches(head):
+                return image_format
+        return None
+
+    def check_headers(
+        self, url: str, content_type: Optional[str], size: Optional[int],
+    ) -> None:
+        """
+        Reject a response by its headers, before any of the body is read.
+
+        Raises:
+            DownloadError: If the type is neither accepted nor generic, or the body is too large.
+        """  # noqa: E501
+        mime_type = parse_content_type(content_type)
+        known = mime_type in self._by_type or mime_type in self.generic_types
+        if mime_type is not None and not known:
+            raise DownloadError(url, f'Unsupported Content-Type: {content_type}')
+        self.check_size(url, size)
+
+    def check_size(self, url: str, size: Optional[int]) -> None:
+        if self.max_size is not None and size is not None and size > self.max_size:
+            raise DownloadError(url, f'Body of {size} bytes exceeds {self.max_size}')
+
+    def detect(self, url: str, content_type: Optional[str], head: bytes) -> str:
+        """
+        Return the extension of the format the first bytes of the body belong to.
+
+        Raises:
+            DownloadError: If the bytes do not start any accepted format.
+        """
+        image_format = self.sniff(head)
+        if image_format is None:
+            raise DownloadError(
+                url, f'Body is not a supported image (Content-Type: {content_type})',
+            )
+        return image_format.extension
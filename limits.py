@@ -0,0 +1,519 @@
+"""
+This module provides per-host throttling shared by both downloaders.
+
+It includes:
+- The `HostLimit` class describing the concurrency and rate limits of a host.
+- The `TokenBucket` class implementing a requests/second limiter.
+- The `HostLimiter` class keeping per-host slots, rate buckets and counters.
+- The `HostScheduler` class handing out pending URLs only for hosts with free capacity.
+- The `AIMDController` class tuning the global concurrency limit at runtime.
+- The `ByteBudget` class bounding the response body bytes in flight across all downloads.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Признак того, что хост упирается в лимит одновременных запросов
+# и освободится только после release, а не через известное время
+AT_CAPACITY = None
+
+# Статусы, которыми сервер сообщает о перегрузке: сигнал снизить параллельность
+OVERLOAD_STATUSES = frozenset({429, 502, 503, 504})
+
+
+@dataclass(frozen=True)
+class HostLimit:
+    """
+    Limits applied to a single host.
+
+    Attributes:
+        max_concurrency (int, optional): Maximum simultaneous requests, `None` for unlimited.
+        rate (float, optional): Maximum requests per second, `None` for unlimited.
+        burst (int, optional): Requests allowed back to back. Defaults to `max(1, rate)`.
+    """  # noqa: E501
+    max_concurrency: Optional[int] = None
+    rate: Optional[float] = None
+    burst: Optional[int] = None
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def try_take(self) -> float:
+        """Take a token and return 0, or return the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class _HostState:
+    __slots__ = ('limit', 'bucket', 'active', 'started', 'completed', 'throttled')
+
+    def __init__(self, limit: HostLimit):
+        self.limit = limit
+        self.bucket = TokenBucket(limit.rate, limit.burst) if limit.rate else None
+        self.active = 0
+        self.started = 0
+        self.completed = 0
+        self.throttled = 0
+
+
+class HostLimiter:
+    """
+    Thread-safe per-host concurrency slots and token buckets with monitoring counters.
+
+    Args:
+        default (HostLimit, optional): Limits for hosts without their own entry. Defaults to unlimited.
+        hosts (Dict[str, HostLimit], optional): Limits for specific hosts.
+    """  # noqa: E501
+
+    def __init__(
+        self,
+        default: Optional[HostLimit] = None,
+        hosts: Optional[Dict[str, HostLimit]] = None,
+    ):
+        self.default = default or HostLimit()
+        self.hosts = hosts or {}
+        self._states: Dict[str, _HostState] = {}
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._listeners: Dict[int, Callable[[], None]] = {}
+
+    def _state(self, host: str) -> _HostState:
+        state = self._states.get(host)
+        if state is None:
+            state = self._states[host] = _HostState(self.hosts.get(host, self.default))
+        return state
+
+    def try_acquire(self, host: str) -> Optional[float]:
+        """
+        Take a slot for the host without blocking.
+
+        A refusal is not counted as throttling: callers that go on to wait for the host
+        call `record_throttled` once per request, however often they poll.
+
+        Returns:
+            float, optional: 0 if the slot was taken, seconds until the next rate token,
+            or `AT_CAPACITY` (None) if the host waits for a running request to finish.
+        """
+        with self._lock:
+            state = self._state(host)
+            limit = state.limit
+            at_limit = limit.max_concurrency is not None and (
+                state.active >= limit.max_concurrency
+            )
+            if at_limit:
+                return AT_CAPACITY
+            if state.bucket is not None:
+                delay = state.bucket.try_take()
+                if delay:
+                    return delay
+            state.active += 1
+            state.started += 1
+            return 0.0
+
+    def record_throttled(self, host: str) -> None:
+        """Account a request that has to wait for a slot or a rate token of the host."""
+        with self._lock:
+            self._state(host).throttled += 1
+
+    def release(self, host: str) -> None:
+        """Return the host slot and wake up everyone waiting for capacity."""
+        with self._lock:
+            state = self._state(host)
+            state.active -= 1
+            state.completed += 1
+            self._released.notify_all()
+            listeners = list(self._listeners.values())
+        for listener in listeners:
+            listener()
+
+    def acquire(self, host: str) -> None:
+        """Block the calling thread until a slot for the host is taken."""
+        if (delay := self.try_acquire(host)) != 0:
+            self.record_throttled(host)
+        while delay != 0:
+            with self._lock:
+                self._released.wait(delay)
+            delay = self.try_acquire(host)
+
+    async def acquire_async(self, host: str) -> None:
+        """Wait in the event loop until a slot for the host is taken."""
+        if (delay := self.try_acquire(host)) != 0:
+            self.record_throttled(host)
+        while delay != 0:
+            loop = asyncio.get_running_loop()
+            released = asyncio.Event()
+            key = self.subscribe(lambda: loop.call_soon_threadsafe(released.set))
+            try:
+                await asyncio.wait_for(released.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.unsubscribe(key)
+            delay = self.try_acquire(host)
+
+    def subscribe(self, listener: Callable[[], None]) -> int:
+        """Call `listener` after every release; returns a key for `unsubscribe`."""
+        with self._lock:
+            key = id(listener)
+            self._listeners[key] = listener
+            return key
+
+    def unsubscribe(self, key: int) -> None:
+        with self._lock:
+            self._listeners.pop(key, None)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Return a snapshot of the per-host counters for monitoring."""
+        with self._lock:
+            return {
+                host: {
+                    'active': state.active,
+                    'started': state.started,
+                    'completed': state.completed,
+                    'throttled': state.throttled,
+                }
+                for host, state in self._states.items()
+            }
+
+    def log_stats(self, top: int = 10) -> None:
+        """Log the counters of the busiest hosts."""
+        stats = sorted(self.stats().items(), key=lambda item: -item[1]['started'])
+        for host, counters in stats[:top]:
+            logging.info(
+                f'Host {host} | started {counters["started"]} | '
+                f'completed {counters["completed"]} | throttled {counters["throttled"]}',
+            )
+
+
+class HostScheduler:
+    """
+    Bounded buffer of pending items grouped by host, served round-robin.
+
+    `pop_ready` only returns an item whose host currently has capacity and takes the
+    host slot for it, so one saturated host cannot block work for the others. Every
+    item that has to wait is counted once in the host's `throttled`.
+    Not thread-safe: meant to be driven by a single dispatcher (thread or event loop).
+    """
+
+    def __init__(self, limiter: HostLimiter, max_pending: int):
+        self.limiter = limiter
+        self.max_pending = max_pending
+        self._pending: 'OrderedDict[str, deque]' = OrderedDict()
+        # Хосты, чей первый элемент уже учтен как ожидающий
+        self._throttled = set()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def full(self) -> bool:
+        return self._size >= self.max_pending
+
+    def push(self, host: str, item: Any) -> None:
+        self._pending.setdefault(host, deque()).append(item)
+        self._size += 1
+
+    def pop_ready(self) -> Tuple[Optional[Tuple[str, Any]], Optional[float]]:
+        """
+        Take the next item of the first host (round-robin) that has capacity.
+
+        Returns:
+            Tuple: `((host, item), None)` with the host slot already taken, or
+            `(None, delay)` where delay is the time until a rate-limited host gets
+            a token (`None` if every host is waiting for a release or nothing is pending).
+        """
+        wait = None
+        for host in list(self._pending):
+            delay = self.limiter.try_acquire(host)
+            if delay == 0:
+                self._throttled.discard(host)
+                items = self._pending.pop(host)
+                item = items.popleft()
+                # Хост уходит в конец очереди, чтобы остальные получили свою очередь
+                if items:
+                    self._pending[host] = items
+                self._size -= 1
+                return (host, item), None
+            if host not in self._throttled:
+                self._throttled.add(host)
+                self.limiter.record_throttled(host)
+            if delay is not AT_CAPACITY:
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def pop_any(self) -> Optional[Tuple[str, Any]]:
+        """Take the next item regardless of capacity, without taking a host slot."""
+        if not self._pending:
+            return None
+        host, items = next(iter(self._pending.items()))
+        self._throttled.discard(host)
+        item = items.popleft()
+        if not items:
+            del self._pending[host]
+        self._size -= 1
+        return host, item
+
+
+class AIMDController:
+    """
+    Adaptive concurrency limit: additive increase, multiplicative decrease.
+
+    Every `limit` completed requests form a window. The limit grows by `increase` while
+    throughput holds up and latency stays within `latency_tolerance` of the best window
+    seen, and is multiplied by `decrease` when overload errors or a latency spike appear.
+
+    Args:
+        min_limit (int): Lower bound for the concurrency limit.
+        max_limit (int): Upper bound for the concurrency limit.
+        initial (int, optional): Starting limit. Defaults to the downloader's `max_active_tasks`.
+        increase (int): Step added to the limit after a healthy window.
+        decrease (float): Factor applied to the limit after an overloaded window.
+        latency_tolerance (float): Allowed ratio of window latency to the baseline latency.
+        error_threshold (float): Share of overload errors in a window that triggers a decrease.
+    """  # noqa: E501
+
+    def __init__(
+        self,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        initial: Optional[int] = None,
+        increase: int = 1,
+        decrease: float = 0.5,
+        latency_tolerance: float = 2.0,
+        error_threshold: float = 0.05,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.initial = initial
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.error_threshold = error_threshold
+        self.limit = self._clamp(initial or min_limit)
+        self.history = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self._reset_window()
+        self._baseline_latency = None
+        self._last_throughput = None
+
+    def _clamp(self, limit: int) -> int:
+        return max(self.min_limit, min(self.max_limit, limit))
+
+    def _reset_window(self) -> None:
+        self._window_start = time.monotonic()
+        self._samples = 0
+        self._errors = 0
+        self._latency_sum = 0.0
+
+    def begin(self, max_active_tasks: int) -> None:
+        """Start a run with `max_active_tasks` as the limit unless `initial` was given."""
+        with self._lock:
+            self.limit = self._clamp(self.initial or max_active_tasks)
+            self.history.append((time.time(), self.limit))
+            self._reset_window()
+
+    def record(self, latency: float, overloaded: bool = False) -> None:
+        """Account one finished request and adjust the limit at the end of a window."""
+        with self._lock:
+            self._samples += 1
+            self._errors += overloaded
+            self._latency_sum += latency
+            if self._samples >= self.limit:
+                self._adjust()
+
+    def _adjust(self) -> None:
+        elapsed = max(time.monotonic() - self._window_start, 1e-6)
+        throughput = self._samples / elapsed
+        latency = self._latency_sum / self._samples
+        error_rate = self._errors / self._samples
+        if self._baseline_latency is None or latency < self._baseline_latency:
+            self._baseline_latency = latency
+
+        old_limit = self.limit
+        spike = latency > self._baseline_latency * self.latency_tolerance
+        if error_rate > self.error_threshold or spike:
+            self.limit = self._clamp(int(self.limit * self.decrease))
+        elif self._last_throughput is None or throughput >= self._last_throughput * 0.9:
+            self.limit = self._clamp(self.limit + self.increase)
+
+        if self.limit != old_limit:
+            self.history.append((time.time(), self.limit))
+            logging.info(
+                f'Adaptive concurrency {old_limit} -> {self.limit} | '
+                f'{throughput:.1f} req/s | latency {latency:.3f}s | '
+                f'errors {error_rate:.0%}',
+            )
+        self._last_throughput = throughput
+        self._reset_window()
+
+    def log_summary(self) -> None:
+        logging.info(
+            f'Adaptive concurrency settled at {self.limit} '
+            f'(bounds {self.min_limit}..{self.max_limit}, {len(self.history)} changes)',
+        )
+
+
+class ByteBudget:
+    """
+    Global budget of response body bytes in flight, shared by threads and event loops.
+
+    A body reserves its `Content-Length` before it is read, or `step` bytes at a time
+    while it streams if the length is unknown; once the budget is used up, body reads
+    wait for other downloads to release their bytes. A body larger than the whole budget
+    still proceeds, alone. When every holder waits to grow, one of them is let through
+    over the limit, so bodies of unknown length never deadlock each other.
+
+    Args:
+        limit (int): Bytes all bodies in flight may reserve together.
+        step (int, optional): Reservation increment of a body without `Content-Length`. Defaults to 1 MiB.
+    """  # noqa: E501
+
+    def __init__(self, limit: int, step: int = 1024 * 1024):
+        self.limit = limit
+        self.step = step
+        self.used = 0
+        self.peak = 0
+        self.waits = 0
+        # Байты тел, ждущих роста резерва: если это все занятое, кто-то должен пройти
+        self._stalled = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._listeners: Dict[int, Callable[[], None]] = {}
+
+    def _try(self, size: int, held: int, waiting: bool) -> bool:
+        stalled = self._stalled if waiting else self._stalled + held
+        fits = self.used + size <= self.limit
+        if not (fits or self.used == held or (held and stalled == self.used)):
+            return False
+        self.used += size
+        self.peak = max(self.peak, self.used)
+        return True
+
+    def _notify(self) -> None:
+        # Вызывается под блокировкой: слушатели только планируют пробуждение
+        self._changed.notify_all()
+        for listener in self._listeners.values():
+            listener()
+
+    def _wait_begin(self, held: int) -> None:
+        self.waits += 1
+        self._stalled += held
+        # Новый ждущий может сделать застрявшими всех держателей бюджета
+        self._notify()
+
+    def try_reserve(self, size: int, held: int = 0) -> bool:
+        """Reserve `size` more bytes for a body holding `held` bytes without blocking."""
+        with self._lock:
+            return self._try(size, held, waiting=False)
+
+    def reserve(self, size: int, held: int = 0, timeout: Optional[float] = None) -> bool:
+        """Block the thread until `size` bytes are reserved; `False` on timeout."""
+        end = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            if self._try(size, held, waiting=False):
+                return True
+            self._wait_begin(held)
+            try:
+                while not self._try(size, held, waiting=True):
+                    left = end - time.monotonic() if end is not None else None
+                    if left is not None and left <= 0:
+                        return False
+                    self._changed.wait(left)
+                return True
+            finally:
+                self._stalled -= held
+
+    async def reserve_async(self, size: int, held: int = 0) -> None:
+        """Wait in the event loop until `size` bytes are reserved."""
+        if self.try_reserve(size, held):
+            return
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        with self._lock:
+            key = id(changed)
+            self._listeners[key] = lambda: loop.call_soon_threadsafe(changed.set)
+            self._wait_begin(held)
+        try:
+            while True:
+                with self._lock:
+                    if self._try(size, held, waiting=True):
+                        return
+                    # Сброс под блокировкой: пробуждение после него не потеряется
+                    changed.clear()
+                await changed.wait()
+        finally:
+            with self._lock:
+                self._stalled -= held
+                self._listeners.pop(key, None)
+
+    def release(self, size: int) -> None:
+        """Return bytes of a finished body and wake up the waiting reads."""
+        with self._lock:
+            self.used -= size
+            self._notify()
+
+    def reservation(self, length: Optional[int]) -> 'BodyReservation':
+        """Start accounting one body of `length` bytes, `None` if unknown."""
+        return BodyReservation(self, length)
+
+    def __str__(self) -> str:
+        return f'{self.used / 1024 / 1024:.1f} / {self.limit / 1024 / 1024:.1f} MB'
+
+    def log_stats(self) -> None:
+        logging.info(
+            f'Byte budget | in flight {self} | '
+            f'peak {self.peak / 1024 / 1024:.1f} MB | waits {self.waits}',
+        )
+
+
+class BodyReservation:
+    """Bytes of a `ByteBudget` held by one body; `grow` before reading up to `size` bytes."""  # noqa: E501
+
+    def __init__(self, budget: ByteBudget, length: Optional[int]):
+        self.budget = budget
+        self.length = length
+        self.held = 0
+
+    def _more(self, size: int) -> int:
+        if self.held and size <= self.held:
+            return 0
+        # Без Content-Length резерв растет шагами, а не на каждый чанк
+        step = self.budget.step if self.length is None else 0
+        return max(size - self.held, step)
+
+    def grow(self, size: int, timeout: Optional[float] = None) -> bool:
+        """Hold at least `size` bytes, blocking the thread; `False` on timeout."""
+        more = self._more(size)
+        if more and not self.budget.reserve(more, self.held, timeout):
+            return False
+        self.held += more
+        return True
+
+    async def grow_async(self, size: int) -> None:
+        """Hold at least `size` bytes, waiting in the event loop."""
+        more = self._more(size)
+        if more:
+            await self.budget.reserve_async(more, self.held)
+        self.held += more
+
+    def release(self) -> None:
+        """Return every held byte; safe to call more than once."""
+        held, self.held = self.held, 0
+        if held:
+            self.budget.release(held)
@@ -0,0 +1,143 @@
+"""
+This module provides the on-disk job manifest that makes long downloads resumable.
+
+It includes:
+- The `Manifest` class recording per-URL status, output path, size and error in SQLite.
+
+Completed URLs are buffered and written in batches, so the manifest costs one commit per
+`batch_size` downloads instead of one per URL. After a crash at most the last unflushed
+batch is downloaded again; with deterministic file names it overwrites the same files.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple, Union
+
+from storage import stored_exists, stored_size
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Manifest:
+    """
+    Persistent per-URL job state stored in a SQLite database.
+
+    Args:
+        path (str): Database file, usually `<folder>/manifest.sqlite`.
+        batch_size (int, optional): Number of buffered updates that triggers a commit. Defaults to 100.
+        flush_interval (float, optional): Maximum seconds an update waits in the buffer. Defaults to 1.
+    """  # noqa: E501
+
+    def __init__(self, path: str, batch_size: int = 100, flush_interval: float = 1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._buffer: List[Tuple] = []
+        self._flushed_at = time.monotonic()
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # Соединение используется и из пула потоков, доступ защищен блокировкой
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # WAL и synchronous=NORMAL: коммит не ждет fsync каждой записи
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS downloads ('
+            ' url TEXT PRIMARY KEY,'
+            ' status TEXT NOT NULL,'
+            ' path TEXT,'
+            ' size INTEGER,'
+            ' error TEXT,'
+            ' attempts INTEGER NOT NULL DEFAULT 0,'
+            ' updated REAL NOT NULL)',
+        )
+        self._db.commit()
+
+    def finished_path(self, url: str) -> Optional[str]:
+        """Return the file of a URL finished in an earlier run, if it still exists."""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT path FROM downloads WHERE url = ? AND status = ?', (url, DONE),
+            ).fetchone()
+        if row is None or not row[0] or not stored_exists(row[0]):
+            return None
+        return row[0]
+
+    def mark_pending(self, url: str) -> None:
+        """Register a URL that has been taken into work."""
+        self._add(('pending', url, PENDING, None, None, None))
+
+    def record(self, url: str, result: Union[str, Exception]) -> None:
+        """Record the final result of a URL: its file path or the error it failed with."""
+        if isinstance(result, Exception):
+            self._add(('result', url, FAILED, None, None, str(result) or repr(result)))
+        else:
+            size = stored_size(result) if stored_exists(result) else None
+            self._add(('result', url, DONE, result, size, None))
+
+    def _add(self, entry: Tuple) -> None:
+        with self._lock:
+            self._buffer.append(entry)
+            due = time.monotonic() - self._flushed_at >= self.flush_interval
+            if len(self._buffer) >= self.batch_size or due:
+                self._flush()
+
+    def flush(self) -> None:
+        """Commit all buffered updates."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        self._flushed_at = time.monotonic()
+        if not self._buffer:
+            return
+        now = time.time()
+        pending = [(url, status, now) for kind, url, status, *_ in self._buffer
+                   if kind == 'pending']
+        results = [(url, status, path, size, error, now)
+                   for kind, url, status, path, size, error in self._buffer
+                   if kind == 'result']
+        self._buffer.clear()
+        with self._db:
+            # Уже известный URL остается в своем статусе до нового результата
+            self._db.executemany(
+                'INSERT OR IGNORE INTO downloads (url, status, updated) VALUES (?, ?, ?)',
+                pending,
+            )
+            self._db.executemany(
+                'INSERT INTO downloads'
+                ' (url, status, path, size, error, attempts, updated)'
+                ' VALUES (?, ?, ?, ?, ?, 1, ?)'
+                ' ON CONFLICT(url) DO UPDATE SET status = excluded.status,'
+                ' path = excluded.path, size = excluded.size, error = excluded.error,'
+                ' attempts = attempts + 1, updated = excluded.updated',
+                results,
+            )
+
+    def counts(self) -> dict:
+        """Return the number of URLs per status."""
+        with self._lock:
+            self._flush()
+            rows = self._db.execute(
+                'SELECT status, COUNT(*) FROM downloads GROUP BY status',
+            ).fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+            self._db.close()
+
+    def log_summary(self) -> None:
+        counts = self.counts()
+        logging.info(
+            f'Manifest {self.path} | done {counts.get(DONE, 0)} | '
+            f'failed {counts.get(FAILED, 0)} | pending {counts.get(PENDING, 0)}',
+        )
@@ -0,0 +1,341 @@
+"""
+This module provides the metrics surface of the downloaders.
+
+It includes:
+- The `Metrics` class, a thread-safe registry of labelled counters, gauges and histograms
+  with a hook API, Prometheus text export (file or local endpoint) and a run summary.
+- The `MeteredStorage` class timing body and disk-write phases of any storage backend.
+
+Phases are recorded as `download_phase_seconds{phase=...}`: `dns`, `connect` and `ttfb`
+come from aiohttp's `TraceConfig` (requests only reports `ttfb`, through its response
+hook), `body` and `write` from `MeteredStorage`.
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import aiohttp
+import requests
+
+from storage import Storage, StorageWriter
+
+# Границы корзин гистограмм в секундах, как у клиентов Prometheus по умолчанию
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    'download_phase_seconds': 'Time spent in each phase of a download.',
+    'download_bytes_total': 'Body bytes written to storage.',
+    'download_responses_total': 'HTTP responses by status code.',
+    'download_errors_total': 'Failed downloads by error type.',
+    'download_files_total': 'Finished downloads by result.',
+    'download_in_flight': 'Downloads currently running.',
+    'download_queue_depth': 'URLs waiting for a worker.',
+    'download_connections_total': 'Requests by connection: newly opened or reused.',
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+Hook = Callable[[str, float, Dict[str, str]], None]
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Thread-safe registry of labelled counters, gauges and histograms.
+
+    Every update is a dictionary lookup and an addition under one lock, cheap enough to
+    stay enabled at thousands of requests per second.
+
+    Args:
+        buckets (Sequence[float], optional): Histogram bucket bounds in seconds.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.started = time.time()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+        self._hooks: List[Hook] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, hook: Hook) -> None:
+        """Call `hook(name, value, labels)` on every update, e.g. to forward to StatsD."""
+        self._hooks.append(hook)
+
+    def _notify(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        for hook in self._hooks:
+            hook(name, value, labels)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+        if self._hooks:
+            self._notify(name, value, labels)
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+        if self._hooks:
+            self._notify(name, value, labels)
+
+    def add(self, name: str, delta: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._gauges.setdefault(name, {})
+            series[key] = value = series.get(key, 0) + delta
+        if self._hooks:
+            self._notify(name, value, labels)
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(self.buckets)
+            histogram.observe(value)
+        if self._hooks:
+            self._notify(name, value, labels)
+
+    def value(self, name: str, **labels: str) -> float:
+        """Return the current value of a counter or gauge series."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.get(name) or self._gauges.get(name) or {}
+            return series.get(key, 0)
+
+    def record_result(self, result) -> None:
+        """Account a finished download: its path or the exception it failed with."""
+        if isinstance(result, Exception):
+            self.inc('download_files_total', result='failed')
+            self.inc('download_errors_total', type=type(result).__name__)
+        else:
+            self.inc('download_files_total', result='ok')
+
+    def record_connections(self, new: int, reused: int) -> None:
+        """Account the connection pool statistics of a finished run."""
+        self.inc('download_connections_total', new, kind='new')
+        self.inc('download_connections_total', reused, kind='reused')
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """Build an aiohttp `TraceConfig` recording dns, connect, ttfb and statuses."""
+        trace = aiohttp.TraceConfig(trace_config_ctx_factory=SimpleNamespace)
+
+        async def on_request_start(session, ctx, params) -> None:
+            ctx.start = time.perf_counter()
+            ctx.dns = 0.0
+
+        async def on_dns_start(session, ctx, params) -> None:
+            ctx.dns_start = time.perf_counter()
+
+        async def on_dns_end(session, ctx, params) -> None:
+            ctx.dns = time.perf_counter() - ctx.dns_start
+            self.observe('download_phase_seconds', ctx.dns, phase='dns')
+
+        async def on_connect_start(session, ctx, params) -> None:
+            ctx.connect_start = time.perf_counter()
+
+        async def on_connect_end(session, ctx, params) -> None:
+            # Создание соединения включает резолв, его время уже учтено отдельно
+            elapsed = time.perf_counter() - ctx.connect_start - ctx.dns
+            self.observe('download_phase_seconds', elapsed, phase='connect')
+
+        async def on_request_end(session, ctx, params) -> None:
+            self.observe(
+                'download_phase_seconds', time.perf_counter() - ctx.start, phase='ttfb',
+            )
+            self.inc('download_responses_total', status=str(params.response.status))
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_dns_resolvehost_start.append(on_dns_start)
+        trace.on_dns_resolvehost_end.append(on_dns_end)
+        trace.on_connection_create_start.append(on_connect_start)
+        trace.on_connection_create_end.append(on_connect_end)
+        trace.on_request_end.append(on_request_end)
+        return trace
+
+    def requests_hook(self, response: requests.Response, *args, **kwargs) -> None:
+        """`requests` response hook recording ttfb and status codes."""
+        self.observe(
+            'download_phase_seconds', response.elapsed.total_seconds(), phase='ttfb',
+        )
+        self.inc('download_responses_total', status=str(response.status_code))
+
+    def to_prometheus(self) -> str:
+        """Render every series in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for kind, families in (('counter', self._counters), ('gauge', self._gauges)):
+                for name, series in sorted(families.items()):
+                    lines += _header(name, kind)
+                    for labels, value in sorted(series.items()):
+                        lines.append(f'{name}{_labels(labels)} {value:g}')
+            for name, series in sorted(self._histograms.items()):
+                lines += _header(name, 'histogram')
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    bounds = [*(f'{bound:g}' for bound in histogram.buckets), '+Inf']
+                    for bound, count in zip(bounds, histogram.counts):
+                        cumulative += count
+                        bucket_labels = _labels(labels + (('le', bound),))
+                        lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+                    lines.append(f'{name}_sum{_labels(labels)} {histogram.sum:g}')
+                    lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str) -> None:
+        """Atomically write the text format to `path`, e.g. for node_exporter's textfile collector."""  # noqa: E501
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+        """Expose `/metrics` on a local endpoint from a daemon thread; `shutdown()` stops it."""  # noqa: E501
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def summary(self) -> dict:
+        """Return the run totals and mean phase timings."""
+        with self._lock:
+            files = self._counters.get('download_files_total', {})
+            phases = self._histograms.get('download_phase_seconds', {})
+            return {
+                'seconds': round(time.time() - self.started, 3),
+                'ok': files.get((('result', 'ok'),), 0),
+                'failed': files.get((('result', 'failed'),), 0),
+                'bytes': self._counters.get('download_bytes_total', {}).get((), 0),
+                'statuses': {
+                    dict(labels)['status']: value for labels, value in
+                    self._counters.get('download_responses_total', {}).items()
+                },
+                'errors': {
+                    dict(labels)['type']: value for labels, value in
+                    self._counters.get('download_errors_total', {}).items()
+                },
+                'phase_mean_ms': {
+                    dict(labels)['phase']: round(h.sum / h.count * 1000, 2)
+                    for labels, h in phases.items() if h.count
+                },
+            }
+
+    def log_summary(self) -> None:
+        summary = self.summary()
+        logging.info(
+            f'Metrics | ok {summary["ok"]} | failed {summary["failed"]} | '
+            f'{summary["bytes"] / 1024 / 1024:.1f} MB in {summary["seconds"]}s | '
+            f'statuses {summary["statuses"]} | errors {summary["errors"]} | '
+            f'phase mean ms {summary["phase_mean_ms"]}',
+        )
+
+
+def _header(name: str, kind: str) -> List[str]:
+    return [f'# HELP {name} {HELP.get(name, name)}', f'# TYPE {name} {kind}']
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _MeteredWriter:
+    """Storage writer wrapper counting bytes and timing the body and write phases."""
+
+    def __init__(self, writer: StorageWriter, metrics: Metrics):
+        self.writer = writer
+        self.metrics = metrics
+        self.opened = time.perf_counter()
+        self.write_time = 0.0
+        self.written = 0
+
+    def write(self, chunk: bytes) -> None:
+        start = time.perf_counter()
+        self.writer.write(chunk)
+        self.write_time += time.perf_counter() - start
+        self.written += len(chunk)
+
+    def commit(self) -> str:
+        path = self.writer.commit()
+        # Одно наблюдение на файл, а не на каждый кусок тела
+        metrics = self.metrics
+        metrics.observe(
+            'download_phase_seconds', time.perf_counter() - self.opened, phase='body',
+        )
+        metrics.observe('download_phase_seconds', self.write_time, phase='write')
+        metrics.inc('download_bytes_total', self.written)
+        return path
+
+    def abort(self) -> None:
+        self.writer.abort()
+
+
+class MeteredStorage:
+    """
+    Storage backend wrapper recording body time, disk-write time and bytes per file.
+
+    Args:
+        storage (Storage): The backend to wrap.
+        metrics (Metrics): Registry the measurements go to.
+    """
+
+    def __init__(self, storage: Storage, metrics: Metrics):
+        self.storage = storage
+        self.metrics = metrics
+        # adopt есть у обертки, только если его поддерживает само хранилище
+        if hasattr(storage, 'adopt'):
+            self.adopt = self._adopt
+
+    def open(
+        self, url: str, extension: str, size: Optional[int] = None,
+    ) -> _MeteredWriter:
+        return _MeteredWriter(self.storage.open(url, extension, size), self.metrics)
+
+    def _adopt(self, url: str, extension: str, path: str) -> str:
+        self.metrics.inc('download_bytes_total', os.path.getsize(path))
+        return self.storage.adopt(url, extension, path)
+
+    def close(self) -> None:
+        self.storage.close()
@@ -0,0 +1,474 @@
+"""
+This module provides functionality to download images with several worker processes.
+
+It includes:
+- The `download_as_completed` generator yielding results with their input position.
+- The `download_stream` generator yielding results as downloads finish.
+- The `main` function to handle the download process for multiple URLs.
+
+Every worker process runs its own event loop, aiohttp session and semaphore (the async
+downloader), so TLS handshakes and response parsing use all CPU cores instead of one.
+The parent shards the URL stream over the workers in small batches and collects results,
+progress and errors from them. Both directions use plain pipes read from the event loop
+and the parent's `wait()`, so no URL or result goes through an extra thread.
+"""
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import pickle
+import time
+import zlib
+from collections import Counter as TypeCounter
+from contextlib import suppress
+from dataclasses import replace
+from multiprocessing.connection import Connection, wait
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
+
+from async_download import _iter_results
+from deadlines import DeadlinePolicy, Hedger
+from dedup import PENDING, Deduplicator
+from formats import FormatRegistry
+from limits import HostLimiter
+from manifest import Manifest
+from pool import PoolConfig
+from ranges import RangePolicy
+from retry import RetryPolicy
+from storage import FileStorage
+from utils import (CHUNK_SIZE, QUEUE_SIZE_FACTOR, DownloadError, SharedProgress,
+                   UrlSource, iter_urls, setup_logging, url_host)
+
+# Сколько URL родитель отправляет воркеру за одну операцию с очередью
+BATCH_SIZE = 16
+
+
+def _portable(url: str, result: Union[str, Exception]) -> Union[str, Exception]:
+    """Return the result itself if it survives pickling, otherwise an equivalent `DownloadError`."""  # noqa: E501
+    if not isinstance(result, Exception):
+        return result
+    try:
+        pickle.loads(pickle.dumps(result))
+        return result
+    except Exception:
+        # Часть ошибок aiohttp не восстанавливается из pickle
+        return DownloadError(url, f'{type(result).__name__}: {result}')
+
+
+async def _readable(connection: Connection) -> None:
+    """Wait until the pipe has data without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    loop.add_reader(connection.fileno(), lambda: ready.done() or ready.set_result(None))
+    try:
+        await ready
+    finally:
+        # Читатель снимается сразу: иначе непрочитанный пайп будил бы цикл постоянно
+        loop.remove_reader(connection.fileno())
+
+
+async def _inbox_urls(inbox: Connection, indices: Dict[int, int]) -> AsyncIterator[str]:
+    """Yield URLs the parent sends to this worker, remembering their global indices."""
+    local_index = 0
+    while True:
+        if not inbox.poll():
+            await _readable(inbox)
+        batch = inbox.recv()
+        if batch is None:
+            return
+        for index, url in batch:
+            indices[local_index] = index
+            local_index += 1
+            yield url
+
+
+def _work(
+    slot: int,
+    inbox: Connection,
+    outbox: Connection,
+    progress: SharedProgress,
+    log_level: Optional[int],
+    options: dict,
+) -> None:
+    """Worker process: download every URL from `inbox` and send results to `outbox`."""
+    if log_level is None:
+        logging.disable(logging.CRITICAL)
+    else:
+        setup_logging()
+        logging.getLogger().setLevel(log_level)
+
+    host_limiter = None
+    if options['host_limits'] is not None:
+        # Блокировки лимитера не передаются между процессами, собираем его заново
+        host_limiter = HostLimiter(*options['host_limits'])
+    deadlines = options['deadlines']
+    if deadlines is not None and deadlines.job is not None:
+        # Дедлайн задания отсчитывается от старта родителя, а не воркера
+        deadlines = replace(deadlines, job=max(0.0, options['job_end'] - time.time()))
+
+    async def run() -> None:
+        loop = asyncio.get_running_loop()
+        indices, ready = {}, []
+
+        def send() -> None:
+            if ready:
+                outbox.send(ready[:])
+                ready.clear()
+
+        results = _iter_results(
+            _inbox_urls(inbox, indices), options['max_active_tasks'],
+            options['cred_json_path'], options['folder'], options['chunk_size'],
+            options['preallocate_file'], options['retry_policy'], host_limiter, None,
+            FileStorage(options['folder'], stable_names=options['stable_names']),
+            None, None, None, options['ranges'], options['pool'], deadlines,
+            options['hedger'], options['formats'], None, None, None,
+            progress.bind(slot),
+        )
+        async for local_index, url, result in results:
+            # Результаты одного оборота цикла уходят родителю одним сообщением
+            if not ready:
+                loop.call_soon(send)
+            # URL родитель помнит сам, поэтому в пайп идет только позиция и результат
+            ready.append((indices.pop(local_index), _portable(url, result)))
+        send()
+
+    try:
+        asyncio.run(run())
+    except BaseException as error:
+        outbox.send([(None, _portable('', error))])
+        raise
+    finally:
+        progress.publish()
+
+
+class _Worker:
+    """Parent-side handle of a worker process and the URLs it has not answered yet."""
+
+    def __init__(self, slot: int, context, progress, log_level, options):
+        self.slot = slot
+        self.pending: Dict[int, str] = {}
+        self.batch: List[Tuple[int, str]] = []
+        child_inbox, self.inbox = context.Pipe(duplex=False)
+        self.outbox, child_outbox = context.Pipe(duplex=False)
+        self.process = context.Process(
+            target=_work, daemon=True,
+            args=(slot, child_inbox, child_outbox, progress, log_level, options),
+        )
+        self.process.start()
+        # Концы воркера закрываем у себя, чтобы его смерть читалась как EOF
+        child_inbox.close()
+        child_outbox.close()
+
+    def assign(self, index: int, url: str) -> None:
+        self.pending[index] = url
+        self.batch.append((index, url))
+        if len(self.batch) >= BATCH_SIZE:
+            self.send()
+
+    def send(self) -> None:
+        if self.batch:
+            # Если воркер умер, его URL завершатся ошибкой при чтении EOF
+            with suppress(OSError):
+                self.inbox.send(self.batch)
+            self.batch = []
+
+    def stop(self) -> None:
+        with suppress(OSError):
+            self.inbox.send(None)
+
+
+def download_as_completed(
+    urls: UrlSource,
+    max_active_tasks: int,
+    cred_json_path: Optional[str] = 'credentials.json',
+    folder: Optional[str] = 'downloads/',
+    processes: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+    preallocate_file: bool = False,
+    retry_policy: Optional[RetryPolicy] = None,
+    host_limiter: Optional[HostLimiter] = None,
+    manifest: Optional[Manifest] = None,
+    ranges: Optional[RangePolicy] = None,
+    pool: Optional[PoolConfig] = None,
+    deadlines: Optional[DeadlinePolicy] = None,
+    hedger: Optional[Hedger] = None,
+    formats: Optional[FormatRegistry] = None,
+    dedup: Optional[Deduplicator] = None,
+) -> Iterator[Tuple[int, str, Union[str, Exception]]]:
+    """
+    Download URLs in worker processes, yielding `(index, url, result)` as they finish.
+
+    `max_active_tasks` is split evenly between the processes. With a `host_limiter` every
+    host is always sent to the same process, so its limits hold across the whole run;
+    without one each batch goes to the least loaded process.
+
+    Args:
+        urls (UrlSource): URLs as an iterable, a file path, or '-' for stdin.
+        max_active_tasks (int): Maximum number of concurrent tasks over all processes.
+        cred_json_path (str, optional): Path to the credentials file. Defaults to 'credentials.json'.
+        folder (str, optional): Folder to save downloaded files. Defaults to 'downloads/'.
+        processes (int, optional): Number of worker processes. Defaults to the number of CPU cores.
+        chunk_size (int, optional): Size of the chunks response bodies are streamed in.
+        preallocate_file (bool, optional): Reserve disk space from `Content-Length` before writing.
+        retry_policy (RetryPolicy, optional): Retry transient failures with backoff. Defaults to no retries.
+        host_limiter (HostLimiter, optional): Per-host concurrency and rate limits, enforced by the process owning the host.
+        manifest (Manifest, optional): Job manifest kept by the parent: finished URLs are skipped and every result is recorded.
+        ranges (RangePolicy, optional): Split large bodies into byte ranges fetched in parallel, resuming partial files.
+        pool (PoolConfig, optional): Connection pool, DNS cache and timeout settings of every worker; pools are sized to its share of tasks.
+        deadlines (DeadlinePolicy, optional): Limits for one URL including its retries and for the whole run, counted from the start of this call.
+        hedger (Hedger, optional): Hedging settings; every worker observes its own response times and keeps its own budget.
+        formats (FormatRegistry, optional): Accepted image formats, detected from the first bytes, and the maximum body size. Defaults to `FormatRegistry()`.
+        dedup (Deduplicator, optional): Kept by the parent: URLs equal after normalization are sent to a worker once and every duplicate gets that result.
+
+    Yields:
+        Tuple[int, str, str | Exception]: Input position, URL and its file path or error.
+    """  # noqa: E501
+    processes = processes or os.cpu_count() or 1
+    tasks_per_process = max(1, math.ceil(max_active_tasks / processes))
+    # У каждого воркера в работе и в очереди не больше пары URL на задачу и одной пачки
+    window = tasks_per_process * (QUEUE_SIZE_FACTOR + 1) + BATCH_SIZE
+    logging.info(f' Multiprocess Downloading ({processes} processes) '.center(80, '#'))
+
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    options = {
+        'max_active_tasks': tasks_per_process,
+        'cred_json_path': cred_json_path,
+        'folder': folder,
+        'chunk_size': chunk_size,
+        'preallocate_file': preallocate_file,
+        'retry_policy': retry_policy,
+        'host_limits': (
+            (host_limiter.default, host_limiter.hosts) if host_limiter is not None
+            else None
+        ),
+        # С манифестом повторная загрузка после сбоя перезаписывает тот же файл
+        'stable_names': manifest is not None,
+        'ranges': ranges,
+        'pool': pool,
+        'deadlines': deadlines,
+        'job_end': (
+            time.time() + deadlines.job
+            if deadlines is not None and deadlines.job is not None else None
+        ),
+        'hedger': hedger,
+        'formats': formats,
+    }
+    root = logging.getLogger()
+    log_level = root.getEffectiveLevel() if root.handlers else None
+    if logging.root.manager.disable >= logging.CRITICAL:
+        log_level = None
+
+    # spawn: воркер не наследует потоки и открытые соединения родителя
+    context = multiprocessing.get_context('spawn')
+    progress = SharedProgress(processes, context)
+    workers = [
+        _Worker(slot, context, progress, log_level, options)
+        for slot in range(processes)
+    ]
+    by_outbox = {worker.outbox: worker for worker in workers}
+    errors = TypeCounter()
+
+    def pick(url: str) -> _Worker:
+        if host_limiter is not None:
+            return workers[zlib.crc32(url_host(url).encode()) % processes]
+        return min(workers, key=lambda worker: len(worker.pending))
+
+    def finish(index: int, url: str, result: Union[str, Exception]):
+        if isinstance(result, Exception):
+            errors[type(result).__name__] += 1
+        if manifest is not None:
+            manifest.record(url, result)
+        return index, url, result
+
+    def emit(index: int, url: str, result: Union[str, Exception]):
+        yield index, url, result
+        if dedup is not None:
+            # Дождавшиеся этого результата дубликаты отдаются следом
+            yield from dedup.resolve(index, url, result)
+
+    def room(worker: _Worker) -> int:
+        return window - len(worker.pending)
+
+    if dedup is not None:
+        dedup.begin()
+    source = enumerate(iter_urls(urls))
+    held = None  # URL, для которого у нужного воркера пока нет места
+    try:
+        while True:
+            # Досылаем URL целыми пачками, пока у воркеров есть место в окне
+            while held is None or room(pick(held[1])) >= BATCH_SIZE:
+                # Отложенный URL уже прошел дедупликацию и манифест
+                fresh = held is None
+                item = held or next(source, None)
+                held = None
+                if item is None:
+                    break
+                index, url = item
+                if dedup is not None and fresh:
+                    duplicate_of = dedup.claim(index, url)
+                    if duplicate_of is not None:
+                        # Дубликат получает результат первого URL с тем же ключом
+                        if duplicate_of is not PENDING:
+                            yield index, url, duplicate_of
+                        continue
+                if manifest is not None and fresh:
+                    # Завершенные в прошлом запуске URL сразу уходят в результаты
+                    path = manifest.finished_path(url)
+                    if path is not None:
+                        logging.info(f'Already downloaded | URL => {url}')
+                        yield from emit(index, url, path)
+                        continue
+                    manifest.mark_pending(url)
+                worker = pick(url)
+                if room(worker) <= 0:
+                    held = item
+                    break
+                worker.assign(index, url)
+            for worker in workers:
+                worker.send()
+
+            busy = [worker.outbox for worker in workers if worker.pending]
+            if not busy:
+                break
+            for outbox in wait(busy):
+                worker = by_outbox[outbox]
+                try:
+                    results = outbox.recv()
+                except EOFError:
+                    # Упавший воркер не ответит: его URL завершаются ошибкой
+                    worker.process.join()
+                    message = f'Worker process exited with {worker.process.exitcode}'
+                    for index, url in worker.pending.items():
+                        yield from emit(*finish(index, url, DownloadError(url, message)))
+                    worker.pending.clear()
+                    continue
+                for index, result in results:
+                    if index is None:
+                        logging.error(f'Worker process {worker.slot} failed: {result!r}')
+                        continue
+                    yield from emit(*finish(index, worker.pending.pop(index), result))
+    finally:
+        for worker in workers:
+            if worker.process.is_alive():
+                worker.stop()
+        for worker in workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        if manifest is not None:
+            manifest.flush()
+
+    progress.log_summary()
+    if dedup is not None:
+        dedup.log_stats()
+    if errors:
+        logging.info(f'Errors | {dict(errors)}')
+    if manifest is not None:
+        manifest.log_summary()
+    logging.info('The script has finished its work'.center(80, '-'))
+
+
+def download_stream(
+    urls: UrlSource,
+    max_active_tasks: int,
+    cred_json_path: Optional[str] = 'credentials.json',
+    folder: Optional[str] = 'downloads/',
+    processes: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+    preallocate_file: bool = False,
+    retry_policy: Optional[RetryPolicy] = None,
+    host_limiter: Optional[HostLimiter] = None,
+    manifest: Optional[Manifest] = None,
+    ranges: Optional[RangePolicy] = None,
+    pool: Optional[PoolConfig] = None,
+    deadlines: Optional[DeadlinePolicy] = None,
+    hedger: Optional[Hedger] = None,
+    formats: Optional[FormatRegistry] = None,
+    dedup: Optional[Deduplicator] = None,
+) -> Iterator[Tuple[str, Union[str, Exception]]]:
+    """
+    Download URLs in worker processes and yield `(url, path_or_error)` as each one finishes.
+
+    Args:
+        urls (UrlSource): URLs as an iterable, a file path, or '-' for stdin.
+        max_active_tasks (int): Maximum number of concurrent tasks over all processes.
+        cred_json_path (str, optional): Path to the credentials file. Defaults to 'credentials.json'.
+        folder (str, optional): Folder to save downloaded files. Defaults to 'downloads/'.
+        processes (int, optional): Number of worker processes. Defaults to the number of CPU cores.
+        chunk_size (int, optional): Size of the chunks response bodies are streamed in.
+        preallocate_file (bool, optional): Reserve disk space from `Content-Length` before writing.
+        retry_policy (RetryPolicy, optional): Retry transient failures with backoff. Defaults to no retries.
+        host_limiter (HostLimiter, optional): Per-host concurrency and rate limits, enforced by the process owning the host.
+        manifest (Manifest, optional): Job manifest kept by the parent: finished URLs are skipped and every result is recorded.
+        ranges (RangePolicy, optional): Split large bodies into byte ranges fetched in parallel, resuming partial files.
+        pool (PoolConfig, optional): Connection pool, DNS cache and timeout settings of every worker; pools are sized to its share of tasks.
+        deadlines (DeadlinePolicy, optional): Limits for one URL including its retries and for the whole run, counted from the start of this call.
+        hedger (Hedger, optional): Hedging settings; every worker observes its own response times and keeps its own budget.
+        formats (FormatRegistry, optional): Accepted image formats, detected from the first bytes, and the maximum body size. Defaults to `FormatRegistry()`.
+        dedup (Deduplicator, optional): Kept by the parent: URLs equal after normalization are sent to a worker once and every duplicate gets that result.
+
+    Yields:
+        Tuple[str, str | Exception]: The URL and either its file path or the error it failed with.
+    """  # noqa: E501
+    for _, url, result in download_as_completed(
+        urls, max_active_tasks, cred_json_path, folder, processes, chunk_size,
+        preallocate_file, retry_policy, host_limiter, manifest, ranges, pool,
+        deadlines, hedger, formats, dedup,
+    ):
+        yield url, result
+
+
+def main(
+    urls: UrlSource,
+    max_active_tasks: int,
+    cred_json_path: Optional[str] = 'credentials.json',
+    folder: Optional[str] = 'downloads/',
+    processes: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+    preallocate_file: bool = False,
+    retry_policy: Optional[RetryPolicy] = None,
+    host_limiter: Optional[HostLimiter] = None,
+    manifest: Optional[Manifest] = None,
+    ranges: Optional[RangePolicy] = None,
+    pool: Optional[PoolConfig] = None,
+    deadlines: Optional[DeadlinePolicy] = None,
+    hedger: Optional[Hedger] = None,
+    formats: Optional[FormatRegistry] = None,
+    dedup: Optional[Deduplicator] = None,
+) -> List[Optional[str]]:
+    """
+    Start the download process for the given list of URLs using several processes.
+
+    The returned list keeps the input order, so a `None` entry identifies the failed URL.
+
+    Args:
+        urls (UrlSource): URLs as an iterable, a file path, or '-' for stdin.
+        max_active_tasks (int): Maximum number of concurrent tasks over all processes.
+        cred_json_path (str, optional): Path to the credentials file. Defaults to 'credentials.json'.
+        folder (str, optional): Folder to save downloaded files. Defaults to 'downloads/'.
+        processes (int, optional): Number of worker processes. Defaults to the number of CPU cores.
+        chunk_size (int, optional): Size of the chunks response bodies are streamed in.
+        preallocate_file (bool, optional): Reserve disk space from `Content-Length` before writing.
+        retry_policy (RetryPolicy, optional): Retry transient failures with backoff. Defaults to no retries.
+        host_limiter (HostLimiter, optional): Per-host concurrency and rate limits, enforced by the process owning the host.
+        manifest (Manifest, optional): Job manifest kept by the parent: finished URLs are skipped and every result is recorded.
+        ranges (RangePolicy, optional): Split large bodies into byte ranges fetched in parallel, resuming partial files.
+        pool (PoolConfig, optional): Connection pool, DNS cache and timeout settings of every worker; pools are sized to its share of tasks.
+        deadlines (DeadlinePolicy, optional): Limits for one URL including its retries and for the whole run, counted from the start of this call.
+        hedger (Hedger, optional): Hedging settings; every worker observes its own response times and keeps its own budget.
+        formats (FormatRegistry, optional): Accepted image formats, detected from the first bytes, and the maximum body size. Defaults to `FormatRegistry()`.
+        dedup (Deduplicator, optional): Kept by the parent: URLs equal after normalization are sent to a worker once and every duplicate gets that result.
+
+    Returns:
+        List[Optional[str]]: A list of file paths where the downloaded files are saved. If a file could not be downloaded, its entry in the list will be `None`.
+    """  # noqa: E501
+    results = {}
+    for index, _, result in download_as_completed(
+        urls, max_active_tasks, cred_json_path, folder, processes, chunk_size,
+        preallocate_file, retry_policy, host_limiter, manifest, ranges, pool,
+        deadlines, hedger, formats, dedup,
+    ):
+        results[index] = None if isinstance(result, Exception) else result
+
+    return [results[index] for index in range(len(results))]
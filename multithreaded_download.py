@@ -2,92 +2,381 @@
 This module provides functionality to download images from a list of URLs using multithreading.
 
 It includes:
+- The `fetch_image` function to request and save a single image, raising on failure.
 - The `download_image` function to download a single image.
+- The `download_stream` generator yielding results as downloads finish.
+- The `download_as_completed` generator yielding results with their input position.
 - The `main` function to handle the download process for multiple URLs.
 """  # noqa: E501
+import heapq
 import logging
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Optional
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import closing
+from itertools import islice
+from typing import Iterator, List, Optional, Tuple, Union
 
 import requests
 
-from utils import (Counter, content_type_to_extension, generate_unique_name,
-                   load_credentials, setup_logging)
+from cache import HttpCache
+from deadlines import DeadlinePolicy, check_deadline, remaining
+from dedup import PENDING, Deduplicator
+from formats import SNIFF_SIZE, FormatRegistry
+from limits import (OVERLOAD_STATUSES, AIMDController, BodyReservation, ByteBudget,
+                    HostLimiter, HostScheduler)
+from manifest import Manifest
+from metrics import MeteredStorage, Metrics
+from pool import PoolConfig, PoolStats
+from postprocess import PostProcessor
+from retry import RetryPolicy, parse_retry_after
+from storage import FileStorage, Storage, StorageWriter, stored_size
+from utils import (CHUNK_SIZE, QUEUE_SIZE_FACTOR, DownloadError, Progress,
+                   UrlSource, count_urls, iter_urls,
+                   load_credentials, parse_content_length, setup_logging,
+                   url_host)
 
+# Сетевые ошибки, после которых имеет смысл повторить запрос
+TRANSIENT_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
 
-def download_image(
+
+def fetch_image(
     url: str,
     session: requests.Session,
-    counter: Counter,
-    total_urls: int,
     folder: str,
+    chunk_size: int = CHUNK_SIZE,
+    preallocate_file: bool = False,
+    storage: Optional[Storage] = None,
+    cache: Optional[HttpCache] = None,
+    deadline: Optional[float] = None,
+    formats: Optional[FormatRegistry] = None,
+    budget: Optional[ByteBudget] = None,
 ) -> str:
     """
-    Download a file from the given URL and save it to the specified folder.
+    Request a single URL and stream the image into the folder.
 
     Args:
         url (str): The URL of the file to download.
         session (requests.Session): Requests session to make HTTP requests.
-        counter (Counter): Counter object for tracking the number of downloaded files.
-        total_urls (int): Total number of URLs to download.
         folder (str): The folder where the downloaded file will be saved.
+        chunk_size (int, optional): Size of the chunks the body is read and written in.
+        preallocate_file (bool, optional): Reserve disk space from `Content-Length` before writing.
+        storage (Storage, optional): Backend the body is written to. Defaults to `FileStorage(folder)`.
+        cache (HttpCache, optional): Validator cache: the request is made conditional and `304` returns the cached file.
+        deadline (float, optional): `time.monotonic()` value after which the download is abandoned.
+        formats (FormatRegistry, optional): Accepted formats, detected from the first bytes, and the maximum body size. Defaults to `FormatRegistry()`.
+        budget (ByteBudget, optional): Global budget of body bytes in flight; the thread does not read the body until its bytes are reserved.
 
     Returns:
         str: The file path where the downloaded file is saved.
+
+    Raises:
+        DownloadError: If the server answered with a non-200 status, a non-image body or a body over the size limit.
+        requests.RequestException: If the request itself failed.
     """  # noqa: E501
-    try:
-        response = session.get(url)
-        if response.status_code == 200:
-            # Получаем Content-Type из Headers
-            content_type = response.headers.get('Content-Type')
-            # Проверка валидного расширение (jpg, png, gif)
-            extension = content_type_to_extension.get(content_type)
-            if extension is None:
-                logging.warning(
-                    f'Unsupported Content-Type: {content_type} | URL => {url}',
-                )
-                return
-
-            # Генерируем уникальное имя для файла
-            unique_name = generate_unique_name()
-            file_path = os.path.join(folder, f'{unique_name}.{extension}')
-
-            # Сохраняем локально
-            with open(file_path, 'wb') as file:
-                file.write(response.content)
-
-            logging.info(
-                f'200 OK | {url[:30]}...{url[-10:]} => {file_path} | '
-                f'{counter} / {total_urls}',
+    if formats is None:
+        formats = FormatRegistry()
+    entry = cache.lookup(url) if cache is not None else None
+    headers = HttpCache.conditional_headers(entry)
+    check_deadline(url, deadline)
+    # Остаток времени до дедлайна только ужесточает таймауты пула
+    with session.get(
+        url, headers=headers, stream=True, timeout=remaining(deadline),
+    ) as response:
+        # Файл не изменился с прошлого запуска: отдаем сохраненный
+        if response.status_code == 304 and entry is not None:
+            cache.hit(url)
+            return entry.path
+        if response.status_code != 200:
+            raise DownloadError(
+                url, f'{response.status_code} ERROR', status=response.status_code,
+                retry_after=parse_retry_after(response.headers.get('Retry-After')),
+            )
+
+        # Тип и размер проверяем до чтения тела
+        content_type = response.headers.get('Content-Type')
+        content_length = parse_content_length(response.headers.get('Content-Length'))
+        formats.check_headers(url, content_type, content_length)
+
+        reservation = budget.reservation(content_length) if budget is not None else None
+        try:
+            # Пока бюджет байтов исчерпан, поток не читает тело
+            _grow(url, reservation, content_length or 0, deadline)
+            # Формат определяем по первым байтам: не-изображение обрывается сразу
+            chunks = response.iter_content(chunk_size)
+            head = _read_head(chunks)
+            extension = formats.detect(url, content_type, head)
+
+            if storage is None:
+                storage = FileStorage(folder)
+            size = content_length if preallocate_file else None
+            writer = storage.open(url, extension, size)
+
+            # Пишем тело по частям, память не зависит от размера файла
+            file_path = _stream_to_writer(
+                url, head, chunks, writer, formats, deadline, reservation,
+            )
+        finally:
+            if reservation is not None:
+                reservation.release()
+        if cache is not None:
+            cache.update(
+                url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                file_path,
             )
-            counter.increment()
-            return file_path
-        else:
-            logging.warning(f'{response.status_code} ERROR | URL => {url}')
-    except requests.RequestException as error:
-        logging.error(f'Requests error occurred for URL: {url}. Error: {error}')
+        return file_path
+
+
+def download_image(
+    url: str,
+    session: requests.Session,
+    counter: Progress,
+    total_urls: Optional[int],
+    folder: str,
+    chunk_size: int = CHUNK_SIZE,
+    preallocate_file: bool = False,
+    retry_policy: Optional[RetryPolicy] = None,
+    host_limiter: Optional[HostLimiter] = None,
+    storage: Optional[Storage] = None,
+    cache: Optional[HttpCache] = None,
+    timeout: Optional[float] = None,
+    formats: Optional[FormatRegistry] = None,
+    postprocess: Optional[PostProcessor] = None,
+    budget: Optional[ByteBudget] = None,
+) -> Optional[str]:
+    """
+    Download a file from the given URL and save it to the specified folder.
+
+    The body is streamed to a temporary `.part` file chunk by chunk and atomically renamed
+    once complete, so memory use does not depend on the file size.
+
+    Args:
+        url (str): The URL of the file to download.
+        session (requests.Session): Requests session to make HTTP requests.
+        counter (Progress): Shared progress of the run: successes, failures, bytes, in-flight.
+        total_urls (int, optional): Total number of URLs to download, if known.
+        folder (str): The folder where the downloaded file will be saved.
+        chunk_size (int, optional): Size of the chunks the body is read and written in.
+        preallocate_file (bool, optional): Reserve disk space from `Content-Length` before writing.
+        retry_policy (RetryPolicy, optional): Retry transient failures, sleeping in the calling thread.
+        host_limiter (HostLimiter, optional): Per-host concurrency and rate limits applied to every attempt.
+        storage (Storage, optional): Backend the body is written to. Defaults to `FileStorage(folder)`.
+        cache (HttpCache, optional): Validator cache: the request is made conditional and `304` returns the cached file.
+        timeout (float, optional): Seconds the download may take, including retries and the waits between them.
+        formats (FormatRegistry, optional): Accepted formats, detected from the first bytes, and the maximum body size.
+        postprocess (PostProcessor, optional): Run its steps over the saved file in a worker process and wait for them.
+        budget (ByteBudget, optional): Global budget of body bytes in flight the body waits for.
+
+    Returns:
+        str, optional: The file path where the downloaded file is saved, `None` on failure. With `postprocess` it is a `ProcessedPath` holding the step results.
+    """  # noqa: E501
+    counter.start()
+    host = url_host(url)
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    attempt = 1
+    while True:
+        if host_limiter is not None:
+            host_limiter.acquire(host)
+        try:
+            result = _attempt(
+                url, session, folder, chunk_size, preallocate_file, storage, cache,
+                deadline, formats, budget,
+            )
+        finally:
+            if host_limiter is not None:
+                host_limiter.release(host)
+        delay = _retry_delay(retry_policy, attempt, result, deadline)
+        if delay is None:
+            break
+        logging.info(f'Retry #{attempt} in {delay:.2f}s | URL => {url}')
+        time.sleep(delay)
+        attempt += 1
+
+    if postprocess is not None and not isinstance(result, Exception):
+        result = postprocess.run(url, result)
+    _report(url, result, counter, total_urls, budget)
+    return None if isinstance(result, Exception) else result
+
+
+def _attempt(
+    url: str,
+    session: requests.Session,
+    folder: str,
+    chunk_size: int,
+    preallocate_file: bool,
+    storage: Optional[Storage] = None,
+    cache: Optional[HttpCache] = None,
+    deadline: Optional[float] = None,
+    formats: Optional[FormatRegistry] = None,
+    budget: Optional[ByteBudget] = None,
+) -> Union[str, Exception]:
+    """Make one download attempt and return either the file path or its error."""
+    try:
+        return fetch_image(
+            url, session, folder, chunk_size, preallocate_file, storage, cache,
+            deadline, formats, budget,
+        )
     except Exception as error:
-        logging.error(f'An unknown error occurred for URL: {url}. Error: {error}')
+        return error
 
 
-def main(
-    urls: List[str],
+def _retry_delay(
+    retry_policy: Optional[RetryPolicy],
+    attempt: int,
+    result: Union[str, Exception],
+    deadline: Optional[float] = None,
+) -> Optional[float]:
+    if retry_policy is None or not isinstance(result, Exception):
+        return None
+    delay = retry_policy.delay_for(attempt, result, TRANSIENT_ERRORS)
+    # Повтор, который не успеет начаться до дедлайна, не планируем
+    if delay is not None and deadline is not None and (
+        time.monotonic() + delay >= deadline
+    ):
+        return None
+    return delay
+
+
+def _is_overload(result: Union[str, Exception]) -> bool:
+    if isinstance(result, DownloadError):
+        return result.status in OVERLOAD_STATUSES
+    return isinstance(result, TRANSIENT_ERRORS)
+
+
+def _report(
+    url: str,
+    result: Union[str, Exception],
+    counter: Progress,
+    total_urls: Optional[int],
+    budget: Optional[ByteBudget] = None,
+) -> None:
+    """Log the final outcome of a URL and account it in the progress."""
+    if isinstance(result, Exception):
+        counter.fail()
+    if isinstance(result, DownloadError):
+        logging.warning(f'{result} | URL => {url}')
+    elif isinstance(result, requests.RequestException):
+        logging.error(f'Requests error occurred for URL: {url}. Error: {result}')
+    elif isinstance(result, Exception):
+        logging.error(f'An unknown error occurred for URL: {url}. Error: {result}')
+    else:
+        # Номер выдается атомарно, поэтому в логе не бывает повторов и пропусков
+        ordinal = counter.succeed(stored_size(result))
+        logging.info(
+            f'200 OK | {url[:30]}...{url[-10:]} => {result} | '
+            f'{ordinal} / {total_urls or "?"}'
+            + (f' | budget {budget}' if budget is not None else ''),
+        )
+
+
+def _read_head(chunks: Iterator[bytes]) -> bytes:
+    """Read chunks of the body until at least `SNIFF_SIZE` bytes are buffered."""
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= SNIFF_SIZE:
+            break
+    return head
+
+
+def _stream_to_writer(
+    url: str,
+    head: bytes,
+    chunks: Iterator[bytes],
+    writer: StorageWriter,
+    formats: FormatRegistry,
+    deadline: Optional[float] = None,
+    reservation: Optional[BodyReservation] = None,
+) -> str:
+    """Write the already read `head` and the rest of the body into a writer and commit it."""  # noqa: E501
+    try:
+        # Первый чанк может оказаться и всем телом
+        size = len(head)
+        formats.check_size(url, size)
+        writer.write(head)
+        for chunk in chunks:
+            # Медленный сервер, присылающий тело по байту, обрывается по дедлайну
+            check_deadline(url, deadline)
+            # Без Content-Length лимит размера проверяется по мере чтения
+            size += len(chunk)
+            formats.check_size(url, size)
+            # Резерв тела без Content-Length растет, пока его читают
+            _grow(url, reservation, size, deadline)
+            writer.write(chunk)
+        # Файл появляется в хранилище только целиком
+        return writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def _grow(
+    url: str,
+    reservation: Optional[BodyReservation],
+    size: int,
+    deadline: Optional[float],
+) -> None:
+    """Hold `size` bytes of the budget, failing the URL if its deadline comes first."""
+    if reservation is not None and not reservation.grow(size, remaining(deadline)):
+        raise DownloadError(url, 'Deadline exceeded')
+
+
+def download_as_completed(
+    urls: UrlSource,
     max_active_tasks: int,
     cred_json_path: Optional[str] = 'credentials.json',
     folder: Optional[str] = 'downloads/',
-) -> List[Optional[str]]:
+    chunk_size: int = CHUNK_SIZE,
+    preallocate_file: bool = False,
+    max_in_flight: Optional[int] = None,
+    retry_policy: Optional[RetryPolicy] = None,
+    host_limiter: Optional[HostLimiter] = None,
+    adaptive: Optional[AIMDController] = None,
+    storage: Optional[Storage] = None,
+    manifest: Optional[Manifest] = None,
+    cache: Optional[HttpCache] = None,
+    metrics: Optional[Metrics] = None,
+    pool: Optional[PoolConfig] = None,
+    deadlines: Optional[DeadlinePolicy] = None,
+    formats: Optional[FormatRegistry] = None,
+    dedup: Optional[Deduplicator] = None,
+    postprocess: Optional[PostProcessor] = None,
+    budget: Optional[ByteBudget] = None,
+) -> Iterator[Tuple[int, str, Union[str, Exception]]]:
     """
-    Start the download process for the given list of URLs using multithreading.
+    Download URLs in a thread pool, yielding `(index, url, result)` as futures finish.
+
+    URLs are submitted lazily: at most `max_in_flight` futures exist at any time, so the
+    input is never materialized as one `Future` per URL.
 
     Args:
-        urls (list[str]): List of URLs to download.
+        urls (UrlSource): URLs as an iterable, a file path, or '-' for stdin.
         max_active_tasks (int): Maximum number of concurrent tasks.
         cred_json_path (str, optional): Path to the credentials file. Defaults to 'credentials.json'.
         folder (str, optional): Folder to save downloaded files. Defaults to 'downloads/'.
+        chunk_size (int, optional): Size of the chunks response bodies are streamed in.
+        preallocate_file (bool, optional): Reserve disk space from `Content-Length` before writing.
+        max_in_flight (int, optional): Size of the submission window. Defaults to twice `max_active_tasks`.
+        retry_policy (RetryPolicy, optional): Retry transient failures with backoff. Defaults to no retries.
+        host_limiter (HostLimiter, optional): Per-host concurrency and rate limits; its `stats()` expose per-host counters.
+        adaptive (AIMDController, optional): Tune the concurrency limit at runtime, starting from `max_active_tasks`.
+        storage (Storage, optional): Backend bodies are written to, e.g. `ContentAddressedStorage`. Defaults to `FileStorage(folder)`.
+        manifest (Manifest, optional): Job manifest: URLs finished in an earlier run are skipped and every result is recorded.
+        cache (HttpCache, optional): Validator cache for repeat crawls; hit/miss ratios are logged at the end.
+        metrics (Metrics, optional): Registry for phase timings, bytes, statuses, errors, in-flight and queue depth.
+        pool (PoolConfig, optional): Connection pool sizes and per-phase timeouts; requests resolves hosts through the system resolver. Defaults to `PoolConfig()`.
+        deadlines (DeadlinePolicy, optional): Limits for one URL including its retries and for the whole run; late URLs fail with `DownloadError`.
+        formats (FormatRegistry, optional): Accepted image formats, detected from the first bytes, and the maximum body size. Defaults to `FormatRegistry()`.
+        dedup (Deduplicator, optional): Download URLs equal after normalization once; every duplicate gets the result of that download.
+        postprocess (PostProcessor, optional): Run CPU-bound steps over every saved file in a process pool; results carry them as `ProcessedPath.processed`.
+        budget (ByteBudget, optional): Global budget of response body bytes in flight; threads wait before reading bodies while it is used up. Usage is shown in the progress log.
 
-    Returns:
-        List[Optional[str]]: A list of file paths where the downloaded files are saved. If a file could not be downloaded, its entry in the list will be `None`.
+    Yields:
+        Tuple[int, str, str | Exception]: Input position, URL and either its file path or its error.
     """  # noqa: E501
     logging.info(' Multithreaded Downloading '.center(80, '#'))
 
@@ -95,26 +384,352 @@ def main(
     if not os.path.exists(folder):
         os.makedirs(folder)
 
-    counter = Counter()  # Счетчик для лога
-    total_urls = len(urls)
+    counter = Progress()  # Прогресс для лога и сводки
+    if dedup is not None:
+        dedup.begin()
+    total_urls = count_urls(urls)
+    urls = enumerate(iter_urls(urls))
+    # В адаптивном режиме пул рассчитан на верхнюю границу, а в работу отдается
+    # столько задач, сколько сейчас разрешает контроллер
+    workers_count = max_active_tasks
+    if adaptive is not None:
+        adaptive.begin(max_active_tasks)
+        workers_count = adaptive.max_limit
+    window = max_in_flight or workers_count * QUEUE_SIZE_FACTOR
+    # Без явных ограничений по хостам планировщик работает как обычная очередь
+    if host_limiter is None:
+        host_limiter = HostLimiter()
+    if storage is None:
+        # С манифестом повторная загрузка после сбоя перезаписывает тот же файл
+        storage = FileStorage(folder, stable_names=manifest is not None)
+    if metrics is not None:
+        storage = MeteredStorage(storage, metrics)
 
     # Загружаем все креды для отправки запросов
     cred = load_credentials(cred_json_path)
 
+    if pool is None:
+        pool = PoolConfig()
+    pool_stats = PoolStats()
+    job_end = deadlines.job_end() if deadlines is not None else None
+
+    def finish(index: int, url: str, result: Union[str, Exception]):
+        _report(url, result, counter, total_urls, budget)
+        if metrics is not None:
+            metrics.record_result(result)
+        if manifest is not None:
+            manifest.record(url, result)
+        return index, url, result
+
+    def emit(index: int, url: str, result: Union[str, Exception]):
+        yield index, url, result
+        if dedup is not None:
+            # Дождавшиеся этого результата дубликаты отдаются следом
+            yield from dedup.resolve(index, url, result)
+
     # Создаем сессию Requests для дальнейших запросов
     with requests.Session() as session:
         session.headers.update(cred['headers'])  # Обновляем headers
+        # Пул соединений на хост не меньше числа потоков, иначе они ждут соединения
+        # или переподключаются
+        pool.mount(session, workers_count, pool_stats)
+        if metrics is not None:
+            session.hooks['response'].append(metrics.requests_hook)
 
         # Используем ThreadPoolExecutor для многопоточности
-        with ThreadPoolExecutor(max_workers=max_active_tasks) as executor:
-            futures = [
-                executor.submit(download_image, url, session, counter, total_urls, folder)
-                for url in urls
-            ]
-            results = [future.result() for future in as_completed(futures)]
+        with ThreadPoolExecutor(max_workers=workers_count) as executor:
+            # URL ждут в буфере по хостам, пока у их хоста не появится свободный слот
+            scheduler = HostScheduler(host_limiter, window)
+            in_flight = {}
+            # Файлы в пуле постобработки: future -> (позиция, URL, путь)
+            processing = {}
+            # Отложенные повторы: (время запуска, позиция, URL, номер попытки, дедлайн).
+            # Поток не спит в ожидании повтора, а сразу берет следующую задачу
+            retries = []
+            exhausted = False
+
+            try:
+                while True:
+                    now = time.monotonic()
+                    while retries and retries[0][0] <= now:
+                        _, index, url, attempt, deadline = heapq.heappop(retries)
+                        scheduler.push(url_host(url), (index, url, attempt, deadline))
+
+                    # Подкладываем URL лениво, держа в работе не больше окна
+                    free = max(
+                        window - len(scheduler) - len(in_flight) - len(retries)
+                        - len(processing), 0,
+                    )
+                    pulled = 0
+                    for index, url in islice(urls, free):
+                        pulled += 1
+                        if dedup is not None:
+                            duplicate_of = dedup.claim(index, url)
+                            if duplicate_of is not None:
+                                # Дубликат получает результат первого URL с тем же ключом
+                                if duplicate_of is not PENDING:
+                                    yield index, url, duplicate_of
+                                continue
+                        if manifest is not None:
+                            # Завершенные в прошлом запуске URL сразу уходят в результаты
+                            path = manifest.finished_path(url)
+                            if path is not None:
+                                logging.info(f'Already downloaded | URL => {url}')
+                                yield from emit(index, url, path)
+                                continue
+                            manifest.mark_pending(url)
+                        scheduler.push(url_host(url), (index, url, 1, None))
+                    # Пропущенные URL не попадают в буфер, поэтому конец входа
+                    # определяем по тому, что он отдал меньше, чем просили
+                    exhausted = exhausted or pulled < free
+
+                    if job_end is not None and now >= job_end:
+                        # После дедлайна задания URL не ждут свободного хоста
+                        while (entry := scheduler.pop_any()) is not None:
+                            _, (index, url, attempt, _) = entry
+                            if attempt == 1:
+                                counter.start()
+                            error = DownloadError(url, 'Deadline exceeded')
+                            yield from emit(*finish(index, url, error))
+
+                    # Свободным потокам отдаем URL только тех хостов, где есть запас
+                    wait_for_token = None
+                    limit = adaptive.limit if adaptive is not None else max_active_tasks
+                    # Пока CPU-этап не догнал загрузки, новые URL не запускаются
+                    if postprocess is not None and (
+                        len(processing) >= postprocess.max_pending
+                    ):
+                        limit = 0
+                    while len(in_flight) < limit:
+                        ready, wait_for_token = scheduler.pop_ready()
+                        if ready is None:
+                            break
+                        host, (index, url, attempt, deadline) = ready
+                        if attempt == 1:
+                            counter.start()
+                            if deadlines is not None:
+                                deadline = deadlines.url_end(job_end)
+                        future = executor.submit(
+                            _attempt, url, session, folder, chunk_size, preallocate_file,
+                            storage, cache, deadline, formats, budget,
+                        )
+                        in_flight[future] = (
+                            host, index, url, attempt, time.monotonic(), deadline,
+                        )
+                    if metrics is not None:
+                        metrics.set('download_in_flight', len(in_flight))
+                        metrics.set('download_queue_depth', len(scheduler) + len(retries))
 
+                    busy = in_flight or processing or retries or scheduler
+                    if exhausted and not busy:
+                        break
+
+                    timeouts = [wait_for_token] if wait_for_token is not None else []
+                    if retries:
+                        timeouts.append(retries[0][0] - now)
+                    if job_end is not None and now < job_end:
+                        timeouts.append(job_end - now)
+                    timeout = min(timeouts) if timeouts else None
+                    if not in_flight and not processing:
+                        time.sleep(timeout or 0)
+                        continue
+
+                    finished, _ = wait(
+                        [*in_flight, *processing], timeout=timeout,
+                        return_when=FIRST_COMPLETED,
+                    )
+                    for future in finished:
+                        if future in processing:
+                            index, url, path = processing.pop(future)
+                            result = postprocess.result(url, path, future)
+                            yield from emit(*finish(index, url, result))
+                            continue
+                        host, index, url, attempt, started, deadline = in_flight.pop(
+                            future,
+                        )
+                        host_limiter.release(host)
+                        result = future.result()
+                        if adaptive is not None:
+                            latency = time.monotonic() - started
+                            adaptive.record(latency, overloaded=_is_overload(result))
+                        delay = _retry_delay(retry_policy, attempt, result, deadline)
+                        if delay is not None:
+                            logging.info(
+                                f'Retry #{attempt} in {delay:.2f}s | URL => {url}',
+                            )
+                            retry_at = time.monotonic() + delay
+                            heapq.heappush(
+                                retries, (retry_at, index, url, attempt + 1, deadline),
+                            )
+                            continue
+
+                        if postprocess is not None and not isinstance(result, Exception):
+                            # Файл уходит в пул процессов, результат придет позже
+                            processing[postprocess.submit(url, result)] = (
+                                index, url, result,
+                            )
+                            continue
+                        yield from emit(*finish(index, url, result))
+            finally:
+                # Если потребитель остановился, не запускаем оставшиеся задачи
+                for future in in_flight:
+                    future.cancel()
+                if postprocess is not None:
+                    postprocess.close()
+                if manifest is not None:
+                    manifest.flush()
+                if cache is not None:
+                    cache.flush()
+                if metrics is not None:
+                    metrics.record_connections(pool_stats.new, pool_stats.reused)
+
+    storage.close()
+
+    counter.log_summary()
+    host_limiter.log_stats()
+    pool_stats.log_stats()
+    if dedup is not None:
+        dedup.log_stats()
+    if postprocess is not None:
+        postprocess.log_stats()
+    if budget is not None:
+        budget.log_stats()
+    if cache is not None:
+        cache.log_stats()
+    if metrics is not None:
+        metrics.log_summary()
+    if manifest is not None:
+        manifest.log_summary()
+    if adaptive is not None:
+        adaptive.log_summary()
     logging.info('The script has finished its work'.center(80, '-'))
-    return results
+
+
+def download_stream(
+    urls: UrlSource,
+    max_active_tasks: int,
+    cred_json_path: Optional[str] = 'credentials.json',
+    folder: Optional[str] = 'downloads/',
+    chunk_size: int = CHUNK_SIZE,
+    preallocate_file: bool = False,
+    retry_policy: Optional[RetryPolicy] = None,
+    host_limiter: Optional[HostLimiter] = None,
+    adaptive: Optional[AIMDController] = None,
+    storage: Optional[Storage] = None,
+    manifest: Optional[Manifest] = None,
+    cache: Optional[HttpCache] = None,
+    metrics: Optional[Metrics] = None,
+    pool: Optional[PoolConfig] = None,
+    deadlines: Optional[DeadlinePolicy] = None,
+    formats: Optional[FormatRegistry] = None,
+    dedup: Optional[Deduplicator] = None,
+    postprocess: Optional[PostProcessor] = None,
+    budget: Optional[ByteBudget] = None,
+) -> Iterator[Tuple[str, Union[str, Exception]]]:
+    """
+    Download URLs and yield `(url, path_or_error)` as soon as each download finishes.
+
+    URLs are consumed lazily and only a bounded window of futures exists at any time,
+    so the input can be far larger than memory.
+
+    Args:
+        urls (UrlSource): URLs as an iterable, a file path, or '-' for stdin.
+        max_active_tasks (int): Maximum number of concurrent tasks.
+        cred_json_path (str, optional): Path to the credentials file. Defaults to 'credentials.json'.
+        folder (str, optional): Folder to save downloaded files. Defaults to 'downloads/'.
+        chunk_size (int, optional): Size of the chunks response bodies are streamed in.
+        preallocate_file (bool, optional): Reserve disk space from `Content-Length` before writing.
+        retry_policy (RetryPolicy, optional): Retry transient failures with backoff. Defaults to no retries.
+        host_limiter (HostLimiter, optional): Per-host concurrency and rate limits; its `stats()` expose per-host counters.
+        adaptive (AIMDController, optional): Tune the concurrency limit at runtime, starting from `max_active_tasks`.
+        storage (Storage, optional): Backend bodies are written to, e.g. `ContentAddressedStorage`. Defaults to `FileStorage(folder)`.
+        manifest (Manifest, optional): Job manifest: URLs finished in an earlier run are skipped and every result is recorded.
+        cache (HttpCache, optional): Validator cache for repeat crawls; hit/miss ratios are logged at the end.
+        metrics (Metrics, optional): Registry for phase timings, bytes, statuses, errors, in-flight and queue depth.
+        pool (PoolConfig, optional): Connection pool sizes and per-phase timeouts; requests resolves hosts through the system resolver. Defaults to `PoolConfig()`.
+        deadlines (DeadlinePolicy, optional): Limits for one URL including its retries and for the whole run; late URLs fail with `DownloadError`.
+        formats (FormatRegistry, optional): Accepted image formats, detected from the first bytes, and the maximum body size. Defaults to `FormatRegistry()`.
+        dedup (Deduplicator, optional): Download URLs equal after normalization once; every duplicate gets the result of that download.
+        postprocess (PostProcessor, optional): Run CPU-bound steps over every saved file in a process pool; results carry them as `ProcessedPath.processed`.
+        budget (ByteBudget, optional): Global budget of response body bytes in flight; threads wait before reading bodies while it is used up. Usage is shown in the progress log.
+
+    Yields:
+        Tuple[str, str | Exception]: The URL and either its file path or the error it failed with.
+    """  # noqa: E501
+    results = download_as_completed(
+        urls, max_active_tasks, cred_json_path, folder, chunk_size, preallocate_file,
+        retry_policy=retry_policy, host_limiter=host_limiter, adaptive=adaptive,
+        storage=storage, manifest=manifest, cache=cache,
+        metrics=metrics, pool=pool, deadlines=deadlines, formats=formats,
+        dedup=dedup, postprocess=postprocess, budget=budget,
+    )
+    with closing(results):
+        for _, url, result in results:
+            yield url, result
+
+
+def main(
+    urls: UrlSource,
+    max_active_tasks: int,
+    cred_json_path: Optional[str] = 'credentials.json',
+    folder: Optional[str] = 'downloads/',
+    chunk_size: int = CHUNK_SIZE,
+    preallocate_file: bool = False,
+    max_in_flight: Optional[int] = None,
+    retry_policy: Optional[RetryPolicy] = None,
+    host_limiter: Optional[HostLimiter] = None,
+    adaptive: Optional[AIMDController] = None,
+    storage: Optional[Storage] = None,
+    manifest: Optional[Manifest] = None,
+    cache: Optional[HttpCache] = None,
+    metrics: Optional[Metrics] = None,
+    pool: Optional[PoolConfig] = None,
+    deadlines: Optional[DeadlinePolicy] = None,
+    formats: Optional[FormatRegistry] = None,
+    dedup: Optional[Deduplicator] = None,
+    postprocess: Optional[PostProcessor] = None,
+    budget: Optional[ByteBudget] = None,
+) -> List[Optional[str]]:
+    """
+    Start the download process for the given list of URLs using multithreading.
+
+    The returned list keeps the input order, so a `None` entry identifies the failed URL.
+
+    Args:
+        urls (UrlSource): URLs as an iterable, a file path, or '-' for stdin.
+        max_active_tasks (int): Maximum number of concurrent tasks.
+        cred_json_path (str, optional): Path to the credentials file. Defaults to 'credentials.json'.
+        folder (str, optional): Folder to save downloaded files. Defaults to 'downloads/'.
+        chunk_size (int, optional): Size of the chunks response bodies are streamed in.
+        preallocate_file (bool, optional): Reserve disk space from `Content-Length` before writing.
+        max_in_flight (int, optional): Size of the submission window. Defaults to twice `max_active_tasks`.
+        retry_policy (RetryPolicy, optional): Retry transient failures with backoff. Defaults to no retries.
+        host_limiter (HostLimiter, optional): Per-host concurrency and rate limits; its `stats()` expose per-host counters.
+        adaptive (AIMDController, optional): Tune the concurrency limit at runtime, starting from `max_active_tasks`.
+        storage (Storage, optional): Backend bodies are written to, e.g. `ContentAddressedStorage`. Defaults to `FileStorage(folder)`.
+        manifest (Manifest, optional): Job manifest: URLs finished in an earlier run are skipped and every result is recorded.
+        cache (HttpCache, optional): Validator cache for repeat crawls; hit/miss ratios are logged at the end.
+        metrics (Metrics, optional): Registry for phase timings, bytes, statuses, errors, in-flight and queue depth.
+        pool (PoolConfig, optional): Connection pool sizes and per-phase timeouts; requests resolves hosts through the system resolver. Defaults to `PoolConfig()`.
+        deadlines (DeadlinePolicy, optional): Limits for one URL including its retries and for the whole run; late URLs fail with `DownloadError`.
+        formats (FormatRegistry, optional): Accepted image formats, detected from the first bytes, and the maximum body size. Defaults to `FormatRegistry()`.
+        dedup (Deduplicator, optional): Download URLs equal after normalization once; every duplicate gets the result of that download.
+        postprocess (PostProcessor, optional): Run CPU-bound steps over every saved file in a process pool; results carry them as `ProcessedPath.processed`.
+        budget (ByteBudget, optional): Global budget of response body bytes in flight; threads wait before reading bodies while it is used up. Usage is shown in the progress log.
+
+    Returns:
+        List[Optional[str]]: A list of file paths where the downloaded files are saved. If a file could not be downloaded, its entry in the list will be `None`.
+    """  # noqa: E501
+    # Результаты приходят в порядке завершения, раскладываем их по позициям URL
+    results = {}
+    for index, _, result in download_as_completed(
+        urls, max_active_tasks, cred_json_path, folder, chunk_size, preallocate_file,
+        max_in_flight, retry_policy, host_limiter, adaptive, storage, manifest,
+        cache, metrics, pool, deadlines, formats, dedup, postprocess, budget,
+    ):
+        results[index] = None if isinstance(result, Exception) else result
+
+    return [results[index] for index in range(len(results))]
 
 
 if __name__ == '__main__':
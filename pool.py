@@ -0,0 +1,195 @@
+"""
+This module provides connection pool, keep-alive, DNS cache and timeout settings for both HTTP clients.
+
+It includes:
+- The `PoolConfig` class describing pool sizes, keep-alive, DNS cache TTL and per-phase
+  timeouts, and building an aiohttp connector or a requests adapter from them.
+- The `PoolStats` class counting new and reused connections.
+- The `PooledAdapter` class, a requests adapter with default timeouts and connection
+  statistics.
+
+aiohttp closes idle connections after `keepalive_timeout` and caches DNS for `dns_ttl`;
+urllib3 keeps idle connections until the server closes them and resolves every new
+connection through the system resolver, trying each address of the host in turn, so
+`dns_ttl` applies to the aiohttp connector only.
+"""  # noqa: E501
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+@dataclass(frozen=True)
+class PoolConfig:
+    """
+    Connection pool, keep-alive, DNS cache and timeout settings.
+
+    Attributes:
+        max_connections (int, optional): Total open connections. Defaults to the concurrency.
+        max_per_host (int, optional): Connections per host. Defaults to the concurrency.
+        max_hosts (int): Per-host pools requests keeps before closing the least recently used.
+        keepalive_timeout (float): Seconds aiohttp keeps an idle connection open.
+        dns_ttl (float, optional): Seconds aiohttp reuses a resolved address; `None` disables the cache. requests always uses the system resolver.
+        connect_timeout (float, optional): Seconds to establish a connection.
+        read_timeout (float, optional): Seconds to wait for the next piece of the response.
+        total_timeout (float, optional): Seconds for a whole request including the body (aiohttp only).
+    """  # noqa: E501
+    max_connections: Optional[int] = None
+    max_per_host: Optional[int] = None
+    max_hosts: int = 100
+    keepalive_timeout: float = 30.0
+    dns_ttl: Optional[float] = 300.0
+    connect_timeout: Optional[float] = 10.0
+    read_timeout: Optional[float] = 30.0
+    total_timeout: Optional[float] = 300.0
+
+    def limits(self, concurrency: int) -> Tuple[int, int]:
+        """Return `(total, per_host)` pool sizes for the given concurrency."""
+        total = self.max_connections or concurrency
+        return total, min(self.max_per_host or concurrency, total)
+
+    def connector(self, concurrency: int, extra: int = 0) -> aiohttp.TCPConnector:
+        """
+        Build an aiohttp connector; create it inside the running event loop.
+
+        Args:
+            concurrency (int): Number of concurrent requests the pool is sized to.
+            extra (int, optional): Connections added to both limits for requests beyond the concurrency, e.g. hedged duplicates and extra byte ranges, so they do not queue for a connection.
+        """  # noqa: E501
+        total, per_host = self.limits(concurrency)
+        return aiohttp.TCPConnector(
+            limit=total + extra,
+            limit_per_host=per_host + extra,
+            keepalive_timeout=self.keepalive_timeout,
+            use_dns_cache=self.dns_ttl is not None,
+            ttl_dns_cache=self.dns_ttl,
+        )
+
+    def client_timeout(self) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(
+            total=self.total_timeout,
+            sock_connect=self.connect_timeout,
+            sock_read=self.read_timeout,
+        )
+
+    def requests_timeout(self) -> Tuple[Optional[float], Optional[float]]:
+        return self.connect_timeout, self.read_timeout
+
+    def trace_config(self, stats: 'PoolStats') -> aiohttp.TraceConfig:
+        """Build an aiohttp `TraceConfig` counting new and reused connections."""
+        trace = aiohttp.TraceConfig()
+
+        async def on_create(session, ctx, params) -> None:
+            stats.opened()
+
+        async def on_reuse(session, ctx, params) -> None:
+            stats.reused_one()
+
+        trace.on_connection_create_end.append(on_create)
+        trace.on_connection_reuseconn.append(on_reuse)
+        return trace
+
+    def mount(
+        self, session: requests.Session, concurrency: int, stats: 'PoolStats',
+    ) -> 'PooledAdapter':
+        """Mount a `PooledAdapter` for http and https on a requests session."""
+        adapter = PooledAdapter(self, concurrency, stats)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return adapter
+
+
+class PoolStats:
+    """Thread-safe counts of connections opened and reused by a run."""
+
+    def __init__(self):
+        self.new = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+
+    def opened(self) -> None:
+        with self._lock:
+            self.new += 1
+
+    def reused_one(self) -> None:
+        with self._lock:
+            self.reused += 1
+
+    def reuse_ratio(self) -> float:
+        total = self.new + self.reused
+        return self.reused / total if total else 0.0
+
+    def log_stats(self) -> None:
+        logging.info(
+            f'Connections | new {self.new} | reused {self.reused} | '
+            f'reuse ratio {self.reuse_ratio():.0%}',
+        )
+
+
+def _pool_class(pool_cls, connection_cls, on_open: Callable[[], None]):
+    """Subclass a urllib3 pool so its connections report opening."""
+    class Connection(connection_cls):
+        def connect(self):
+            # connect() вызывается только для нового соединения
+            super().connect()
+            on_open()
+
+    return type(pool_cls.__name__, (pool_cls,), {'ConnectionCls': Connection})
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    requests adapter sized to the concurrency, with default timeouts and reuse statistics.
+
+    A number passed as the timeout of a request, e.g. the time left before a deadline,
+    caps the configured connect and read timeouts instead of replacing them.
+
+    Args:
+        config (PoolConfig): Pool and timeout settings.
+        concurrency (int): Number of threads sharing the session.
+        stats (PoolStats): Counts of new and reused connections.
+    """
+
+    def __init__(self, config: PoolConfig, concurrency: int, stats: PoolStats):
+        # У HTTPAdapter уже есть собственный атрибут config
+        self.pool_config = config
+        self.stats = stats
+        self._local = threading.local()
+        _, per_host = config.limits(concurrency)
+        # Пул не меньше числа потоков: иначе лишние соединения закрываются
+        # после каждого запроса и открываются заново
+        super().__init__(pool_connections=config.max_hosts, pool_maxsize=per_host)
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _pool_class(HTTPConnectionPool, HTTPConnection, self._opened),
+            'https': _pool_class(HTTPSConnectionPool, HTTPSConnection, self._opened),
+        }
+
+    def _opened(self) -> None:
+        # urllib3 открывает соединение в потоке запроса, поэтому счетчик потока
+        # показывает, понадобилось ли новое соединение этому запросу
+        self._local.opened = getattr(self._local, 'opened', 0) + 1
+        self.stats.opened()
+
+    def send(self, request, timeout=None, **kwargs) -> requests.Response:
+        if timeout is None:
+            timeout = self.pool_config.requests_timeout()
+        elif isinstance(timeout, (int, float)):
+            # Одно число, например остаток до дедлайна, только ужесточает таймауты
+            timeout = tuple(
+                timeout if limit is None else min(limit, timeout)
+                for limit in self.pool_config.requests_timeout()
+            )
+        opened = getattr(self._local, 'opened', 0)
+        response = super().send(request, timeout=timeout, **kwargs)
+        if getattr(self._local, 'opened', 0) == opened:
+            self.stats.reused_one()
+        return response
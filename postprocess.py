@@ -0,0 +1,256 @@
+"""
+This module provides the CPU-bound post-processing of downloaded images in a process pool.
+
+It includes:
+- The `PostProcessor` class running pluggable steps over every saved file in a
+  `ProcessPoolExecutor` and bounding the files waiting for it.
+- The `ProcessedPath` class: the path of a saved file carrying the results of the steps.
+- The built-in steps `verify_image`, `image_info` and `Thumbnail` (requires Pillow).
+
+A step is a picklable callable `step(path, data)` receiving the file path and its bytes,
+read once per file in the worker process; its return value is stored under the step's
+name. A step raising an exception fails the URL with `DownloadError`. While
+`max_pending` files wait for the pool, the downloaders take no new URLs, so a slow CPU
+stage throttles the downloads instead of piling up work.
+"""  # noqa: E501
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import sqlite3
+import struct
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import suppress
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple, Union
+
+from formats import FormatRegistry
+from storage import member_location, read_stored
+from utils import DownloadError
+
+Step = Callable[[str, bytes], Any]
+
+
+class ProcessedPath(str):
+    """The path of a saved file; `processed` maps step names to their results."""
+
+    def __new__(cls, path: str, processed: Dict[str, Any]):
+        instance = super().__new__(cls, path)
+        instance.processed = processed
+        return instance
+
+    def __reduce__(self):
+        return ProcessedPath, (str(self), self.processed)
+
+
+# Манифест и дедупликация пишут путь в SQLite, который не принимает подклассы str
+sqlite3.register_adapter(ProcessedPath, str)
+
+
+def _run_steps(url: str, path: str, steps: Dict[str, Step]) -> Dict[str, Any]:
+    """Worker process: read the file once and run every step over it."""
+    data = read_stored(path)
+    processed = {}
+    for name, step in steps.items():
+        try:
+            processed[name] = step(path, data)
+        except Exception as error:
+            raise DownloadError(url, f'Post-processing {name} failed: {error}') from None
+    return processed
+
+
+class PostProcessor:
+    """
+    Pool of worker processes running post-processing steps over downloaded files.
+
+    The pool is started by the first `submit` and stopped by `close`, which the
+    downloaders call at the end of a run.
+
+    Args:
+        steps (Mapping[str, Step]): Steps by name, run in order; each must be picklable, e.g. a module-level function.
+        workers (int, optional): Number of worker processes. Defaults to the number of CPU cores.
+        max_pending (int, optional): Files submitted and not yet processed before downloads pause. Defaults to twice `workers`.
+    """  # noqa: E501
+
+    def __init__(
+        self,
+        steps: Mapping[str, Step],
+        workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+    ):
+        self.steps = dict(steps)
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 2
+        self.processed = 0
+        self.failed = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, url: str, path: str) -> Future:
+        """Queue a saved file for the steps without waiting for them."""
+        with self._lock:
+            if self._executor is None:
+                # spawn: воркер не наследует потоки и соединения загрузчика
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self._executor.submit(_run_steps, url, path, self.steps)
+
+    def result(
+        self, url: str, path: str, future: Future,
+    ) -> Union[ProcessedPath, Exception]:
+        """Return the path with the results of a finished `submit`, or its error."""
+        try:
+            processed = future.result()
+        except Exception as error:
+            if not isinstance(error, DownloadError):
+                error = DownloadError(url, f'Post-processing failed: {error!r}')
+            with self._lock:
+                self.failed += 1
+            logging.warning(f'{error} | URL => {url}')
+            return error
+        with self._lock:
+            self.processed += 1
+        return ProcessedPath(path, processed)
+
+    def run(self, url: str, path: str) -> Union[ProcessedPath, Exception]:
+        """Process one file and wait for the result."""
+        return self.result(url, path, self.submit(url, path))
+
+    async def run_async(self, url: str, path: str) -> Union[ProcessedPath, Exception]:
+        """Process one file, waiting for the result without blocking the event loop."""
+        future = self.submit(url, path)
+        with suppress(Exception):
+            # Ошибку шага разбирает result()
+            await asyncio.wrap_future(future)
+        return self.result(url, path, future)
+
+    def close(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def log_stats(self) -> None:
+        logging.info(
+            f'Post-processing | processed {self.processed} | failed {self.failed}',
+        )
+
+
+_registry = FormatRegistry()
+
+
+def verify_image(path: str, data: bytes) -> bool:
+    """Step: raise if the body is not a complete image, e.g. a truncated download."""
+    image_format = _registry.sniff(data)
+    if image_format is None:
+        raise ValueError('unknown image format')
+    body = data.rstrip(b'\0')
+    complete = {
+        'jpg': lambda: body.endswith(b'\xff\xd9'),
+        'png': lambda: b'IEND' in body[-12:],
+        'gif': lambda: body.endswith(b';'),
+        'webp': lambda: int.from_bytes(data[4:8], 'little') + 8 <= len(data),
+    }.get(image_format.extension, lambda: True)
+    if not complete():
+        raise ValueError(f'truncated {image_format.extension}')
+    return True
+
+
+def image_info(path: str, data: bytes) -> Dict[str, Any]:
+    """Step: format, width, height and size in bytes, read from the image header."""
+    image_format = _registry.sniff(data)
+    extension = image_format.extension if image_format is not None else None
+    width, height = _dimensions(extension, data)
+    return {'format': extension, 'width': width, 'height': height, 'size': len(data)}
+
+
+def _dimensions(extension: Optional[str], data: bytes) -> Tuple[Optional[int], ...]:
+    try:
+        if extension == 'png':
+            return struct.unpack('>II', data[16:24])
+        if extension == 'gif':
+            return struct.unpack('<HH', data[6:10])
+        if extension == 'bmp':
+            width, height = struct.unpack('<ii', data[18:26])
+            return width, abs(height)
+        if extension == 'webp':
+            return _webp_dimensions(data)
+        if extension == 'jpg':
+            return _jpeg_dimensions(data)
+    except struct.error:
+        pass
+    return None, None
+
+
+def _webp_dimensions(data: bytes) -> Tuple[Optional[int], ...]:
+    chunk = data[12:16]
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3fff, height & 0x3fff
+    if chunk == b'VP8L':
+        bits = int.from_bytes(data[21:25], 'little')
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    if chunk == b'VP8X':
+        return (
+            int.from_bytes(data[24:27], 'little') + 1,
+            int.from_bytes(data[27:30], 'little') + 1,
+        )
+    return None, None
+
+
+def _jpeg_dimensions(data: bytes) -> Tuple[Optional[int], ...]:
+    # Размер лежит в маркере SOF: идем по сегментам до первого из них
+    position = 2
+    while position + 9 <= len(data):
+        if data[position] != 0xff:
+            break
+        marker = data[position + 1]
+        length = struct.unpack('>H', data[position + 2:position + 4])[0]
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>HH', data[position + 5:position + 9])
+            return width, height
+        position += 2 + length
+    return None, None
+
+
+class Thumbnail:
+    """
+    Step: save a thumbnail that fits into `size` and return its path; requires Pillow.
+
+    Args:
+        size (Tuple[int, int], optional): Maximum width and height. Defaults to 256x256.
+        folder (str, optional): Folder for thumbnails. Defaults to `thumbnails/` next to the image.
+        quality (int, optional): JPEG quality of the thumbnail.
+    """  # noqa: E501
+
+    def __init__(
+        self, size: Tuple[int, int] = (256, 256), folder: Optional[str] = None,
+        quality: int = 85,
+    ):
+        self.size = size
+        self.folder = folder
+        self.quality = quality
+
+    def path_for(self, path: str) -> str:
+        """Thumbnail path of a saved file; a shard member is named by its shard and offset."""  # noqa: E501
+        location = member_location(path)
+        source = path if location is None else location[0]
+        name = os.path.splitext(os.path.basename(source))[0]
+        if location is not None:
+            # У всех членов шарда один файл, различаются они смещением
+            name = f'{name}-{location[1]}'
+        folder = self.folder or os.path.join(os.path.dirname(source), 'thumbnails')
+        return os.path.join(folder, f'{name}.jpg')
+
+    def __call__(self, path: str, data: bytes) -> str:
+        # Pillow нужен только этому шагу, поэтому импортируется в воркере
+        from PIL import Image
+
+        thumbnail_path = self.path_for(path)
+        os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+        with Image.open(io.BytesIO(data)) as image:
+            image.thumbnail(self.size)
+            image.convert('RGB').save(thumbnail_path, 'JPEG', quality=self.quality)
+        return thumbnail_path
@@ -0,0 +1,186 @@
+"""
+This module provides parallel ranged downloads of large bodies.
+
+It includes:
+- The `RangePolicy` class deciding when and how a body is split into byte ranges.
+- The `PartialFile` class writing ranges at their offsets of a preallocated file and
+  keeping the progress of every range in a sidecar, so an interrupted download resumes.
+- The `parse_content_range` function reading the `Content-Range` header.
+
+The first request of a URL asks for `bytes=0-<threshold - 1>`. A server without range
+support answers `200` with the whole body, which is streamed as usual; a small body fits
+into the first range; a larger one is split and the remaining ranges are fetched over
+extra connections while the first one is still streaming.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from utils import preallocate, remove_file
+
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+
+@dataclass(frozen=True)
+class RangePolicy:
+    """
+    When and how bodies are split into byte ranges.
+
+    Attributes:
+        threshold (int): Bodies larger than this many bytes are split; it is also the size of the first range.
+        parts (int): Maximum number of ranges, and of connections used for one body.
+        min_part_size (int): Ranges are never made smaller than this, so small excesses are not split.
+    """  # noqa: E501
+    threshold: int = 8 * 1024 * 1024
+    parts: int = 4
+    min_part_size: int = 1024 * 1024
+
+    def first_range(self) -> str:
+        return f'bytes=0-{self.threshold - 1}'
+
+    def split(self, start: int, total: int) -> List[Tuple[int, int]]:
+        """Split `[start, total)` into up to `parts - 1` inclusive ranges."""
+        length = total - start
+        count = max(1, min(self.parts - 1, length // self.min_part_size))
+        size = -(-length // count)
+        return [
+            (offset, min(offset + size, total) - 1)
+            for offset in range(start, total, size)
+        ]
+
+
+def parse_content_range(value: Optional[str]) -> Optional[Tuple[int, int, int]]:
+    """Parse `bytes <first>-<last>/<total>`; `None` if absent or the total is unknown."""
+    match = CONTENT_RANGE.fullmatch(value.strip()) if value else None
+    if match is None:
+        return None
+    return tuple(int(group) for group in match.groups())
+
+
+def if_range(etag: Optional[str], last_modified: Optional[str]) -> Optional[str]:
+    """Pick the validator for `If-Range`: a strong ETag, else `Last-Modified`."""
+    if etag and not etag.startswith('W/'):
+        return etag
+    return last_modified
+
+
+class PartialFile:
+    """
+    Preallocated `<folder>/<url hash>.ranged.part` file with a JSON sidecar of progress.
+
+    Every range is `[start, end, next]`, `next` being its first byte not yet written; a
+    range is written by one connection only, so the offsets never overlap.
+
+    Args:
+        folder (str): Folder the partial file is kept in until it is complete.
+        url (str): The URL, which gives the file a stable name across runs.
+    """
+
+    def __init__(self, folder: str, url: str):
+        name = hashlib.sha256(url.encode()).hexdigest()[:32]
+        self.path = os.path.join(folder, f'{name}.ranged.part')
+        self.state_path = f'{self.path}.json'
+        self.state: Optional[dict] = None
+        self._fd = None
+        self._lock = threading.Lock()
+        if os.path.exists(self.path) and os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r') as file:
+                    self.state = json.load(file)
+            except ValueError:
+                self.state = None
+
+    @property
+    def ranges(self) -> List[List[int]]:
+        return self.state['ranges']
+
+    def validator(self) -> Optional[str]:
+        return if_range(self.state['etag'], self.state['last_modified'])
+
+    def matches(
+        self, total: int, etag: Optional[str], last_modified: Optional[str],
+    ) -> bool:
+        """Whether the saved progress belongs to the same version of the body."""
+        state = self.state
+        return (
+            state is not None and state['total'] == total
+            and (etag, last_modified) == (state['etag'], state['last_modified'])
+            and if_range(etag, last_modified) is not None
+        )
+
+    def missing(self) -> List[int]:
+        """Indices of ranges not written completely."""
+        return [
+            index for index, (_, end, next_) in enumerate(self.ranges) if next_ <= end
+        ]
+
+    def resume_header(self) -> Optional[str]:
+        """`Range` of the first unfinished range if there is progress to resume."""
+        if self.state is None or self.validator() is None or not self.missing():
+            return None
+        _, end, next_ = self.ranges[self.missing()[0]]
+        return f'bytes={next_}-{end}'
+
+    def begin(
+        self,
+        total: int,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        ranges: List[Tuple[int, int]],
+    ) -> None:
+        """Start a new body: preallocate the file and save the range plan."""
+        self.state = {
+            'total': total, 'etag': etag, 'last_modified': last_modified,
+            'ranges': [[start, end, start] for start, end in ranges],
+        }
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        preallocate(self._fd, total)
+        os.ftruncate(self._fd, total)
+        self.save()
+
+    def open(self) -> None:
+        """Reopen a file with saved progress for resuming."""
+        self._fd = os.open(self.path, os.O_RDWR)
+
+    def write(self, index: int, chunk: bytes) -> None:
+        """Write the next chunk of range `index` at its offset."""
+        rng = self.ranges[index]
+        if rng[2] + len(chunk) > rng[1] + 1:
+            raise ValueError(f'Range {rng[0]}-{rng[1]} received too many bytes')
+        os.pwrite(self._fd, chunk, rng[2])
+        rng[2] += len(chunk)
+
+    def save(self) -> None:
+        """Atomically write the progress sidecar."""
+        with self._lock:
+            temp_path = f'{self.state_path}.tmp'
+            with open(temp_path, 'w') as file:
+                json.dump(self.state, file)
+            os.replace(temp_path, self.state_path)
+
+    def commit(self) -> str:
+        """Close the complete file and drop its sidecar; the caller moves the file into storage."""  # noqa: E501
+        self._close()
+        remove_file(self.state_path)
+        return self.path
+
+    def suspend(self) -> None:
+        """Save progress and close the file, keeping both for a later attempt."""
+        if self._fd is not None:
+            self.save()
+        self._close()
+
+    def discard(self) -> None:
+        self._close()
+        self.state = None
+        remove_file(self.path)
+        remove_file(self.state_path)
+
+    def _close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,117 @@
+"""
+This module provides the retry policy shared by the async and multithreaded downloaders.
+
+It includes:
+- The `RetryPolicy` class deciding whether and when a failed attempt is retried.
+- The `parse_retry_after` function to read the `Retry-After` header.
+"""
+import random
+import time
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple, Type
+
+from utils import DownloadError
+
+# Статусы, которые обычно означают временную проблему на стороне сервера.
+# Значение - собственный лимит попыток для статуса (None - общий max_attempts)
+DEFAULT_RETRY_STATUSES = {
+    408: None,
+    425: None,
+    429: None,
+    500: None,
+    502: None,
+    503: None,
+    504: None,
+}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Convert a `Retry-After` header (seconds or HTTP date) into a delay in seconds."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Exponential backoff with jitter for failed download attempts.
+
+    Attributes:
+        max_attempts (int): Total number of attempts per URL, including the first one.
+        backoff_base (float): Delay before the first retry, doubled on every next one.
+        backoff_max (float): Upper bound for the computed backoff delay.
+        jitter (float): Fraction of the delay that is randomized (0 - none, 1 - full jitter).
+        retry_statuses (Dict[int, Optional[int]]): Retryable statuses and their own attempt limits.
+        respect_retry_after (bool): Wait at least as long as the server's `Retry-After` asks.
+        max_retry_after (float): Cap for `Retry-After`; longer requests are not retried.
+    """  # noqa: E501
+    max_attempts: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 30.0
+    jitter: float = 1.0
+    retry_statuses: Dict[int, Optional[int]] = field(
+        default_factory=lambda: dict(DEFAULT_RETRY_STATUSES),
+    )
+    respect_retry_after: bool = True
+    max_retry_after: float = 120.0
+
+    def backoff(self, attempt: int) -> float:
+        """Return the jittered exponential delay after the given (1-based) attempt."""
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        return delay - random.uniform(0, delay * self.jitter)
+
+    def retry_delay(
+        self,
+        attempt: int,
+        status: Optional[int] = None,
+        retry_after: Optional[float] = None,
+    ) -> Optional[float]:
+        """
+        Decide whether a failed attempt should be retried.
+
+        Args:
+            attempt (int): Number of the attempt that has just failed, starting from 1.
+            status (int, optional): HTTP status of the failure, `None` for network errors.
+            retry_after (float, optional): Delay requested by the server, in seconds.
+
+        Returns:
+            float, optional: Seconds to wait before the next attempt, `None` to give up.
+        """
+        max_attempts = self.max_attempts
+        if status is not None:
+            if status not in self.retry_statuses:
+                return None
+            max_attempts = self.retry_statuses[status] or max_attempts
+        if attempt >= max_attempts:
+            return None
+
+        delay = self.backoff(attempt)
+        if retry_after is not None and self.respect_retry_after:
+            if retry_after > self.max_retry_after:
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+    def delay_for(
+        self,
+        attempt: int,
+        error: Exception,
+        transient_errors: Tuple[Type[BaseException], ...],
+    ) -> Optional[float]:
+        """Return the retry delay for an error raised by a download attempt, if any."""
+        if isinstance(error, DownloadError):
+            if error.status is None:
+                return None
+            return self.retry_delay(attempt, error.status, error.retry_after)
+        if isinstance(error, transient_errors):
+            return self.retry_delay(attempt)
+        return None
@@ -1,30 +1,400 @@
+import argparse
 import asyncio
+import logging
+import os
+from dataclasses import replace
+from typing import Optional
 
 from async_download import main as async_download
+from cache import HttpCache
+from deadlines import DeadlinePolicy, Hedger
+from dedup import Deduplicator
+from formats import DEFAULT_FORMATS, FormatRegistry
+from limits import AIMDController, ByteBudget, HostLimit, HostLimiter
+from multiprocess_download import main as multiprocess_download
 from multithreaded_download import main as multithreaded_download
+from manifest import Manifest
+from metrics import Metrics
+from pool import PoolConfig
+from postprocess import PostProcessor, Thumbnail, image_info, verify_image
+from ranges import RangePolicy
+from retry import RetryPolicy
+from storage import ContentAddressedStorage, FileStorage, ShardStorage
 from utils import setup_logging
 
+# Шаги постобработки, доступные из командной строки
+POSTPROCESS_STEPS = {
+    'verify': verify_image,
+    'info': image_info,
+    'thumbnail': Thumbnail(),
+}
+
+DEFAULT_URLS = [
+    'https://cdn.pixabay.com/photo/2017/06/04/23/57/stem-2372543_640.png',  # noqa: E50
+    'https://docs.aiohttp.org/en/stable/',  # noqa: E501
+    'https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcTbhGz3EHmtHBkrjYLUhhTWcfZaJFT1h_4M2w&s',  # noqa: E501
+    'https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcTKRr-HtArLFdW-OnHtCsS-Gg9gYwwYQ08xQA&s',  # noqa: E501
+    'https://hugh.cdn.rumble.cloud/s/z8/c/B/H/j/cBHja.caa-happyanimals212-rr8nk2.jpeg',  # noqa: E501
+    'https://www.womansworld.com/wp-content/uploads/2019/12/39-funny-animal-memes-that-are-impawsible-not-to-laugh-at-01-17.jpg?w=640',  # noqa: E501
+    'https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcRl2TQzoCaOsJGnRk7UUSMUjD7bOhV6qyCQ9Q&s',  # noqa: E501
+    'https://hips.hearstapps.com/redbook/assets/17/35/1504024434-lionlead.jpg',  # noqa: E501
+    'https://www.liveabout.com/thmb/F8TGD3J_sEVFQCXMr-lrAOZAW8k=/1500x0/filters:no_upscale():max_bytes(150000):strip_icc()/dog-funny-face-58b8ecd55f9b58af5c9bd15d.jpg',  # noqa: E501
+    'https://mymodernmet.com/wp/wp-content/uploads/archive/5jlLAXGFyrZYC1du9Wxm_1082119659.jpeg',  # noqa: E501
+    'https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcR9FUr4VB-2UzG83w4CMGIk77ai4nn-MhKpKw&s',  # noqa: E501
+    'https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcQ_QgCrFTnj74rZhAOtuHlpFMTyYOb0M8jtPA&s',  # noqa: E501
+    'https://www.tutorialspoiddddnt.com/online_python_formatter.htm',  # noqa: E501
+]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Download images from a list of URLs.')
+    parser.add_argument(
+        'source', nargs='?',
+        help="File with one URL per line, or '-' for stdin. Defaults to built-in URLs.",
+    )
+    parser.add_argument(
+        '--mode', choices=['async', 'multithreaded', 'multiprocess', 'all'],
+        default='all', help='Download mode. Defaults to running each of them.',
+    )
+    parser.add_argument('--max-active-tasks', type=int, default=5)
+    parser.add_argument('--folder', default='downloads/')
+    parser.add_argument(
+        '--processes', type=int,
+        help='Worker processes of the multiprocess mode. Defaults to the core count.',
+    )
+    parser.add_argument(
+        '--max-attempts', type=int, default=3,
+        help='Attempts per URL for transient errors (429, 5xx, connection resets).',
+    )
+    parser.add_argument(
+        '--host-concurrency', type=int,
+        help='Maximum simultaneous requests to a single host.',
+    )
+    parser.add_argument(
+        '--host-rate', type=float,
+        help='Maximum requests per second to a single host.',
+    )
+    parser.add_argument(
+        '--adaptive', type=int, metavar='MAX_LIMIT',
+        help='Tune concurrency at runtime between 1 and MAX_LIMIT, '
+             'starting from --max-active-tasks.',
+    )
+    parser.add_argument(
+        '--content-addressed', action='store_true',
+        help='Store each unique image once under its SHA-256 in sharded folders.',
+    )
+    parser.add_argument(
+        '--shards', type=float, metavar='MB',
+        help='Pack images into tar shards of about this many megabytes '
+             'instead of one file per image.',
+    )
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='Keep a job manifest in the folder; a re-run skips finished URLs.',
+    )
+    parser.add_argument(
+        '--dedup', action='store_true',
+        help='Download URLs equal after normalization (host case, default port, '
+             'fragment, query order) once.',
+    )
+    parser.add_argument(
+        '--dedup-capacity', type=int, metavar='URLS',
+        help='Keep only a Bloom filter sized for this many unique URLs in memory and '
+             'the exact keys in a file in the folder (with --dedup).',
+    )
+    parser.add_argument(
+        '--cache', action='store_true',
+        help='Send If-None-Match/If-Modified-Since and reuse files on 304 Not Modified.',
+    )
+    parser.add_argument(
+        '--cache-max-entries', type=int,
+        help='Keep at most this many cache entries, evicting the least recently used.',
+    )
+    parser.add_argument(
+        '--cache-max-age', type=float, metavar='DAYS',
+        help='Forget cache entries older than this many days.',
+    )
+    parser.add_argument(
+        '--range-threshold', type=float, metavar='MB',
+        help='Fetch bodies larger than this as parallel byte ranges (async and '
+             'multiprocess modes); partial files are resumed.',
+    )
+    parser.add_argument(
+        '--range-parts', type=int, default=4,
+        help='Maximum ranges and connections per body. Defaults to 4.',
+    )
+    parser.add_argument(
+        '--pool-size', type=int,
+        help='Total pooled connections. Defaults to the concurrency.',
+    )
+    parser.add_argument(
+        '--pool-per-host', type=int,
+        help='Pooled connections per host. Defaults to the concurrency.',
+    )
+    parser.add_argument(
+        '--keepalive', type=float, metavar='SECONDS',
+        help='Seconds an idle connection is kept open (async modes).',
+    )
+    parser.add_argument(
+        '--dns-ttl', type=float, metavar='SECONDS',
+        help='Seconds a resolved address is reused (async modes); 0 disables the cache.',
+    )
+    parser.add_argument('--connect-timeout', type=float, metavar='SECONDS')
+    parser.add_argument('--read-timeout', type=float, metavar='SECONDS')
+    parser.add_argument(
+        '--total-timeout', type=float, metavar='SECONDS',
+        help='Limit for a whole request including the body (async modes).',
+    )
+    parser.add_argument(
+        '--request-deadline', type=float, metavar='SECONDS',
+        help='Give up a URL after this long, retries included.',
+    )
+    parser.add_argument(
+        '--job-deadline', type=float, metavar='SECONDS',
+        help='Stop the run after this long; unfinished URLs fail.',
+    )
+    parser.add_argument(
+        '--hedge', type=float, metavar='PERCENTILE',
+        help='Duplicate requests slower than this percentile of observed response '
+             'times, e.g. 95 (async and multiprocess modes).',
+    )
+    parser.add_argument(
+        '--hedge-budget', type=float, default=0.05,
+        help='Maximum duplicate requests as a share of all requests. Defaults to 0.05.',
+    )
+    parser.add_argument(
+        '--max-size', type=float, metavar='MB',
+        help='Reject bodies larger than this many megabytes.',
+    )
+    parser.add_argument(
+        '--byte-budget', type=float, metavar='MB',
+        help='Maximum response body megabytes in flight; body reads wait while '
+             'it is used up.',
+    )
+    parser.add_argument(
+        '--formats', metavar='EXTENSIONS',
+        help='Comma-separated image formats to accept, e.g. jpg,png. Defaults to '
+             + ','.join(image_format.extension for image_format in DEFAULT_FORMATS)
+             + '.',
+    )
+    parser.add_argument(
+        '--postprocess', metavar='STEPS',
+        help='Comma-separated steps run over every saved file in a process pool: '
+             + ', '.join(POSTPROCESS_STEPS) + ' (thumbnail requires Pillow).',
+    )
+    parser.add_argument(
+        '--postprocess-workers', type=int,
+        help='Post-processing processes. Defaults to the number of CPU cores.',
+    )
+    parser.add_argument(
+        '--metrics-file',
+        help='Write metrics in the Prometheus text format to this file after each mode.',
+    )
+    parser.add_argument(
+        '--metrics-port', type=int,
+        help='Serve Prometheus metrics on http://127.0.0.1:PORT/metrics while running.',
+    )
+    args = parser.parse_args()
+    if args.postprocess:
+        unknown = set(args.postprocess.split(',')) - set(POSTPROCESS_STEPS)
+        if unknown:
+            parser.error(f'unknown post-processing steps: {", ".join(sorted(unknown))}')
+    if args.source == '-' and args.mode == 'all':
+        parser.error("stdin can be read only once, choose a single --mode")
+    return args
+
+
+def make_adaptive(args: argparse.Namespace) -> Optional[AIMDController]:
+    if args.adaptive is None:
+        return None
+    return AIMDController(min_limit=1, max_limit=args.adaptive)
+
+
+def make_storage(args: argparse.Namespace):
+    if args.content_addressed:
+        return ContentAddressedStorage(args.folder)
+    # С манифестом повторная загрузка после сбоя перезаписывает тот же файл
+    stable_names = bool(args.resume)
+    if args.shards:
+        # Постобработка читает файл сразу после записи, поэтому шард сбрасывается
+        return ShardStorage(
+            args.folder, int(args.shards * 1024 * 1024),
+            flush_members=bool(args.postprocess), stable_names=stable_names,
+        )
+    return FileStorage(args.folder, stable_names=stable_names)
+
+
+def make_manifest(args: argparse.Namespace, mode: str) -> Optional[Manifest]:
+    if not args.resume:
+        return None
+    # У каждого режима свой манифест, чтобы режим 'all' не пропускал второй прогон
+    return Manifest(os.path.join(args.folder, f'manifest-{mode}.sqlite'))
+
+
+def make_dedup(args: argparse.Namespace, mode: str) -> Optional[Deduplicator]:
+    if not args.dedup:
+        return None
+    if args.dedup_capacity is None:
+        return Deduplicator()
+    return Deduplicator(
+        os.path.join(args.folder, f'dedup-{mode}.sqlite'), capacity=args.dedup_capacity,
+    )
+
+
+def make_cache(args: argparse.Namespace, mode: str) -> Optional[HttpCache]:
+    if not args.cache:
+        return None
+    max_age = args.cache_max_age * 24 * 3600 if args.cache_max_age else None
+    return HttpCache(
+        os.path.join(args.folder, f'http_cache-{mode}.sqlite'),
+        max_entries=args.cache_max_entries, max_age=max_age,
+    )
+
+
+def make_ranges(args: argparse.Namespace) -> Optional[RangePolicy]:
+    if args.range_threshold is None:
+        return None
+    return RangePolicy(
+        threshold=int(args.range_threshold * 1024 * 1024), parts=args.range_parts,
+    )
+
+
+def make_pool(args: argparse.Namespace) -> PoolConfig:
+    # Незаданные флаги оставляют значения PoolConfig по умолчанию
+    options = {
+        'max_connections': args.pool_size,
+        'max_per_host': args.pool_per_host,
+        'keepalive_timeout': args.keepalive,
+        'dns_ttl': args.dns_ttl,
+        'connect_timeout': args.connect_timeout,
+        'read_timeout': args.read_timeout,
+        'total_timeout': args.total_timeout,
+    }
+    pool = PoolConfig(**{
+        key: value for key, value in options.items() if value is not None
+    })
+    if args.dns_ttl == 0:
+        pool = replace(pool, dns_ttl=None)
+    return pool
+
+
+def make_deadlines(args: argparse.Namespace) -> Optional[DeadlinePolicy]:
+    if args.request_deadline is None and args.job_deadline is None:
+        return None
+    return DeadlinePolicy(request=args.request_deadline, job=args.job_deadline)
+
+
+def make_hedger(args: argparse.Namespace) -> Optional[Hedger]:
+    if args.hedge is None:
+        return None
+    return Hedger(percentile=args.hedge, max_extra=args.hedge_budget)
+
+
+def make_formats(args: argparse.Namespace) -> FormatRegistry:
+    formats = DEFAULT_FORMATS
+    if args.formats:
+        accepted = {extension.strip().lower() for extension in args.formats.split(',')}
+        formats = [
+            image_format for image_format in DEFAULT_FORMATS
+            if image_format.extension in accepted
+        ]
+    max_size = int(args.max_size * 1024 * 1024) if args.max_size else None
+    return FormatRegistry(formats, max_size=max_size)
+
+
+def make_budget(args: argparse.Namespace) -> Optional[ByteBudget]:
+    if not args.byte_budget:
+        return None
+    return ByteBudget(int(args.byte_budget * 1024 * 1024))
+
+
+def make_postprocess(args: argparse.Namespace) -> Optional[PostProcessor]:
+    if not args.postprocess:
+        return None
+    steps = {name: POSTPROCESS_STEPS[name] for name in args.postprocess.split(',')}
+    return PostProcessor(steps, workers=args.postprocess_workers)
+
+
+def run_with_metrics(args: argparse.Namespace, mode: str, download) -> None:
+    """Call `download(metrics)` with a fresh registry, exposing it as the flags ask."""
+    if args.metrics_file is None and args.metrics_port is None:
+        download(None)
+        return
+    metrics = Metrics()
+    server = metrics.serve(args.metrics_port) if args.metrics_port else None
+    try:
+        download(metrics)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    if args.metrics_file:
+        path = args.metrics_file
+        # В режиме 'all' у каждого режима свой файл
+        if args.mode == 'all':
+            root, extension = os.path.splitext(path)
+            path = f'{root}-{mode}{extension}'
+        metrics.write_prometheus(path)
+
 
 def main():
-    urls = [
-        'https://cdn.pixabay.com/photo/2017/06/04/23/57/stem-2372543_640.png',  # noqa: E50
-        'https://docs.aiohttp.org/en/stable/',  # noqa: E501
-        'https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcTbhGz3EHmtHBkrjYLUhhTWcfZaJFT1h_4M2w&s',  # noqa: E501
-        'https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcTKRr-HtArLFdW-OnHtCsS-Gg9gYwwYQ08xQA&s',  # noqa: E501
-        'https://hugh.cdn.rumble.cloud/s/z8/c/B/H/j/cBHja.caa-happyanimals212-rr8nk2.jpeg',  # noqa: E501
-        'https://www.womansworld.com/wp-content/uploads/2019/12/39-funny-animal-memes-that-are-impawsible-not-to-laugh-at-01-17.jpg?w=640',  # noqa: E501
-        'https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcRl2TQzoCaOsJGnRk7UUSMUjD7bOhV6qyCQ9Q&s',  # noqa: E501
-        'https://hips.hearstapps.com/redbook/assets/17/35/1504024434-lionlead.jpg',  # noqa: E501
-        'https://www.liveabout.com/thmb/F8TGD3J_sEVFQCXMr-lrAOZAW8k=/1500x0/filters:no_upscale():max_bytes(150000):strip_icc()/dog-funny-face-58b8ecd55f9b58af5c9bd15d.jpg',  # noqa: E501
-        'https://mymodernmet.com/wp/wp-content/uploads/archive/5jlLAXGFyrZYC1du9Wxm_1082119659.jpeg',  # noqa: E501
-        'https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcR9FUr4VB-2UzG83w4CMGIk77ai4nn-MhKpKw&s',  # noqa: E501
-        'https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcQ_QgCrFTnj74rZhAOtuHlpFMTyYOb0M8jtPA&s',  # noqa: E501
-        'https://www.tutorialspoiddddnt.com/online_python_formatter.htm',  # noqa: E501
-    ]
+    args = parse_args()
     setup_logging()
-    max_active_tasks = 5
-    result_async = asyncio.run(async_download(urls, max_active_tasks))  # Асинхронная загрузка
-    result_multithreaded = multithreaded_download(urls, max_active_tasks)  # Мультипоточная загрузка
+    # Файл перечитывается лениво в каждом режиме, список используется как есть
+    urls = args.source or DEFAULT_URLS
+    max_active_tasks = args.max_active_tasks
+    retry_policy = RetryPolicy(max_attempts=args.max_attempts)
+    host_limit = HostLimit(max_concurrency=args.host_concurrency, rate=args.host_rate)
+    if args.mode in ('async', 'all'):
+        # Асинхронная загрузка
+        run_with_metrics(args, 'async', lambda metrics: asyncio.run(async_download(
+            urls, max_active_tasks, folder=args.folder, retry_policy=retry_policy,
+            host_limiter=HostLimiter(default=host_limit),
+            adaptive=make_adaptive(args), storage=make_storage(args),
+            manifest=make_manifest(args, 'async'), cache=make_cache(args, 'async'),
+            metrics=metrics, ranges=make_ranges(args), pool=make_pool(args),
+            deadlines=make_deadlines(args), hedger=make_hedger(args),
+            formats=make_formats(args), dedup=make_dedup(args, 'async'),
+            postprocess=make_postprocess(args), budget=make_budget(args),
+        )))
+    if args.mode in ('multithreaded', 'all'):
+        # Мультипоточная загрузка
+        if args.hedge is not None:
+            logging.warning('Multithreaded mode ignores --hedge')
+        run_with_metrics(args, 'multithreaded', lambda metrics: multithreaded_download(
+            urls, max_active_tasks, folder=args.folder, retry_policy=retry_policy,
+            host_limiter=HostLimiter(default=host_limit),
+            adaptive=make_adaptive(args), storage=make_storage(args),
+            manifest=make_manifest(args, 'multithreaded'),
+            cache=make_cache(args, 'multithreaded'), metrics=metrics,
+            pool=make_pool(args), deadlines=make_deadlines(args),
+            formats=make_formats(args), dedup=make_dedup(args, 'multithreaded'),
+            postprocess=make_postprocess(args), budget=make_budget(args),
+        ))
+    if args.mode in ('multiprocess', 'all'):
+        # Мультипроцессная загрузка: по циклу событий на каждое ядро
+        unsupported = [
+            flag for flag, value in (
+                ('--adaptive', args.adaptive),
+                ('--content-addressed', args.content_addressed),
+                ('--shards', args.shards),
+                ('--cache', args.cache),
+                ('--metrics-file', args.metrics_file),
+                ('--metrics-port', args.metrics_port),
+                ('--postprocess', args.postprocess),
+                ('--byte-budget', args.byte_budget),
+            ) if value
+        ]
+        if unsupported:
+            logging.warning(f'Multiprocess mode ignores {", ".join(unsupported)}')
+        multiprocess_download(
+            urls, max_active_tasks, folder=args.folder, processes=args.processes,
+            retry_policy=retry_policy, host_limiter=HostLimiter(default=host_limit),
+            manifest=make_manifest(args, 'multiprocess'), ranges=make_ranges(args),
+            pool=make_pool(args), deadlines=make_deadlines(args),
+            hedger=make_hedger(args), formats=make_formats(args),
+            dedup=make_dedup(args, 'multiprocess'),
+        )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,466 @@
+"""
+This module provides the storage backends the downloaders stream image bodies into.
+
+It includes:
+- The `FileStorage` class saving every download as its own uniquely named file (default).
+- The `ContentAddressedStorage` class saving each unique body once under its digest.
+- The `ShardStorage` class packing bodies into rolling tar shards with a URL index.
+- The `stored_size`, `stored_exists` and `read_stored` functions accepting either kind of
+  saved path: a file or a `<shard>#<offset>:<length>` member of a shard.
+
+A backend's `open` returns a writer with `write(chunk)`, `commit() -> path` and `abort()`;
+`close()` flushes whatever the backend keeps open. Writers are synchronous: the async
+downloader calls them through a thread pool. A backend may also `adopt` a complete file
+written elsewhere, e.g. by a ranged download; backends without it get no ranged downloads.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+from typing import BinaryIO, Dict, Optional, Protocol, Tuple
+
+from utils import generate_unique_name, preallocate, remove_file, temp_path_for
+
+MEMBER_PATH = re.compile(r'(.+)#(\d+):(\d+)')
+
+
+class StorageWriter(Protocol):
+    def write(self, chunk: bytes) -> None: ...
+
+    def commit(self) -> str: ...
+
+    def abort(self) -> None: ...
+
+
+class Storage(Protocol):
+    def open(
+        self, url: str, extension: str, size: Optional[int] = None,
+    ) -> StorageWriter: ...
+
+    def close(self) -> None: ...
+
+
+class FileWriter:
+    """Write a body into a temporary `.part` file and atomically rename it on commit."""
+
+    def __init__(self, file_path: str, size: Optional[int] = None):
+        self.file_path = file_path
+        self.temp_path = temp_path_for(file_path)
+        self.size = size
+        self.written = 0
+        self._file = open(self.temp_path, 'wb')
+        if size:
+            preallocate(self._file.fileno(), size)
+
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+        self.written += len(chunk)
+
+    def _close(self) -> None:
+        # Обрезаем лишнее, если Content-Length не совпал с телом
+        if self.size and self.written != self.size:
+            self._file.truncate(self.written)
+        self._file.close()
+
+    def commit(self) -> str:
+        """Finish the file and move it into place, so it never appears half-written."""
+        self._close()
+        os.replace(self.temp_path, self.file_path)
+        return self.file_path
+
+    def abort(self) -> None:
+        self._file.close()
+        remove_file(self.temp_path)
+
+
+class FileStorage:
+    """
+    Default backend: one file per download named `{timestamp}_{uuid}.{extension}`.
+
+    Args:
+        folder (str): The folder where downloaded files are saved.
+        stable_names (bool, optional): Name files by a hash of the URL instead, so a
+            resumed job overwrites its earlier attempt rather than leaving a second copy.
+    """
+
+    def __init__(self, folder: str, stable_names: bool = False):
+        self.folder = folder
+        self.stable_names = stable_names
+
+    def open(self, url: str, extension: str, size: Optional[int] = None) -> FileWriter:
+        """
+        Start writing the body of `url`.
+
+        Args:
+            url (str): The URL the body comes from.
+            extension (str): File extension matching the content type.
+            size (int, optional): Expected body size to preallocate, if known.
+        """
+        return FileWriter(self._path_for(url, extension), size)
+
+    def adopt(self, url: str, extension: str, path: str) -> str:
+        """Move a complete file of `url` to the path `open` would have written it to."""
+        file_path = self._path_for(url, extension)
+        os.replace(path, file_path)
+        return file_path
+
+    def _path_for(self, url: str, extension: str) -> str:
+        if self.stable_names:
+            unique_name = hashlib.sha256(url.encode()).hexdigest()[:32]
+        else:
+            unique_name = generate_unique_name()
+        return os.path.join(self.folder, f'{unique_name}.{extension}')
+
+    def close(self) -> None:
+        pass
+
+
+class HashingWriter(FileWriter):
+    """File writer that hashes the body while it streams and stores it by digest."""
+
+    def __init__(
+        self,
+        storage: 'ContentAddressedStorage',
+        url: str,
+        extension: str,
+        size: Optional[int] = None,
+    ):
+        super().__init__(os.path.join(storage.folder, uuid.uuid4().hex), size)
+        self.storage = storage
+        self.url = url
+        self.extension = extension
+        self.hash = hashlib.new(storage.algorithm)
+
+    def write(self, chunk: bytes) -> None:
+        super().write(chunk)
+        self.hash.update(chunk)
+
+    def commit(self) -> str:
+        self._close()
+        return self.storage.store(
+            self.temp_path, self.hash.hexdigest(), self.extension, self.url,
+        )
+
+
+class ContentAddressedStorage:
+    """
+    Store each unique body once as `ab/cd/<digest>.<extension>` and map URLs to digests.
+
+    The digest is computed while the body streams, so deduplication costs no extra read.
+    Sharded subdirectories keep any single directory small even for millions of files.
+
+    Args:
+        folder (str): Root folder of the blob store.
+        depth (int, optional): Number of nested shard directories. Defaults to 2.
+        width (int, optional): Hex characters of the digest per shard level. Defaults to 2.
+        algorithm (str, optional): `hashlib` algorithm name. Defaults to 'sha256'.
+        index_name (str, optional): Append-only URL -> digest log inside the folder.
+    """  # noqa: E501
+
+    def __init__(
+        self,
+        folder: str,
+        depth: int = 2,
+        width: int = 2,
+        algorithm: str = 'sha256',
+        index_name: str = 'url_index.jsonl',
+    ):
+        self.folder = folder
+        self.depth = depth
+        self.width = width
+        self.algorithm = algorithm
+        self.index_path = os.path.join(folder, index_name)
+        self.duplicates = 0
+        self._lock = threading.Lock()
+        self._index = None
+
+    def path_for(self, digest: str, extension: str) -> str:
+        shards = [
+            digest[level * self.width:(level + 1) * self.width]
+            for level in range(self.depth)
+        ]
+        return os.path.join(self.folder, *shards, f'{digest}.{extension}')
+
+    def open(self, url: str, extension: str, size: Optional[int] = None) -> HashingWriter:
+        """Start writing the body of `url`; see `FileStorage.open`."""
+        return HashingWriter(self, url, extension, size)
+
+    def adopt(self, url: str, extension: str, path: str) -> str:
+        """Store a complete file of `url` written elsewhere; its digest is computed by reading it."""  # noqa: E501
+        digest = hashlib.new(self.algorithm)
+        with open(path, 'rb') as file:
+            while chunk := file.read(1024 * 1024):
+                digest.update(chunk)
+        return self.store(path, digest.hexdigest(), extension, url)
+
+    def store(self, temp_path: str, digest: str, extension: str, url: str) -> str:
+        """Move a finished temporary file under its digest unless that blob exists."""
+        file_path = self.path_for(digest, extension)
+        # Проверка и перенос под одной блокировкой: два одинаковых тела,
+        # скачанных одновременно, считаются одной копией и одним дублем
+        with self._lock:
+            duplicate = os.path.exists(file_path)
+            if duplicate:
+                self.duplicates += 1
+            else:
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                os.replace(temp_path, file_path)
+        if duplicate:
+            # Такое содержимое уже сохранено: второй копии не пишем
+            remove_file(temp_path)
+            logging.info(f'Duplicate content {digest[:12]} | URL => {url}')
+        self.remember(url, digest)
+        return file_path
+
+    def remember(self, url: str, digest: str) -> None:
+        """Append the URL -> digest pair to the index."""
+        line = json.dumps({'url': url, 'digest': digest}) + '\n'
+        with self._lock:
+            if self._index is None:
+                self._index = open(self.index_path, 'a', buffering=1)
+            self._index.write(line)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._index is not None:
+                self._index.close()
+                self._index = None
+
+    def load_index(self) -> Dict[str, str]:
+        """Read the URL -> digest mapping; later entries win."""
+        mapping = {}
+        if not os.path.exists(self.index_path):
+            return mapping
+        with open(self.index_path, 'r') as index:
+            for line in index:
+                entry = json.loads(line)
+                mapping[entry['url']] = entry['digest']
+        return mapping
+
+
+def member_path(shard: str, offset: int, length: int) -> str:
+    """Path of a body stored in a shard: `<shard>#<offset>:<length>`."""
+    return f'{shard}#{offset}:{length}'
+
+
+def member_location(path: str) -> Optional[Tuple[str, int, int]]:
+    """Return `(shard, offset, length)` of a shard member path, or `None` for a file."""
+    match = MEMBER_PATH.fullmatch(path)
+    if match is None or os.path.exists(path):
+        return None
+    return match.group(1), int(match.group(2)), int(match.group(3))
+
+
+def stored_size(path: str) -> int:
+    """Size in bytes of a saved body, a file or a shard member."""
+    location = member_location(path)
+    if location is None:
+        return os.path.getsize(path)
+    return location[2]
+
+
+def stored_exists(path: str) -> bool:
+    """Whether a saved body is still there; a member needs its shard written up to its end."""  # noqa: E501
+    location = member_location(path)
+    if location is None:
+        return os.path.exists(path)
+    shard, offset, length = location
+    return os.path.exists(shard) and os.path.getsize(shard) >= offset + length
+
+
+def read_stored(path: str) -> bytes:
+    """Read a saved body, a file or a shard member."""
+    location = member_location(path)
+    if location is None:
+        with open(path, 'rb') as file:
+            return file.read()
+    shard, offset, length = location
+    with open(shard, 'rb') as file:
+        file.seek(offset)
+        return file.read(length)
+
+
+class ShardWriter:
+    """Hold a body in memory, spilling a large one to disk, until it is packed into a shard."""  # noqa: E501
+
+    def __init__(self, storage: 'ShardStorage', url: str, extension: str):
+        self.storage = storage
+        self.url = url
+        self.extension = extension
+        self.written = 0
+        self._body = tempfile.SpooledTemporaryFile(storage.spool_size)
+
+    def write(self, chunk: bytes) -> None:
+        self._body.write(chunk)
+        self.written += len(chunk)
+
+    def commit(self) -> str:
+        try:
+            return self.storage.append(self.url, self.extension, self._body, self.written)
+        finally:
+            self._body.close()
+
+    def abort(self) -> None:
+        self._body.close()
+
+
+class ShardStorage:
+    """
+    Pack bodies into rolling tar shards `shard-000000.tar`, `shard-000001.tar`, ...
+
+    Every download becomes a tar member `<name>.<extension>`, as in WebDataset, appended
+    through one buffered writer per shard, so a million small images cost a few hundred
+    files instead of a million creates and renames. A shard is closed once the next
+    member would take it over `shard_size`. Bodies stream into memory and are appended
+    whole on commit, so concurrent downloads never interleave inside a shard.
+
+    The saved path of a body is `<shard>#<offset>:<length>`: `read_stored` reads it with
+    one seek. The URL -> (shard, offset, length) index is appended to `shard_index.jsonl`
+    only after the shard data it points to is flushed, so after a crash every indexed
+    member is readable.
+
+    Args:
+        folder (str): Folder for the shards and the index.
+        shard_size (int, optional): Shard size in bytes to roll over at. Defaults to 256 MiB.
+        spool_size (int, optional): Body size kept in memory before spilling it to a temporary file. Defaults to 1 MiB.
+        buffer_size (int, optional): Write buffer of the shard. Defaults to 1 MiB.
+        flush_members (bool, optional): Flush every member to the OS at once, so it can be read before the shard is closed, e.g. by post-processing.
+        stable_names (bool, optional): Name members by a hash of the URL instead of a unique name.
+        index_name (str, optional): Append-only URL index inside the folder.
+    """  # noqa: E501
+
+    def __init__(
+        self,
+        folder: str,
+        shard_size: int = 256 * 1024 * 1024,
+        spool_size: int = 1024 * 1024,
+        buffer_size: int = 1024 * 1024,
+        flush_members: bool = False,
+        stable_names: bool = False,
+        index_name: str = 'shard_index.jsonl',
+    ):
+        self.folder = folder
+        self.shard_size = shard_size
+        self.spool_size = spool_size
+        self.buffer_size = buffer_size
+        self.flush_members = flush_members
+        self.stable_names = stable_names
+        self.index_path = os.path.join(folder, index_name)
+        self.shards = 0
+        self._lock = threading.Lock()
+        self._shard = None
+        self._shard_path = None
+        self._position = 0
+        self._number = 0
+        self._index = None
+        # Строки индекса, чьи данные еще в буфере шарда, и сколько байт шарда сброшено
+        self._pending = []
+        self._flushed = 0
+
+    def open(self, url: str, extension: str, size: Optional[int] = None) -> ShardWriter:
+        """Start writing the body of `url`; see `FileStorage.open`."""
+        return ShardWriter(self, url, extension)
+
+    def adopt(self, url: str, extension: str, path: str) -> str:
+        """Append a complete file of `url` written elsewhere to the shard and remove it."""  # noqa: E501
+        with open(path, 'rb') as body:
+            member = self.append(url, extension, body, os.fstat(body.fileno()).st_size)
+        remove_file(path)
+        return member
+
+    def append(self, url: str, extension: str, body: BinaryIO, length: int) -> str:
+        """Append a finished body as the next tar member and return its path."""
+        if self.stable_names:
+            name = hashlib.sha256(url.encode()).hexdigest()[:32]
+        else:
+            name = generate_unique_name()
+        info = tarfile.TarInfo(f'{name}.{extension}')
+        info.size = length
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        header = info.tobuf(tarfile.USTAR_FORMAT)
+        padding = -length % tarfile.BLOCKSIZE
+        body.seek(0)
+        with self._lock:
+            end = self._position + len(header) + length + padding
+            if self._shard is None or (self._position and end > self.shard_size):
+                self._roll()
+            offset = self._position + len(header)
+            self._shard.write(header)
+            shutil.copyfileobj(body, self._shard)
+            self._shard.write(tarfile.NUL * padding)
+            self._position = offset + length + padding
+            shard = self._shard_path
+            self._pending.append({
+                'url': url, 'shard': os.path.basename(shard),
+                'offset': offset, 'length': length,
+            })
+            if self.flush_members or self._position - self._flushed >= self.buffer_size:
+                self._flush()
+        return member_path(shard, offset, length)
+
+    def _roll(self) -> None:
+        # Номер шарда подбирается так, чтобы не перезаписать шарды прошлых запусков
+        self._finish()
+        os.makedirs(self.folder, exist_ok=True)
+        while True:
+            path = os.path.join(self.folder, f'shard-{self._number:06d}.tar')
+            self._number += 1
+            try:
+                self._shard = open(path, 'xb', buffering=self.buffer_size)
+            except FileExistsError:
+                continue
+            break
+        self._shard_path = path
+        self._position = 0
+        self._flushed = 0
+        self.shards += 1
+
+    def _finish(self) -> None:
+        if self._shard is None:
+            return
+        # Два пустых блока - конец архива для tar
+        self._shard.write(tarfile.NUL * tarfile.BLOCKSIZE * 2)
+        self._flush()
+        self._shard.close()
+        self._shard = None
+
+    def _flush(self) -> None:
+        # Сначала данные шарда, потом указывающие на них строки индекса
+        self._shard.flush()
+        self._flushed = self._position
+        if not self._pending:
+            return
+        if self._index is None:
+            self._index = open(self.index_path, 'a')
+        self._index.write(''.join(json.dumps(entry) + '\n' for entry in self._pending))
+        self._index.flush()
+        self._pending.clear()
+
+    def close(self) -> None:
+        with self._lock:
+            self._finish()
+            if self._index is not None:
+                self._index.close()
+                self._index = None
+
+    def load_index(self) -> Dict[str, Tuple[str, int, int]]:
+        """Read the URL -> (shard path, offset, length) mapping; later entries win."""
+        mapping = {}
+        if not os.path.exists(self.index_path):
+            return mapping
+        with open(self.index_path, 'r') as index:
+            for line in index:
+                entry = json.loads(line)
+                mapping[entry['url']] = (
+                    os.path.join(self.folder, entry['shard']),
+                    entry['offset'], entry['length'],
+                )
+        return mapping
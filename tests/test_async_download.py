@@ -1,12 +1,28 @@
 import asyncio
 import os
+import threading
+import tracemalloc
 
 import pytest
 import aiohttp
-from aioresponses import aioresponses
-
-from ..async_download import download_image, main
-from ..utils import Counter
+from aioresponses import CallbackResult, aioresponses
+
+from ..async_download import (DownloadError, download_image, download_stream,
+                              main)
+from ..cache import HttpCache
+from ..limits import AIMDController, HostLimit, HostLimiter
+from ..manifest import Manifest
+from ..retry import RetryPolicy
+from ..storage import ContentAddressedStorage
+from ..utils import Counter, Progress
+
+# Тела начинаются с сигнатур форматов: загрузчик определяет формат по первым байтам
+FAKE_IMAGES = {
+    'image/jpeg': b'\xff\xd8\xff\xe0fake image data',
+    'image/png': b'\x89PNG\r\n\x1a\nfake image data',
+    'image/gif': b'GIF89afake image data',
+}
+FAKE_JPEG = FAKE_IMAGES['image/jpeg']
 
 
 @pytest.fixture
@@ -29,7 +45,7 @@ async def test_download_image_success(temp_folder, mock_urls):
     with aioresponses() as mock:
         for n, url in enumerate(mock_urls):
             mock.get(
-                url, status=200, body=b'fake image data',
+                url, status=200, body=FAKE_IMAGES[content_types[n]],
                 headers={'Content-Type': content_types[n]},
             )
 
@@ -100,7 +116,7 @@ async def test_main_function(temp_folder, mock_urls):
     with aioresponses() as mock:
         for url in mock_urls:
             mock.get(
-                url, status=200, body=b'fake image data',
+                url, status=200, body=FAKE_JPEG,
                 headers={'Content-Type': 'image/jpeg'},
             )
 
@@ -110,3 +126,291 @@ async def test_main_function(temp_folder, mock_urls):
 
         assert len(result) == len(mock_urls)
         assert len(os.listdir(temp_folder)) == len(mock_urls)
+
+
+async def _peak_memory_for_download(folder, size):
+    url = 'https://example.com/big.jpg'
+    with aioresponses() as mock:
+        mock.get(
+            url, status=200, body=FAKE_JPEG + b'\0' * (size - len(FAKE_JPEG)),
+            headers={'Content-Type': 'image/jpeg', 'Content-Length': str(size)},
+        )
+        session = aiohttp.ClientSession()
+
+        tracemalloc.start()
+        result = await download_image(
+            url, asyncio.Semaphore(1), session, Progress(), 1, str(folder),
+            preallocate_file=True,
+        )
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    await session.close()
+    assert os.path.getsize(result) == size
+    return peak
+
+
+@pytest.mark.asyncio
+async def test_download_image_streams_with_flat_memory(temp_folder):
+    small_peak = await _peak_memory_for_download(temp_folder, 1024 * 1024)
+    large_peak = await _peak_memory_for_download(temp_folder, 16 * 1024 * 1024)
+
+    assert large_peak < 1024 * 1024
+    assert large_peak < small_peak * 2
+    assert not [name for name in os.listdir(temp_folder) if name.endswith('.part')]
+
+
+@pytest.mark.asyncio
+async def test_main_bounded_pool_with_async_iterable(temp_folder):
+    urls = [f'https://example.com/image{n}.jpg' for n in range(50)]
+    failed_url = urls[7]
+    max_active_tasks = 3
+    tasks_seen = []
+
+    async def url_stream():
+        for url in urls:
+            tasks_seen.append(len(asyncio.all_tasks()))
+            yield url
+
+    with aioresponses() as mock:
+        for url in urls:
+            if url == failed_url:
+                mock.get(url, status=404)
+            else:
+                mock.get(
+                    url, status=200, body=FAKE_JPEG,
+                    headers={'Content-Type': 'image/jpeg'},
+                )
+
+        result = await main(url_stream(), max_active_tasks, folder=str(temp_folder))
+
+    assert len(result) == len(urls)
+    assert result[7] is None
+    assert all(path is not None for n, path in enumerate(result) if n != 7)
+    # Тестовая задача + пул + продюсер + воркеры, независимо от количества URL
+    assert max(tasks_seen) <= max_active_tasks + 3
+
+
+@pytest.mark.asyncio
+async def test_download_stream_from_file_yields_errors(temp_folder, mock_urls):
+    failed_url = 'https://example.com/missing.jpg'
+    urls_file = temp_folder / 'urls.txt'
+    urls_file.write_text('\n'.join(mock_urls + ['', failed_url]) + '\n')
+    download_folder = temp_folder / 'downloads'
+
+    with aioresponses() as mock:
+        for url in mock_urls:
+            mock.get(
+                url, status=200, body=FAKE_JPEG,
+                headers={'Content-Type': 'image/jpeg'},
+            )
+        mock.get(failed_url, status=404)
+
+        results = dict([
+            item async for item in download_stream(
+                str(urls_file), 2, folder=str(download_folder),
+            )
+        ])
+
+    assert set(results) == set(mock_urls) | {failed_url}
+    assert isinstance(results[failed_url], DownloadError)
+    assert results[failed_url].status == 404
+    assert all(os.path.exists(results[url]) for url in mock_urls)
+
+
+@pytest.mark.asyncio
+async def test_slow_url_source_does_not_block_downloads(temp_folder, mock_urls):
+    requested = threading.Event()
+
+    def respond(url, **kwargs):
+        requested.set()
+        return CallbackResult(body=FAKE_JPEG, headers={'Content-Type': 'image/jpeg'})
+
+    def slow_source():
+        yield mock_urls[0]
+        # Источник, как медленный stdin, ждет, пока не начнется первая загрузка
+        assert requested.wait(5)
+        yield mock_urls[1]
+
+    with aioresponses() as mock:
+        for url in mock_urls[:2]:
+            mock.get(url, callback=respond)
+        result = await main(slow_source(), 2, folder=str(temp_folder))
+
+    assert all(result) and len(result) == 2
+
+
+@pytest.mark.asyncio
+async def test_main_retries_transient_failures(temp_folder, mock_urls):
+    with aioresponses() as mock:
+        for url in mock_urls:
+            mock.get(url, status=503, headers={'Retry-After': '0'})
+            mock.get(url, exception=aiohttp.ServerDisconnectedError())
+            mock.get(
+                url, status=200, body=FAKE_JPEG,
+                headers={'Content-Type': 'image/jpeg'},
+            )
+
+        retry_policy = RetryPolicy(backoff_base=0.01)
+        result = await main(
+            mock_urls, 1, folder=str(temp_folder), retry_policy=retry_policy,
+        )
+
+    assert all(path is not None for path in result)
+    assert len(os.listdir(temp_folder)) == len(mock_urls)
+
+
+@pytest.mark.asyncio
+async def test_download_image_gives_up_after_max_attempts(temp_folder):
+    url = 'https://example.com/image.jpg'
+    with aioresponses() as mock:
+        mock.get(url, status=503, repeat=True)
+
+        session = aiohttp.ClientSession()
+        result = await download_image(
+            url, asyncio.Semaphore(1), session, Progress(), 1, str(temp_folder),
+            retry_policy=RetryPolicy(max_attempts=3, backoff_base=0.01),
+        )
+        await session.close()
+
+        requests_made = sum(len(calls) for calls in mock.requests.values())
+
+    assert result is None
+    assert requests_made == 3
+
+
+@pytest.mark.asyncio
+async def test_main_respects_per_host_concurrency(temp_folder):
+    slow_urls = [f'https://slow.example.com/image{n}.jpg' for n in range(4)]
+    fast_urls = [f'https://fast.example.com/image{n}.jpg' for n in range(4)]
+    active = {'slow.example.com': 0, 'fast.example.com': 0}
+    peak = dict(active)
+
+    async def respond(url, **kwargs):
+        active[url.host] += 1
+        peak[url.host] = max(peak[url.host], active[url.host])
+        await asyncio.sleep(0.02)
+        active[url.host] -= 1
+        return CallbackResult(
+            status=200, body=FAKE_JPEG, headers={'Content-Type': 'image/jpeg'},
+        )
+
+    host_limiter = HostLimiter(
+        default=HostLimit(max_concurrency=4),
+        hosts={'slow.example.com': HostLimit(max_concurrency=1)},
+    )
+    with aioresponses() as mock:
+        for url in slow_urls + fast_urls:
+            mock.get(url, callback=respond)
+
+        result = await main(
+            slow_urls + fast_urls, 4, folder=str(temp_folder), host_limiter=host_limiter,
+        )
+
+    assert all(path is not None for path in result)
+    assert peak['slow.example.com'] == 1
+    assert peak['fast.example.com'] > 1
+    assert host_limiter.stats()['slow.example.com']['completed'] == len(slow_urls)
+
+
+@pytest.mark.asyncio
+async def test_main_adaptive_concurrency_backs_off_on_overload(temp_folder):
+    urls = [f'https://example.com/image{n}.jpg' for n in range(80)]
+    capacity = 4
+    state = {'active': 0, 'peak': 0}
+
+    async def respond(url, **kwargs):
+        if state['active'] >= capacity:
+            return CallbackResult(status=503)
+        state['active'] += 1
+        state['peak'] = max(state['peak'], state['active'])
+        await asyncio.sleep(0.005)
+        state['active'] -= 1
+        return CallbackResult(
+            status=200, body=FAKE_JPEG, headers={'Content-Type': 'image/jpeg'},
+        )
+
+    adaptive = AIMDController(min_limit=1, max_limit=16)
+    with aioresponses() as mock:
+        for url in urls:
+            mock.get(url, callback=respond, repeat=True)
+
+        result = await main(
+            urls, 2, folder=str(temp_folder), adaptive=adaptive,
+            retry_policy=RetryPolicy(max_attempts=10, backoff_base=0.001),
+        )
+
+    assert all(path is not None for path in result)
+    # Лимит рос от стартовых 2, но перегрузка возвращала его назад
+    assert state['peak'] > 2
+    assert any(limit > 2 for _, limit in adaptive.history)
+    assert 1 <= adaptive.limit <= 16
+
+
+@pytest.mark.asyncio
+async def test_main_content_addressed_storage_deduplicates(temp_folder):
+    urls = [f'https://example.com/image{n}.jpg' for n in range(6)]
+    with aioresponses() as mock:
+        for n, url in enumerate(urls):
+            mock.get(
+                url, status=200, body=FAKE_JPEG + f'body {n % 2}'.encode(),
+                headers={'Content-Type': 'image/jpeg'},
+            )
+
+        storage = ContentAddressedStorage(str(temp_folder))
+        result = await main(urls, 3, folder=str(temp_folder), storage=storage)
+
+    assert len(set(result)) == 2
+    assert storage.duplicates == 4
+    assert set(storage.load_index()) == set(urls)
+
+
+@pytest.mark.asyncio
+async def test_main_with_manifest_skips_finished_urls(temp_folder):
+    urls = [f'https://example.com/image{n}.jpg' for n in range(4)]
+    folder = str(temp_folder / 'downloads')
+    path = str(temp_folder / 'manifest.sqlite')
+
+    with aioresponses() as mock:
+        for n, url in enumerate(urls):
+            if n >= 2:
+                mock.get(url, status=503)
+            mock.get(
+                url, status=200, body=FAKE_JPEG, headers={'Content-Type': 'image/jpeg'},
+            )
+        first = await main(urls, 2, folder=folder, manifest=Manifest(path))
+        second = await main(urls, 2, folder=folder, manifest=Manifest(path))
+        requests_made = sum(len(calls) for calls in mock.requests.values())
+
+    assert first[:2] == second[:2] and first[2:] == [None, None]
+    assert all(second)
+    # Второй запуск запрашивает только два URL, упавших в первом
+    assert requests_made == len(urls) + 2
+    assert len(os.listdir(folder)) == len(urls)
+
+
+@pytest.mark.asyncio
+async def test_main_conditional_requests_reuse_cached_files(temp_folder):
+    urls = [f'https://example.com/image{n}.jpg' for n in range(3)]
+    folder = str(temp_folder / 'downloads')
+
+    def respond(url, headers=None, **kwargs):
+        if (headers or {}).get('If-None-Match') == '"v1"':
+            return CallbackResult(status=304)
+        return CallbackResult(
+            body=FAKE_JPEG,
+            headers={'Content-Type': 'image/jpeg', 'ETag': '"v1"'},
+        )
+
+    with aioresponses() as mock:
+        for url in urls:
+            mock.get(url, callback=respond, repeat=True)
+        first_cache = HttpCache(str(temp_folder / 'cache.sqlite'))
+        first = await main(urls, 2, folder=folder, cache=first_cache)
+        cache = HttpCache(str(temp_folder / 'cache.sqlite'))
+        second = await main(urls, 2, folder=folder, cache=cache)
+
+    assert first == second
+    assert (first_cache.hits, first_cache.misses) == (0, 3)
+    assert (cache.hits, cache.misses) == (3, 0)
+    assert len(os.listdir(folder)) == len(urls)
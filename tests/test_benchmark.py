@@ -0,0 +1,49 @@
+import time
+
+import requests
+
+from ..benchmark import (JPEG_MAGIC, HostProfile, ImageServer, percentile,
+                         run_benchmark)
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 100) == 100
+    assert percentile([], 50) == 0.0
+
+
+def test_image_server_is_reproducible_per_host():
+    default = HostProfile(image_size=1000, size_jitter=0.5, latency=0)
+    slow = HostProfile(image_size=10, latency=0.2, error_rate=1.0)
+    with ImageServer(default, {'127.0.0.2': slow}, seed=1) as server:
+        fast_url, slow_url = server.urls(2)
+        assert '127.0.0.1' in fast_url and '127.0.0.2' in slow_url
+
+        first = requests.get(fast_url)
+        assert first.headers['Content-Type'] == 'image/jpeg'
+        assert first.content.startswith(JPEG_MAGIC)
+        assert 500 <= len(first.content) <= 1500
+        assert requests.get(fast_url).content == first.content
+
+        start = time.monotonic()
+        assert requests.get(slow_url).status_code == 503
+        assert time.monotonic() - start >= 0.2
+        assert server.requests == 3
+
+
+def test_run_benchmark_reports_every_case():
+    with ImageServer(HostProfile(image_size=2048, latency=0.001)) as server:
+        rows = run_benchmark(
+            server, concurrency_levels=[2], url_counts=[10], process_counts=[1, 2],
+        )
+
+    assert [(row['mode'], row['processes']) for row in rows] == [
+        ('async', 1), ('multithreaded', 1), ('multiprocess', 1), ('multiprocess', 2),
+    ]
+    for row in rows:
+        assert row['files'] == 10 and row['failed'] == 0
+        assert row['mb_per_s'] > 0
+        assert 0 < row['p50_ms'] <= row['p95_ms'] <= row['p99_ms']
+        assert row['peak_rss_mb'] > 0 and row['cpu_s'] >= 0
@@ -0,0 +1,75 @@
+import time
+
+from .. import cache as cache_module
+from ..cache import CacheEntry, HttpCache
+
+
+def _cache_file(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b'data')
+    return str(path)
+
+
+def test_conditional_headers():
+    entry = CacheEntry('"abc"', 'Wed, 21 Oct 2015 07:28:00 GMT', 'a.jpg')
+    assert HttpCache.conditional_headers(entry) == {
+        'If-None-Match': '"abc"',
+        'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT',
+    }
+    assert HttpCache.conditional_headers(CacheEntry(None, None, 'a.jpg')) == {}
+    assert HttpCache.conditional_headers(None) == {}
+
+
+def test_lookup_and_persistence(tmp_path):
+    db = str(tmp_path / 'cache.sqlite')
+    cache = HttpCache(db)
+    path = _cache_file(tmp_path, 'a.jpg')
+    cache.update('https://example.com/a.jpg', '"v1"', None, path)
+    cache.update('https://example.com/b.jpg', None, None, path)
+    cache.close()
+
+    cache = HttpCache(db)
+    assert cache.lookup('https://example.com/a.jpg') == CacheEntry('"v1"', None, path)
+    # Без валидаторов запись не сохраняется
+    assert cache.lookup('https://example.com/b.jpg') is None
+    assert len(cache) == 1
+
+
+def test_lookup_ignores_deleted_file(tmp_path):
+    cache = HttpCache(str(tmp_path / 'cache.sqlite'))
+    cache.update('https://example.com/a.jpg', '"v1"', None, str(tmp_path / 'gone.jpg'))
+    assert cache.lookup('https://example.com/a.jpg') is None
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path):
+    cache = HttpCache(str(tmp_path / 'cache.sqlite'), max_entries=2)
+    path = _cache_file(tmp_path, 'a.jpg')
+    for name in ('a', 'b', 'c'):
+        cache.update(f'https://example.com/{name}.jpg', f'"{name}"', None, path)
+        time.sleep(0.01)
+    cache.hit('https://example.com/a.jpg')
+
+    assert cache.evict() == 1
+    assert cache.lookup('https://example.com/a.jpg') is not None
+    assert cache.lookup('https://example.com/b.jpg') is None
+    assert cache.lookup('https://example.com/c.jpg') is not None
+
+
+def test_age_eviction(tmp_path, monkeypatch):
+    cache = HttpCache(str(tmp_path / 'cache.sqlite'), max_age=60)
+    path = _cache_file(tmp_path, 'a.jpg')
+    cache.update('https://example.com/a.jpg', '"v1"', None, path)
+
+    later = time.time() + 120
+    monkeypatch.setattr(cache_module.time, 'time', lambda: later)
+    assert cache.lookup('https://example.com/a.jpg') is None
+    assert cache.evict() == 1
+
+
+def test_hit_ratio(tmp_path):
+    cache = HttpCache(str(tmp_path / 'cache.sqlite'))
+    path = _cache_file(tmp_path, 'a.jpg')
+    cache.update('https://example.com/a.jpg', '"v1"', None, path)
+    cache.hit('https://example.com/a.jpg')
+    cache.hit('https://example.com/a.jpg')
+    assert cache.hit_ratio() == 2 / 3
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import time
+
+from ..async_download import main as async_main
+from ..benchmark import HostProfile, ImageServer
+from ..deadlines import DeadlinePolicy, Hedger
+from ..multithreaded_download import main as threaded_main
+from ..retry import RetryPolicy
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CRED_PATH = os.path.join(REPO_DIR, 'credentials.json')
+
+
+def test_hedger_waits_for_samples_and_keeps_to_its_budget():
+    hedger = Hedger(percentile=90, max_extra=0.1, min_delay=0.01, min_samples=10)
+    for _ in range(9):
+        hedger.record(0.02)
+    assert hedger.delay() is None
+    hedger.record(0.5)
+    assert hedger.delay() == 0.5
+    for _ in range(90):
+        hedger.record(0.02)
+    assert hedger.delay() == 0.02
+
+    assert sum(hedger.try_hedge() for _ in range(20)) == 10
+    assert hedger.stats() == {'requests': 100, 'hedged': 10, 'wins': 0}
+
+
+def test_job_deadline_bounds_the_run_in_both_modes(tmp_path):
+    policy = DeadlinePolicy(job=0.3)
+    with ImageServer(HostProfile(image_size=64, latency=1.0)) as server:
+        urls = server.urls(20)
+        started = time.monotonic()
+        coroutines = asyncio.run(async_main(
+            urls, 2, CRED_PATH, str(tmp_path / 'a'), deadlines=policy,
+        ))
+        threaded = threaded_main(
+            urls, 2, CRED_PATH, str(tmp_path / 'b'), deadlines=policy,
+        )
+        elapsed = time.monotonic() - started
+
+    assert coroutines == [None] * 20
+    assert threaded == [None] * 20
+    # Без дедлайна каждый режим шел бы 10 секунд
+    assert elapsed < 3
+
+
+def test_request_deadline_stops_retries(tmp_path):
+    retry_policy = RetryPolicy(max_attempts=50, backoff_base=0.05, jitter=0)
+    policy = DeadlinePolicy(request=0.3)
+    with ImageServer(HostProfile(image_size=64, latency=0, error_rate=1.0)) as server:
+        urls = server.urls(2)
+        started = time.monotonic()
+        result = asyncio.run(async_main(
+            urls, 2, CRED_PATH, str(tmp_path / 'a'), retry_policy=retry_policy,
+            deadlines=policy,
+        ))
+        result += threaded_main(
+            urls, 2, CRED_PATH, str(tmp_path / 'b'), retry_policy=retry_policy,
+            deadlines=policy,
+        )
+        elapsed = time.monotonic() - started
+        requests = server.requests
+
+    assert result == [None] * 4
+    assert elapsed < 2
+    assert requests < 40
+
+
+def test_hedged_requests_cut_stalled_responses(tmp_path):
+    profile = HostProfile(image_size=64, latency=0.005, stall_rate=0.1, stall=3.0)
+    hedger = Hedger(percentile=90, max_extra=0.5, min_delay=0.02, min_samples=1)
+    with ImageServer(profile) as server:
+        # Первые запросы без задержки дают хеджеру наблюдения
+        asyncio.run(async_main(
+            server.urls(1), 1, CRED_PATH, str(tmp_path), hedger=hedger,
+        ))
+        started = time.monotonic()
+        result = asyncio.run(async_main(
+            server.urls(60), 8, CRED_PATH, str(tmp_path), hedger=hedger,
+        ))
+        elapsed = time.monotonic() - started
+
+    assert None not in result
+    assert hedger.hedged > 0
+    assert hedger.wins > 0
+    assert elapsed < 3
@@ -0,0 +1,94 @@
+import asyncio
+import os
+
+import pytest
+
+from ..async_download import main as async_main
+from ..benchmark import HostProfile, ImageServer
+from ..dedup import PENDING, BloomFilter, Deduplicator, normalize_url
+from ..multiprocess_download import main as multiprocess_main
+from ..multithreaded_download import DownloadError, main as threaded_main
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CRED_PATH = os.path.join(REPO_DIR, 'credentials.json')
+
+
+def test_normalize_url_maps_equivalent_urls_to_one_key():
+    key = normalize_url('https://example.com/a.jpg?b=2&a=1')
+    assert normalize_url('HTTPS://Example.COM:443/a.jpg?a=1&b=2#top') == key
+    assert normalize_url('https://example.com/a.jpg?a=1&&b=2') == key
+    assert normalize_url('http://example.com') == 'http://example.com/'
+    assert normalize_url('http://example.com:8080/') == 'http://example.com:8080/'
+    # Путь и порядок повторяющихся параметров значимы
+    assert normalize_url('https://example.com/A.jpg?a=1&b=2') != key
+    assert (
+        normalize_url('https://x.io/?a=2&a=1') != normalize_url('https://x.io/?a=1&a=2')
+    )
+
+
+def test_bloom_filter_never_forgets_a_key():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    keys = [f'https://example.com/{n}' for n in range(1000)]
+    assert not any(bloom.add(key) for key in keys[:1])
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f'https://other.com/{n}' in bloom for n in range(10000))
+    assert false_positives < 300
+
+
+@pytest.mark.parametrize('in_sqlite', [False, True])
+def test_duplicates_wait_for_the_first_url(tmp_path, in_sqlite):
+    path = str(tmp_path / 'dedup.sqlite') if in_sqlite else None
+    dedup = Deduplicator(path, capacity=100)
+    assert dedup.claim(0, 'https://example.com/a') is None
+    assert dedup.claim(1, 'https://EXAMPLE.com/a#x') is PENDING
+    assert dedup.claim(2, 'https://example.com/b') is None
+    assert dedup.resolve(1, 'https://EXAMPLE.com/a#x', 'ignored') == []
+    assert dedup.resolve(0, 'https://example.com/a', '/d/a.jpg') == [
+        (1, 'https://EXAMPLE.com/a#x', '/d/a.jpg'),
+    ]
+    assert dedup.claim(3, 'https://example.com:443/a') == '/d/a.jpg'
+
+    dedup.resolve(
+        2, 'https://example.com/b',
+        DownloadError('https://example.com/b', '404 ERROR', 404),
+    )
+    error = dedup.claim(4, 'https://example.com/b')
+    assert isinstance(error, DownloadError) and error.status == 404
+    assert (dedup.inputs, dedup.duplicates) == (5, 3)
+
+    # Новый прогон не видит ключей предыдущего
+    dedup.begin()
+    assert dedup.claim(0, 'https://example.com/a') is None
+    dedup.close()
+
+
+def test_every_mode_downloads_duplicates_once(tmp_path):
+    with ImageServer(HostProfile(image_size=256, latency=0.01)) as server:
+        unique = [f'{url}?a=1&b=2' for url in server.urls(6)]
+        urls = unique + [
+            url.replace('http://', 'HTTP://').replace('a=1&b=2', 'b=2&a=1')
+            for url in unique
+        ]
+        urls += [f'{url}#fragment' for url in unique]
+
+        results = {
+            'async': asyncio.run(async_main(
+                urls, 4, CRED_PATH, str(tmp_path / 'a'), dedup=Deduplicator(),
+            )),
+            'threaded': threaded_main(
+                urls, 4, CRED_PATH, str(tmp_path / 't'),
+                dedup=Deduplicator(str(tmp_path / 'dedup.sqlite'), capacity=100),
+            ),
+            'multiprocess': multiprocess_main(
+                urls, 4, CRED_PATH, str(tmp_path / 'm'), processes=2,
+                dedup=Deduplicator(),
+            ),
+        }
+        requests = server.requests
+
+    assert requests == 3 * len(unique)
+    for result in results.values():
+        assert len(result) == len(urls) and all(result)
+        assert result[:6] == result[6:12] == result[12:]
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+import requests_mock
+from aioresponses import aioresponses
+
+from ..async_download import main as async_main
+from ..formats import DownloadError, FormatRegistry, ImageFormat
+from ..multithreaded_download import main as threaded_main
+
+JPEG = b'\xff\xd8\xff\xe0' + b'\0' * 100
+WEBP = b'RIFF\x10\x00\x00\x00WEBPVP8 ' + b'\0' * 100
+AVIF = b'\x00\x00\x00\x1cftypavif' + b'\0' * 100
+HTML = b'<!DOCTYPE html><html><body>Not found</body></html>'
+
+
+def test_detect_uses_magic_bytes_over_content_type():
+    formats = FormatRegistry()
+    url = 'https://example.com/a'
+    assert formats.detect(url, 'image/png', JPEG) == 'jpg'
+    assert formats.detect(url, 'application/octet-stream', WEBP) == 'webp'
+    assert formats.detect(url, None, AVIF) == 'avif'
+    with pytest.raises(DownloadError):
+        formats.detect(url, 'image/jpeg', HTML)
+
+    formats.check_headers(url, 'image/JPEG; charset=binary', 10)
+    with pytest.raises(DownloadError):
+        formats.check_headers(url, 'text/html; charset=utf-8', 10)
+    with pytest.raises(DownloadError):
+        FormatRegistry(max_size=5).check_headers(url, 'image/jpeg', 10)
+
+
+def test_registered_format_is_accepted():
+    formats = FormatRegistry(formats=[])
+    assert formats.sniff(JPEG) is None
+    formats.register(ImageFormat('jxl', ('image/jxl',), rb'\xff\x0a'))
+    assert formats.detect('https://example.com/a', 'image/jxl', b'\xff\x0a\0') == 'jxl'
+
+
+@pytest.mark.asyncio
+async def test_async_rejects_non_images_and_oversized_bodies(tmp_path):
+    urls = [f'https://example.com/{name}' for name in ('webp', 'html', 'big', 'octet')]
+    with aioresponses() as mock:
+        mock.get(urls[0], body=WEBP, headers={'Content-Type': 'image/webp'})
+        mock.get(urls[1], body=HTML, headers={'Content-Type': 'image/jpeg'})
+        # Без Content-Length лимит срабатывает при чтении тела
+        mock.get(urls[2], body=JPEG * 20, headers={'Content-Type': 'image/jpeg'})
+        mock.get(urls[3], body=JPEG, headers={'Content-Type': 'application/octet-stream'})
+        result = await async_main(
+            urls, 2, folder=str(tmp_path), formats=FormatRegistry(max_size=1000),
+        )
+
+    assert result[0].endswith('.webp')
+    assert result[1:3] == [None, None]
+    assert result[3].endswith('.jpg')
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_threaded_rejects_html_after_the_first_chunk(tmp_path):
+    url = 'https://example.com/page'
+    read = []
+
+    def body():
+        # Тело отдается кусками: загрузчик не должен дочитывать страницу до конца
+        for _ in range(100):
+            read.append(1)
+            yield HTML
+
+    with requests_mock.Mocker() as mock:
+        mock.get(url, body=_Stream(body()), headers={'Content-Type': 'image/jpeg'})
+        result = threaded_main([url], 1, folder=str(tmp_path))
+
+    assert result == [None]
+    assert len(read) < 100
+    assert os.listdir(tmp_path) == []
+
+
+class _Stream:
+    """File-like body for `requests_mock` yielding the chunks of a generator."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    def read(self, size=-1, **kwargs):
+        return next(self._chunks, b'')
+
+    def close(self):
+        pass
+
+
+def test_threaded_detects_format_behind_generic_type(tmp_path):
+    url = 'https://example.com/image'
+    with requests_mock.Mocker() as mock:
+        mock.get(url, content=WEBP, headers={'Content-Type': 'binary/octet-stream'})
+        result = threaded_main([url], 1, folder=str(tmp_path))
+
+    assert result[0].endswith('.webp')
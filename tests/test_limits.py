@@ -0,0 +1,210 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from .. import limits
+from ..async_download import main as async_main
+from ..benchmark import HostProfile, ImageServer
+from ..limits import (AT_CAPACITY, AIMDController, ByteBudget, HostLimit, HostLimiter,
+                      HostScheduler, TokenBucket)
+from ..multithreaded_download import main as threaded_main
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CRED_PATH = os.path.join(REPO_DIR, 'credentials.json')
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=10, capacity=2)
+
+    assert bucket.try_take() == 0
+    assert bucket.try_take() == 0
+    delay = bucket.try_take()
+    assert 0 < delay <= 0.1
+
+    time.sleep(delay)
+    assert bucket.try_take() == 0
+
+
+def test_host_limiter_concurrency_and_stats():
+    limiter = HostLimiter(
+        default=HostLimit(max_concurrency=2),
+        hosts={'slow.example.com': HostLimit(max_concurrency=1)},
+    )
+
+    assert limiter.try_acquire('slow.example.com') == 0
+    assert limiter.try_acquire('slow.example.com') is AT_CAPACITY
+    assert limiter.try_acquire('fast.example.com') == 0
+    assert limiter.try_acquire('fast.example.com') == 0
+    assert limiter.try_acquire('fast.example.com') is AT_CAPACITY
+
+    limiter.release('slow.example.com')
+    assert limiter.try_acquire('slow.example.com') == 0
+
+    stats = limiter.stats()
+    assert stats['slow.example.com'] == {
+        'active': 1, 'started': 2, 'completed': 1, 'throttled': 0,
+    }
+    assert stats['fast.example.com']['active'] == 2
+
+
+def test_host_scheduler_skips_saturated_hosts():
+    limiter = HostLimiter(default=HostLimit(max_concurrency=1))
+    scheduler = HostScheduler(limiter, max_pending=10)
+    for n in range(3):
+        scheduler.push('busy.example.com', f'busy-{n}')
+    scheduler.push('idle.example.com', 'idle-0')
+
+    assert scheduler.pop_ready() == (('busy.example.com', 'busy-0'), None)
+    # Хост busy занят, поэтому следующей выдается работа другого хоста
+    assert scheduler.pop_ready() == (('idle.example.com', 'idle-0'), None)
+    assert scheduler.pop_ready() == (None, None)
+    assert len(scheduler) == 2
+
+    limiter.release('busy.example.com')
+    assert scheduler.pop_ready() == (('busy.example.com', 'busy-1'), None)
+
+
+def test_host_scheduler_counts_each_waiting_item_once():
+    limiter = HostLimiter(default=HostLimit(max_concurrency=1))
+    scheduler = HostScheduler(limiter, max_pending=10)
+    for n in range(3):
+        scheduler.push('busy.example.com', f'busy-{n}')
+
+    assert scheduler.pop_ready()[0] == ('busy.example.com', 'busy-0')
+    # Повторные опросы занятого хоста не увеличивают счетчик
+    for _ in range(5):
+        assert scheduler.pop_ready() == (None, None)
+    assert limiter.stats()['busy.example.com']['throttled'] == 1
+
+    limiter.release('busy.example.com')
+    assert scheduler.pop_ready()[0] == ('busy.example.com', 'busy-1')
+    scheduler.pop_ready()
+    assert limiter.stats()['busy.example.com']['throttled'] == 2
+
+
+def test_host_scheduler_reports_rate_limit_delay():
+    limiter = HostLimiter(default=HostLimit(rate=5, burst=1))
+    scheduler = HostScheduler(limiter, max_pending=10)
+    scheduler.push('example.com', 'first')
+    scheduler.push('example.com', 'second')
+
+    assert scheduler.pop_ready()[0] == ('example.com', 'first')
+    ready, delay = scheduler.pop_ready()
+    assert ready is None
+    assert 0 < delay <= 0.2
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(limits.time, 'monotonic', lambda: clock[0])
+    return clock
+
+
+def run_window(controller, clock, latency, overloaded=False):
+    for _ in range(controller.limit):
+        clock[0] += 0.01
+        controller.record(latency, overloaded=overloaded)
+
+
+def test_aimd_grows_while_healthy_up_to_max(fake_clock):
+    controller = AIMDController(min_limit=1, max_limit=6)
+    controller.begin(2)
+
+    for _ in range(10):
+        run_window(controller, fake_clock, latency=0.1)
+
+    assert controller.limit == 6
+    assert [limit for _, limit in controller.history] == [2, 3, 4, 5, 6]
+
+
+def test_aimd_backs_off_on_overload_and_latency_spikes(fake_clock):
+    controller = AIMDController(min_limit=2, max_limit=32, initial=16)
+    controller.begin(5)
+    assert controller.limit == 16
+
+    run_window(controller, fake_clock, latency=0.1)
+    assert controller.limit == 17
+
+    run_window(controller, fake_clock, latency=0.1, overloaded=True)
+    assert controller.limit == 8
+
+    run_window(controller, fake_clock, latency=0.5)
+    assert controller.limit == 4
+
+    for _ in range(3):
+        run_window(controller, fake_clock, latency=0.1, overloaded=True)
+    assert controller.limit == 2
+
+
+def test_byte_budget_blocks_reads_until_bytes_are_released():
+    budget = ByteBudget(100)
+    first = budget.reservation(60)
+    assert first.grow(60)
+    assert not budget.try_reserve(60)
+    # Тело больше всего бюджета проходит, но только в одиночку
+    assert not budget.reservation(500).grow(500, timeout=0.05)
+
+    second = budget.reservation(60)
+    thread = threading.Thread(target=second.grow, args=(60,), daemon=True)
+    thread.start()
+    time.sleep(0.05)
+    assert thread.is_alive() and budget.used == 60
+    first.release()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert (budget.used, budget.peak, budget.waits) == (60, 60, 2)
+    second.release()
+    second.release()
+    assert budget.used == 0
+
+
+def test_byte_budget_lets_one_stalled_body_of_unknown_length_through():
+    budget = ByteBudget(100, step=50)
+    bodies = [budget.reservation(None), budget.reservation(None)]
+    for body in bodies:
+        assert body.grow(10)
+    assert budget.used == 100
+
+    # Оба тела хотят расти: без выхода из тупика они ждали бы друг друга вечно
+    threads = [
+        threading.Thread(target=body.grow, args=(80,), daemon=True) for body in bodies
+    ]
+    threads[0].start()
+    time.sleep(0.05)
+    assert threads[0].is_alive()
+    threads[1].start()
+    time.sleep(0.05)
+    assert sum(thread.is_alive() for thread in threads) == 1
+
+    # Резерв растет шагами: 50 + 50
+    done = next(body for body in bodies if body.held == 100)
+    done.release()
+    for thread in threads:
+        thread.join(1)
+    assert [body.held for body in bodies if body is not done] == [100]
+    assert budget.used == 100
+
+
+def test_byte_budget_bounds_bytes_in_flight_in_both_modes(tmp_path, caplog):
+    caplog.set_level('INFO')
+    image_size = 64 * 1024
+    with ImageServer(HostProfile(image_size=image_size, latency=0.02)) as server:
+        urls = server.urls(12)
+        budgets = [ByteBudget(image_size + 1024) for _ in range(2)]
+        results = [
+            asyncio.run(async_main(
+                urls, 8, CRED_PATH, str(tmp_path / 'a'), budget=budgets[0],
+            )),
+            threaded_main(urls, 8, CRED_PATH, str(tmp_path / 't'), budget=budgets[1]),
+        ]
+
+    for result, budget in zip(results, budgets):
+        assert all(result)
+        assert budget.used == 0
+        assert 0 < budget.peak <= budget.limit
+        assert budget.waits > 0
+    assert 'budget ' in caplog.text and ' / 0.1 MB' in caplog.text
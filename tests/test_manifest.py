@@ -0,0 +1,194 @@
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests_mock
+
+from ..manifest import DONE, FAILED, PENDING, Manifest
+from ..multithreaded_download import main
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CRED_PATH = os.path.join(REPO_DIR, 'credentials.json')
+
+
+def _rows(path):
+    with sqlite3.connect(path) as db:
+        return dict(db.execute('SELECT url, status FROM downloads').fetchall())
+
+
+def test_manifest_commits_in_batches(tmp_path):
+    path = str(tmp_path / 'manifest.sqlite')
+    manifest = Manifest(path, batch_size=3, flush_interval=60)
+    file_path = tmp_path / 'a.jpg'
+    file_path.write_bytes(b'data')
+
+    manifest.mark_pending('https://example.com/a.jpg')
+    manifest.record('https://example.com/a.jpg', str(file_path))
+    assert _rows(path) == {}
+
+    manifest.record('https://example.com/b.jpg', ValueError('boom'))
+    assert _rows(path) == {
+        'https://example.com/a.jpg': DONE,
+        'https://example.com/b.jpg': FAILED,
+    }
+    manifest.mark_pending('https://example.com/c.jpg')
+    manifest.close()
+
+    resumed = Manifest(path)
+    assert resumed.finished_path('https://example.com/a.jpg') == str(file_path)
+    assert resumed.finished_path('https://example.com/b.jpg') is None
+    assert resumed.counts() == {DONE: 1, FAILED: 1, PENDING: 1}
+
+
+def test_manifest_ignores_finished_url_with_missing_file(tmp_path):
+    manifest = Manifest(str(tmp_path / 'manifest.sqlite'), batch_size=1)
+    manifest.record('https://example.com/a.jpg', str(tmp_path / 'deleted.jpg'))
+    assert manifest.finished_path('https://example.com/a.jpg') is None
+
+
+def test_main_skips_urls_finished_in_earlier_run(tmp_path):
+    urls = [f'https://example.com/image{n}.jpg' for n in range(4)]
+    folder = str(tmp_path / 'downloads')
+    path = str(tmp_path / 'manifest.sqlite')
+
+    with requests_mock.Mocker() as mock:
+        for url in urls[:2]:
+            mock.get(
+                url, content=b'\xff\xd8\xffdata', headers={'Content-Type': 'image/jpeg'},
+            )
+        for url in urls[2:]:
+            mock.get(url, status_code=503)
+        first = main(urls, 2, folder=folder, manifest=Manifest(path))
+
+        for url in urls[2:]:
+            mock.get(
+                url, content=b'\xff\xd8\xffdata', headers={'Content-Type': 'image/jpeg'},
+            )
+        mock.reset_mock()
+        second = main(urls, 2, folder=folder, manifest=Manifest(path))
+        requested = {request.url for request in mock.request_history}
+
+    assert first[:2] == second[:2] and first[2:] == [None, None]
+    assert all(second)
+    assert requested == set(urls[2:])
+    assert len(os.listdir(folder)) == len(urls)
+
+
+class _SlowImageHandler(BaseHTTPRequestHandler):
+    hits = []
+
+    def do_GET(self):
+        self.hits.append(self.path)
+        time.sleep(0.05)
+        body = b'\xff\xd8\xff' + self.path.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def image_server():
+    _SlowImageHandler.hits = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _SlowImageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}', _SlowImageHandler.hits
+    server.shutdown()
+    server.server_close()
+
+
+def _wait_for_done(path, count, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(path):
+            try:
+                done = [status for status in _rows(path).values() if status == DONE]
+            except sqlite3.OperationalError:
+                done = []
+            if len(done) >= count:
+                return
+        time.sleep(0.05)
+    raise TimeoutError('the job did not make progress')
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGKILL'), reason='needs SIGKILL')
+def test_resume_after_crash_finishes_without_duplicates(tmp_path, image_server):
+    base_url, hits = image_server
+    urls = [f'{base_url}/image{n}.jpg' for n in range(60)]
+    folder = str(tmp_path / 'downloads')
+    path = str(tmp_path / 'manifest.sqlite')
+    batch_size = 5
+
+    script = (
+        'import sys\n'
+        'from manifest import Manifest\n'
+        'from multithreaded_download import main\n'
+        'urls, cred, folder, path = sys.argv[1].split(), *sys.argv[2:]\n'
+        f'main(urls, 4, cred, folder, manifest=Manifest(path, {batch_size}))\n'
+    )
+    job = subprocess.Popen(
+        [sys.executable, '-c', script, ' '.join(urls), CRED_PATH, folder, path],
+        cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_for_done(path, 15)
+    finally:
+        job.send_signal(signal.SIGKILL)
+        job.wait()
+    assert len(set(hits)) < len(urls), 'the job finished before it was killed'
+
+    hits_before_crash = len(hits)
+    result = main(urls, 4, CRED_PATH, folder, manifest=Manifest(path))
+
+    assert all(result)
+    # Повторно скачаны только незавершенные URL и последняя незаписанная пачка
+    assert len(hits) - hits_before_crash < len(urls)
+    assert len(hits) <= len(urls) + batch_size + 4
+    files = os.listdir(folder)
+    assert len(files) == len(urls)
+    assert not [name for name in files if name.endswith('.part')]
+    assert set(_rows(path).values()) == {DONE}
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGKILL'), reason='needs SIGKILL')
+def test_run_py_resume_after_crash_keeps_one_file_per_url(tmp_path, image_server):
+    base_url, hits = image_server
+    urls = [f'{base_url}/image{n}.jpg' for n in range(200)]
+    source = tmp_path / 'urls.txt'
+    source.write_text('\n'.join(urls))
+    folder = str(tmp_path / 'downloads')
+    command = [
+        sys.executable, 'run.py', str(source), '--mode', 'multithreaded',
+        '--max-active-tasks', '4', '--folder', folder, '--resume',
+    ]
+
+    job = subprocess.Popen(
+        command, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_for_done(os.path.join(folder, 'manifest-multithreaded.sqlite'), 15)
+    finally:
+        job.send_signal(signal.SIGKILL)
+        job.wait()
+    assert len(set(hits)) < len(urls), 'the job finished before it was killed'
+
+    subprocess.run(
+        command, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        check=True,
+    )
+
+    # URL, скачанные после последнего коммита манифеста, перезаписывают свой файл
+    images = [name for name in os.listdir(folder) if name.endswith('.jpg')]
+    assert len(images) == len(urls)
+    assert not [name for name in os.listdir(folder) if name.endswith('.part')]
@@ -0,0 +1,81 @@
+import asyncio
+
+import requests
+
+from ..async_download import main as async_main
+from ..benchmark import HostProfile, ImageServer
+from ..metrics import Metrics
+
+
+def _phase_count(metrics, phase):
+    text = metrics.to_prometheus()
+    line = f'download_phase_seconds_count{{phase="{phase}"}} '
+    return next(
+        (int(row[len(line):]) for row in text.splitlines() if row.startswith(line)), 0,
+    )
+
+
+def test_counters_gauges_and_hooks():
+    metrics = Metrics()
+    events = []
+    metrics.subscribe(lambda name, value, labels: events.append((name, value, labels)))
+
+    metrics.inc('download_responses_total', status='200')
+    metrics.inc('download_responses_total', status='200')
+    metrics.add('download_in_flight', 2)
+    metrics.add('download_in_flight', -1)
+    metrics.record_result(ValueError('boom'))
+
+    assert metrics.value('download_responses_total', status='200') == 2
+    assert metrics.value('download_in_flight') == 1
+    assert metrics.value('download_errors_total', type='ValueError') == 1
+    assert events[0] == ('download_responses_total', 1, {'status': '200'})
+    assert metrics.summary()['failed'] == 1
+
+
+def test_prometheus_histogram_is_cumulative(tmp_path):
+    metrics = Metrics(buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        metrics.observe('download_phase_seconds', value, phase='ttfb')
+
+    text = metrics.to_prometheus()
+    assert '# TYPE download_phase_seconds histogram' in text
+    assert 'download_phase_seconds_bucket{phase="ttfb",le="0.1"} 1' in text
+    assert 'download_phase_seconds_bucket{phase="ttfb",le="1"} 3' in text
+    assert 'download_phase_seconds_bucket{phase="ttfb",le="+Inf"} 4' in text
+    assert 'download_phase_seconds_count{phase="ttfb"} 4' in text
+
+    path = tmp_path / 'downloader.prom'
+    metrics.write_prometheus(str(path))
+    assert path.read_text() == text
+
+
+def test_serve_exposes_metrics_endpoint():
+    metrics = Metrics()
+    metrics.inc('download_bytes_total', 42)
+    server = metrics.serve(0)
+    try:
+        port = server.server_address[1]
+        response = requests.get(f'http://127.0.0.1:{port}/metrics')
+        assert 'download_bytes_total 42' in response.text
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_async_main_records_phases_over_real_sockets(tmp_path):
+    metrics = Metrics()
+    with ImageServer(HostProfile(image_size=4096, latency=0.01)) as server:
+        urls = server.urls(6)
+        # Через localhost, чтобы клиент выполнил резолв имени
+        urls[0] = urls[0].replace('127.0.0.1', 'localhost')
+        result = asyncio.run(async_main(urls, 3, folder=str(tmp_path), metrics=metrics))
+
+    assert all(result)
+    assert metrics.value('download_responses_total', status='200') == 6
+    assert metrics.value('download_bytes_total') == 6 * 4096
+    assert metrics.value('download_in_flight') == 0
+    for phase in ('ttfb', 'body', 'write'):
+        assert _phase_count(metrics, phase) == 6
+    assert 1 <= _phase_count(metrics, 'connect') <= 6
+    assert _phase_count(metrics, 'dns') >= 1
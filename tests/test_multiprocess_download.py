@@ -0,0 +1,52 @@
+import os
+
+from ..benchmark import HostProfile, ImageServer
+from ..limits import HostLimit, HostLimiter
+from ..manifest import Manifest
+from ..multiprocess_download import DownloadError, download_as_completed, main
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CRED_PATH = os.path.join(REPO_DIR, 'credentials.json')
+
+
+def test_main_spreads_urls_over_processes_and_keeps_order(tmp_path):
+    folder = str(tmp_path / 'downloads')
+    with ImageServer(HostProfile(image_size=2048, latency=0.001)) as server:
+        urls = server.urls(40)
+        result = main(urls, 8, CRED_PATH, folder, processes=2)
+
+    assert len(result) == len(urls) and all(result)
+    assert len(set(result)) == len(urls)
+    assert sorted(os.listdir(folder)) == sorted(os.path.basename(p) for p in result)
+
+
+def test_errors_come_back_with_their_status(tmp_path):
+    profile = HostProfile(image_size=64, latency=0)
+    broken = HostProfile(image_size=64, latency=0, error_rate=1.0)
+    with ImageServer(profile, {'127.0.0.2': broken}) as server:
+        urls = server.urls(10)
+        limiter = HostLimiter(default=HostLimit(max_concurrency=2))
+        results = {
+            url: result for _, url, result in download_as_completed(
+                urls, 4, CRED_PATH, str(tmp_path), processes=2,
+                host_limiter=limiter,
+            )
+        }
+
+    failed = {url for url, result in results.items() if isinstance(result, Exception)}
+    assert failed == {url for url in urls if '127.0.0.2' in url}
+    assert all(results[url].status == 503 for url in failed)
+    assert all(isinstance(results[url], DownloadError) for url in failed)
+
+
+def test_manifest_in_parent_skips_finished_urls(tmp_path):
+    folder = str(tmp_path / 'downloads')
+    path = str(tmp_path / 'manifest.sqlite')
+    with ImageServer(HostProfile(image_size=64, latency=0)) as server:
+        urls = server.urls(6)
+        first = main(urls, 4, CRED_PATH, folder, processes=2, manifest=Manifest(path))
+        requests_before = server.requests
+        second = main(urls, 4, CRED_PATH, folder, processes=2, manifest=Manifest(path))
+
+    assert first == second and all(first)
+    assert server.requests == requests_before
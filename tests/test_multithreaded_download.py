@@ -1,11 +1,27 @@
-import os 
+import io
+import os
+import tracemalloc
 
 import pytest
 import requests
 import requests_mock
 
-from ..multithreaded_download import download_image, main
-from ..utils import Counter
+from ..multithreaded_download import (DownloadError, download_as_completed,
+                                      download_image, download_stream, main)
+from ..cache import HttpCache
+from ..limits import AIMDController, HostLimit, HostLimiter
+from ..metrics import Metrics
+from ..retry import RetryPolicy
+from ..storage import ContentAddressedStorage
+from ..utils import Counter, Progress
+
+# Тела начинаются с сигнатур форматов: загрузчик определяет формат по первым байтам
+FAKE_IMAGES = {
+    'image/jpeg': b'\xff\xd8\xff\xe0fake image data',
+    'image/png': b'\x89PNG\r\n\x1a\nfake image data',
+    'image/gif': b'GIF89afake image data',
+}
+FAKE_JPEG = FAKE_IMAGES['image/jpeg']
 
 
 @pytest.fixture
@@ -26,7 +42,7 @@ def test_download_image_success(temp_folder, mock_urls):
     with requests_mock.Mocker() as mock:
         for n, url in enumerate(mock_urls):
             mock.get(
-                url, status_code=200, content=b'fake image data',
+                url, status_code=200, content=FAKE_IMAGES[content_types[n]],
                 headers={'Content-Type': content_types[n]},
             )
 
@@ -77,7 +93,7 @@ def test_main_function(temp_folder, mock_urls):
     with requests_mock.Mocker() as mock:
         for n, url in enumerate(mock_urls):
             mock.get(
-                url, status_code=200, content=b'fake image data',
+                url, status_code=200, content=FAKE_IMAGES[content_types[n]],
                 headers={'Content-Type': content_types[n]},
             )
 
@@ -87,3 +103,252 @@ def test_main_function(temp_folder, mock_urls):
 
         assert len(result) == len(mock_urls)
         assert len(os.listdir(temp_folder)) == len(mock_urls)
+
+
+def _peak_memory_for_download(folder, size):
+    url = 'https://example.com/big.jpg'
+    body = io.BytesIO(FAKE_JPEG + b'\0' * (size - len(FAKE_JPEG)))
+    with requests_mock.Mocker() as mock:
+        mock.get(url, status_code=200, body=body, headers={'Content-Type': 'image/jpeg'})
+        session = requests.Session()
+
+        tracemalloc.start()
+        result = download_image(
+            url, session, Progress(), 1, str(folder), preallocate_file=True,
+        )
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    assert os.path.getsize(result) == size
+    return peak
+
+
+def test_download_image_streams_with_flat_memory(temp_folder):
+    small_peak = _peak_memory_for_download(temp_folder, 1024 * 1024)
+    large_peak = _peak_memory_for_download(temp_folder, 16 * 1024 * 1024)
+
+    assert large_peak < 1024 * 1024
+    assert large_peak < small_peak * 2
+    assert not [name for name in os.listdir(temp_folder) if name.endswith('.part')]
+
+
+def test_download_stream_from_file_yields_errors(temp_folder, mock_urls):
+    failed_url = 'https://example.com/missing.jpg'
+    urls_file = temp_folder / 'urls.txt'
+    urls_file.write_text('\n'.join(mock_urls + ['', failed_url]) + '\n')
+    download_folder = temp_folder / 'downloads'
+
+    with requests_mock.Mocker() as mock:
+        for url in mock_urls:
+            mock.get(
+                url, status_code=200, content=FAKE_JPEG,
+                headers={'Content-Type': 'image/jpeg'},
+            )
+        mock.get(failed_url, status_code=404)
+
+        results = dict(download_stream(str(urls_file), 2, folder=str(download_folder)))
+
+    assert set(results) == set(mock_urls) | {failed_url}
+    assert isinstance(results[failed_url], DownloadError)
+    assert results[failed_url].status == 404
+    assert all(os.path.exists(results[url]) for url in mock_urls)
+
+
+def test_main_preserves_input_order(temp_folder):
+    urls = [f'https://example.com/image{n}.jpg' for n in range(20)]
+    failed_url = urls[5]
+
+    with requests_mock.Mocker() as mock:
+        for url in urls:
+            if url == failed_url:
+                mock.get(url, status_code=404)
+            else:
+                mock.get(
+                    url, status_code=200, content=FAKE_JPEG,
+                    headers={'Content-Type': 'image/jpeg'},
+                )
+
+        result = main(urls, 4, folder=str(temp_folder))
+
+    assert len(result) == len(urls)
+    assert result[5] is None
+    assert all(path is not None for n, path in enumerate(result) if n != 5)
+
+
+def test_download_as_completed_bounds_in_flight(temp_folder):
+    urls = [f'https://example.com/image{n}.jpg' for n in range(30)]
+    max_in_flight = 3
+    consumed = []
+    completed = []
+
+    def url_stream():
+        for url in urls:
+            # Новый URL берется только когда в окне есть место
+            assert len(consumed) - len(completed) < max_in_flight
+            consumed.append(url)
+            yield url
+
+    with requests_mock.Mocker() as mock:
+        for url in urls:
+            mock.get(
+                url, status_code=200, content=FAKE_JPEG,
+                headers={'Content-Type': 'image/jpeg'},
+            )
+
+        for index, url, result in download_as_completed(
+            url_stream(), 2, folder=str(temp_folder), max_in_flight=max_in_flight,
+        ):
+            assert urls[index] == url
+            assert os.path.exists(result)
+            completed.append(index)
+
+    assert sorted(completed) == list(range(len(urls)))
+
+
+def test_main_retries_transient_failures(temp_folder, mock_urls):
+    with requests_mock.Mocker() as mock:
+        for url in mock_urls:
+            mock.get(url, [
+                {'status_code': 429, 'headers': {'Retry-After': '0'}},
+                {'exc': requests.exceptions.ConnectionError},
+                {
+                    'status_code': 200, 'content': FAKE_JPEG,
+                    'headers': {'Content-Type': 'image/jpeg'},
+                },
+            ])
+
+        retry_policy = RetryPolicy(backoff_base=0.01)
+        result = main(mock_urls, 1, folder=str(temp_folder), retry_policy=retry_policy)
+
+    assert all(path is not None for path in result)
+    assert len(os.listdir(temp_folder)) == len(mock_urls)
+
+
+def test_download_image_does_not_retry_client_errors(temp_folder):
+    url = 'https://example.com/image.jpg'
+    with requests_mock.Mocker() as mock:
+        mock.get(url, status_code=404)
+
+        result = download_image(
+            url, requests.Session(), Progress(), 1, str(temp_folder),
+            retry_policy=RetryPolicy(backoff_base=0.01),
+        )
+
+        assert result is None
+        assert mock.call_count == 1
+
+
+class PeakHostLimiter(HostLimiter):
+    """HostLimiter that remembers the largest number of active requests per host."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.peak = {}
+
+    def try_acquire(self, host):
+        delay = super().try_acquire(host)
+        active = self.stats()[host]['active']
+        self.peak[host] = max(self.peak.get(host, 0), active)
+        return delay
+
+
+def test_main_respects_per_host_concurrency(temp_folder):
+    slow_urls = [f'https://slow.example.com/image{n}.jpg' for n in range(4)]
+    fast_urls = [f'https://fast.example.com/image{n}.jpg' for n in range(4)]
+
+    host_limiter = PeakHostLimiter(
+        default=HostLimit(max_concurrency=4),
+        hosts={'slow.example.com': HostLimit(max_concurrency=1)},
+    )
+    with requests_mock.Mocker() as mock:
+        for url in slow_urls + fast_urls:
+            mock.get(
+                url, status_code=200, content=FAKE_JPEG,
+                headers={'Content-Type': 'image/jpeg'},
+            )
+
+        result = main(
+            slow_urls + fast_urls, 4, folder=str(temp_folder), host_limiter=host_limiter,
+        )
+
+    assert all(path is not None for path in result)
+    assert host_limiter.peak['slow.example.com'] == 1
+    assert host_limiter.peak['fast.example.com'] >= 3
+    assert host_limiter.stats()['slow.example.com']['completed'] == len(slow_urls)
+
+
+def test_main_adaptive_concurrency_stays_within_bounds(temp_folder):
+    urls = [f'https://example.com/image{n}.jpg' for n in range(40)]
+    adaptive = AIMDController(min_limit=1, max_limit=4)
+
+    with requests_mock.Mocker() as mock:
+        for url in urls:
+            mock.get(
+                url, status_code=200, content=FAKE_JPEG,
+                headers={'Content-Type': 'image/jpeg'},
+            )
+
+        result = main(urls, 1, folder=str(temp_folder), adaptive=adaptive)
+
+    assert all(path is not None for path in result)
+    assert adaptive.history[0][1] == 1
+    assert max(limit for _, limit in adaptive.history) <= 4
+
+
+def test_main_content_addressed_storage_deduplicates(temp_folder):
+    urls = [f'https://example.com/image{n}.jpg' for n in range(6)]
+    with requests_mock.Mocker() as mock:
+        for n, url in enumerate(urls):
+            mock.get(
+                url, status_code=200, content=FAKE_JPEG + f'body {n % 2}'.encode(),
+                headers={'Content-Type': 'image/jpeg'},
+            )
+
+        storage = ContentAddressedStorage(str(temp_folder))
+        result = main(urls, 3, folder=str(temp_folder), storage=storage)
+
+    assert len(set(result)) == 2
+    assert storage.duplicates == 4
+    assert set(storage.load_index()) == set(urls)
+
+
+def test_main_conditional_requests_reuse_cached_files(temp_folder):
+    urls = [f'https://example.com/image{n}.jpg' for n in range(3)]
+    folder = str(temp_folder / 'downloads')
+
+    def respond(request, context):
+        if request.headers.get('If-None-Match') == '"v1"':
+            context.status_code = 304
+            return b''
+        context.headers = {'Content-Type': 'image/jpeg', 'ETag': '"v1"'}
+        return FAKE_JPEG
+
+    with requests_mock.Mocker() as mock:
+        for url in urls:
+            mock.get(url, content=respond)
+        first_cache = HttpCache(str(temp_folder / 'cache.sqlite'))
+        first = main(urls, 2, folder=folder, cache=first_cache)
+        cache = HttpCache(str(temp_folder / 'cache.sqlite'))
+        second = main(urls, 2, folder=folder, cache=cache)
+
+    assert first == second
+    assert (first_cache.hits, first_cache.misses) == (0, 3)
+    assert (cache.hits, cache.misses) == (3, 0)
+    assert len(os.listdir(folder)) == len(urls)
+
+
+def test_main_records_metrics(temp_folder, mock_urls):
+    with requests_mock.Mocker() as mock:
+        for url in mock_urls[:2]:
+            mock.get(url, content=FAKE_JPEG, headers={'Content-Type': 'image/jpeg'})
+        mock.get(mock_urls[2], status_code=404)
+
+        metrics = Metrics()
+        main(mock_urls, 2, folder=str(temp_folder), metrics=metrics)
+
+    summary = metrics.summary()
+    assert (summary['ok'], summary['failed']) == (2, 1)
+    assert summary['statuses'] == {'200': 2, '404': 1}
+    assert summary['errors'] == {'DownloadError': 1}
+    assert summary['bytes'] == 2 * len(FAKE_JPEG)
+    assert set(summary['phase_mean_ms']) == {'ttfb', 'body', 'write'}
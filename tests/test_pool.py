@@ -0,0 +1,59 @@
+import asyncio
+import os
+
+import pytest
+import requests
+
+from ..async_download import main as async_main
+from ..benchmark import HostProfile, ImageServer
+from ..metrics import Metrics
+from ..multithreaded_download import main as threaded_main
+from ..pool import PoolConfig, PoolStats
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CRED_PATH = os.path.join(REPO_DIR, 'credentials.json')
+
+
+def test_pool_is_sized_to_the_concurrency():
+    assert PoolConfig().limits(32) == (32, 32)
+    assert PoolConfig(max_connections=100, max_per_host=8).limits(32) == (100, 8)
+    assert PoolConfig(max_connections=4).limits(32) == (4, 4)
+
+
+@pytest.mark.asyncio
+async def test_connector_leaves_room_for_extra_connections():
+    connector = PoolConfig(max_per_host=8).connector(32, extra=3)
+    assert (connector.limit, connector.limit_per_host) == (35, 11)
+    await connector.close()
+
+
+def test_requests_adapter_reuses_connections_and_applies_timeouts():
+    stats = PoolStats()
+    with ImageServer(HostProfile(image_size=64, latency=0)) as server:
+        with requests.Session() as session:
+            PoolConfig().mount(session, 4, stats)
+            for url in server.urls(10):
+                assert session.get(url).status_code == 200
+        assert (stats.new, stats.reused) == (1, 9)
+
+    with ImageServer(HostProfile(image_size=64, latency=0.5)) as server:
+        with requests.Session() as session:
+            PoolConfig(read_timeout=0.1).mount(session, 4, PoolStats())
+            with pytest.raises(requests.Timeout):
+                session.get(server.urls(1)[0])
+
+
+def test_both_modes_report_connection_reuse(tmp_path):
+    with ImageServer(HostProfile(image_size=64, latency=0.001)) as server:
+        urls = server.urls(30)
+        threaded, coroutines = Metrics(), Metrics()
+        threaded_main(urls, 4, CRED_PATH, str(tmp_path / 'a'), metrics=threaded)
+        asyncio.run(async_main(
+            urls, 4, CRED_PATH, str(tmp_path / 'b'), metrics=coroutines,
+        ))
+
+    for metrics in (threaded, coroutines):
+        new = metrics.value('download_connections_total', kind='new')
+        reused = metrics.value('download_connections_total', kind='reused')
+        assert new + reused == len(urls)
+        assert 1 <= new <= 4
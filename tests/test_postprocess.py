@@ -0,0 +1,159 @@
+import asyncio
+import os
+import struct
+import time
+import zlib
+
+import aiohttp
+import pytest
+import requests
+import requests_mock
+from aioresponses import aioresponses
+
+from ..async_download import download_image as async_download_image
+from ..async_download import main as async_main
+from ..multithreaded_download import download_image
+from ..multithreaded_download import main as threaded_main
+from ..postprocess import PostProcessor, Thumbnail, image_info, verify_image
+from ..storage import ShardStorage
+from ..utils import Progress
+
+
+def _png(width: int, height: int) -> bytes:
+    def chunk(kind: bytes, body: bytes) -> bytes:
+        crc = zlib.crc32(kind + body)
+        return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', crc)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)
+    pixels = zlib.compress(b'\0' * (width + 1) * height)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', pixels)
+            + chunk(b'IEND', b''))
+
+
+PNG = _png(3, 2)
+GIF = b'GIF89a' + struct.pack('<HH', 5, 4) + b'\0' * 10 + b';'
+JPEG = (b'\xff\xd8' + b'\xff\xe0' + struct.pack('>H', 4) + b'\0\0'
+        + b'\xff\xc0' + struct.pack('>HBHH', 11, 8, 7, 9) + b'\0' * 6 + b'\xff\xd9')
+
+
+def _save(storage, url, body):
+    writer = storage.open(url, 'png')
+    writer.write(body)
+    return writer.commit()
+
+
+def _stamp(path, data):
+    # Медленный шаг: возвращает время окончания обработки
+    time.sleep(0.2)
+    return time.time()
+
+
+def test_builtin_steps_read_headers_and_detect_truncation():
+    assert image_info('a.png', PNG) == {
+        'format': 'png', 'width': 3, 'height': 2, 'size': len(PNG),
+    }
+    assert image_info('a.gif', GIF)['width'] == 5
+    assert image_info('a.jpg', JPEG)['width'] == 9
+    assert image_info('a.jpg', JPEG)['height'] == 7
+    for data in (PNG, GIF, JPEG):
+        assert verify_image('a', data)
+    with pytest.raises(ValueError):
+        verify_image('a.png', PNG[:-12])
+    with pytest.raises(ValueError):
+        verify_image('a.jpg', JPEG[:-2])
+
+
+@pytest.mark.asyncio
+async def test_async_attaches_step_results_and_fails_broken_files(tmp_path):
+    urls = ['https://example.com/ok.png', 'https://example.com/broken.png']
+    postprocess = PostProcessor({'verify': verify_image, 'info': image_info}, workers=1)
+    with aioresponses() as mock:
+        mock.get(urls[0], body=PNG, headers={'Content-Type': 'image/png'})
+        mock.get(urls[1], body=PNG[:-12], headers={'Content-Type': 'image/png'})
+        result = await async_main(urls, 2, folder=str(tmp_path), postprocess=postprocess)
+
+    assert result[0].processed['info']['width'] == 3
+    assert result[0].processed['verify'] is True
+    assert os.path.exists(result[0])
+    assert result[1] is None
+    assert (postprocess.processed, postprocess.failed) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_async_progress_counts_a_file_after_its_steps(tmp_path):
+    url = 'https://example.com/broken.png'
+    progress = Progress()
+    postprocess = PostProcessor({'verify': verify_image}, workers=1)
+    with aioresponses() as mock:
+        mock.get(url, body=PNG[:-12], headers={'Content-Type': 'image/png'})
+        async with aiohttp.ClientSession() as session:
+            path = await async_download_image(
+                url, asyncio.Semaphore(1), session, progress, 1, str(tmp_path),
+                postprocess=postprocess,
+            )
+    postprocess.close()
+
+    assert path is None
+    assert (progress.succeeded, progress.failed) == (0, 1)
+
+
+def test_threaded_downloads_wait_for_the_cpu_stage(tmp_path):
+    urls = [f'https://example.com/{n}.png' for n in range(8)]
+    postprocess = PostProcessor({'stamp': _stamp}, workers=1, max_pending=1)
+    with requests_mock.Mocker() as mock:
+        for url in urls:
+            mock.get(url, content=PNG, headers={'Content-Type': 'image/png'})
+        result = threaded_main(urls, 2, folder=str(tmp_path), postprocess=postprocess)
+
+    assert all(result)
+    # Без противодавления все файлы скачались бы до конца первой обработки
+    saved_at = max(os.path.getmtime(path) for path in result)
+    first_processed = min(path.processed['stamp'] for path in result)
+    assert saved_at > first_processed
+
+
+def test_download_image_waits_for_postprocessing(tmp_path):
+    url = 'https://example.com/a.gif'
+    postprocess = PostProcessor({'info': image_info}, workers=1)
+    with requests_mock.Mocker() as mock:
+        mock.get(url, content=GIF, headers={'Content-Type': 'image/gif'})
+        path = download_image(
+            url, requests.Session(), Progress(), 1, str(tmp_path),
+            postprocess=postprocess,
+        )
+    postprocess.close()
+
+    assert path.processed['info']['format'] == 'gif'
+
+
+def test_thumbnails_of_shard_members_do_not_collide(tmp_path):
+    storage = ShardStorage(str(tmp_path))
+    paths = [_save(storage, f'https://example.com/{n}.png', PNG) for n in range(3)]
+    storage.close()
+    thumbnail = Thumbnail()
+
+    names = {thumbnail.path_for(path) for path in paths}
+    assert len(names) == len(paths)
+    assert {os.path.dirname(name) for name in names} == {str(tmp_path / 'thumbnails')}
+    assert thumbnail.path_for(str(tmp_path / 'a.png')) == str(
+        tmp_path / 'thumbnails' / 'a.jpg',
+    )
+
+
+def test_shard_storage_gets_one_thumbnail_per_member(tmp_path):
+    pytest.importorskip('PIL')
+    urls = [f'https://example.com/{n}.png' for n in range(4)]
+    postprocess = PostProcessor({'thumbnail': Thumbnail(size=(2, 2))}, workers=1)
+    storage = ShardStorage(str(tmp_path), flush_members=True)
+    with requests_mock.Mocker() as mock:
+        for url in urls:
+            mock.get(url, content=PNG, headers={'Content-Type': 'image/png'})
+        result = threaded_main(
+            urls, 2, folder=str(tmp_path), storage=storage, postprocess=postprocess,
+        )
+
+    thumbnails = {path.processed['thumbnail'] for path in result}
+    assert len(thumbnails) == len(urls)
+    assert sorted(os.listdir(tmp_path / 'thumbnails')) == sorted(
+        os.path.basename(path) for path in thumbnails
+    )
@@ -0,0 +1,105 @@
+import asyncio
+import multiprocessing
+import threading
+
+from ..utils import Counter, Progress, SharedProgress
+
+THREADS = 64
+OPERATIONS = 5000
+
+
+def test_progress_is_exact_under_many_threads():
+    progress = Progress()
+    ordinals = [[] for _ in range(THREADS)]
+    barrier = threading.Barrier(THREADS)
+
+    def work(n):
+        barrier.wait()
+        for step in range(OPERATIONS):
+            progress.start()
+            if step % 5 == 0:
+                progress.fail()
+            else:
+                ordinals[n].append(progress.succeed(size=3))
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    failed = THREADS * OPERATIONS // 5
+    succeeded = THREADS * OPERATIONS - failed
+    assert progress.snapshot() == {
+        'started': THREADS * OPERATIONS,
+        'succeeded': succeeded,
+        'failed': failed,
+        'bytes': succeeded * 3,
+    }
+    assert progress.in_flight == 0
+    # Каждый номер в логе выдан ровно один раз
+    assert sorted(n for chunk in ordinals for n in chunk) == list(range(1, succeeded + 1))
+
+
+def test_progress_from_asyncio_tasks():
+    progress = Progress()
+
+    async def task():
+        progress.start()
+        await asyncio.sleep(0)
+        progress.succeed(size=10)
+
+    async def run():
+        await asyncio.gather(*(task() for _ in range(1000)))
+
+    asyncio.run(run())
+    assert (progress.succeeded, progress.bytes, progress.in_flight) == (1000, 10000, 0)
+
+
+def _process_worker(progress, slot):
+    progress.bind(slot)
+    threads = [
+        threading.Thread(target=lambda: [progress.succeed(size=1) for _ in range(500)])
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    progress.fail()
+    progress.publish()
+
+
+def test_shared_progress_across_processes():
+    context = multiprocessing.get_context('spawn')
+    progress = SharedProgress(4, context)
+    processes = [
+        context.Process(target=_process_worker, args=(progress, slot))
+        for slot in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert progress.succeeded == 4 * 4 * 500
+    assert progress.bytes == 4 * 4 * 500
+    assert progress.failed == 4
+
+
+def test_merge_snapshot_and_counter_compatibility():
+    progress = Progress()
+    progress.succeed(5)
+    progress.merge({'started': 2, 'succeeded': 1, 'failed': 1, 'bytes': 7})
+    assert progress.snapshot()['bytes'] == 12
+
+    counter = Counter()
+    assert str(counter) == '1'
+    counter.increment()
+    assert counter.value == 2
+
+    counter = Counter(5)
+    assert str(counter) == '5'
+    assert counter.succeed() == 5
+    counter.increment()
+    assert (counter.value, counter.succeeded) == (7, 2)
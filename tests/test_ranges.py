@@ -0,0 +1,85 @@
+import os
+import random
+
+import pytest
+from aioresponses import CallbackResult, aioresponses
+
+from ..async_download import main
+from ..ranges import PartialFile, RangePolicy, parse_content_range
+
+BODY = b'\xff\xd8\xff\xe0' + random.Random(0).randbytes(4996)
+POLICY = RangePolicy(threshold=1000, parts=4, min_part_size=500)
+URL = 'https://example.com/large.jpg'
+
+
+def test_split_respects_parts_and_min_size():
+    assert POLICY.split(1000, 5000) == [(1000, 2333), (2334, 3667), (3668, 4999)]
+    assert POLICY.split(1000, 1600) == [(1000, 1599)]
+    assert parse_content_range('bytes 0-999/5000') == (0, 999, 5000)
+    assert parse_content_range('bytes 0-999/*') is None
+
+
+def _ranged_server(requested, fail_from=None):
+    def respond(url, headers=None, **kwargs):
+        value = (headers or {}).get('Range')
+        requested.append(value)
+        common = {'Content-Type': 'image/jpeg', 'ETag': '"v1"'}
+        if value is None:
+            return CallbackResult(body=BODY, headers=common)
+        first, last = (int(part) for part in value[len('bytes='):].split('-'))
+        if fail_from is not None and first >= fail_from:
+            return CallbackResult(status=503)
+        last = min(last, len(BODY) - 1)
+        return CallbackResult(
+            status=206, body=BODY[first:last + 1],
+            headers={**common, 'Content-Range': f'bytes {first}-{last}/{len(BODY)}'},
+        )
+    return respond
+
+
+@pytest.mark.asyncio
+async def test_large_body_is_fetched_as_parallel_ranges(tmp_path):
+    requested = []
+    with aioresponses() as mock:
+        mock.get(URL, callback=_ranged_server(requested), repeat=True)
+        [path] = await main([URL], 4, folder=str(tmp_path), ranges=POLICY)
+
+    assert open(path, 'rb').read() == BODY
+    assert sorted(requested) == [
+        'bytes=0-999', 'bytes=1000-2333', 'bytes=2334-3667', 'bytes=3668-4999',
+    ]
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+
+
+@pytest.mark.asyncio
+async def test_server_without_ranges_gets_a_single_stream(tmp_path):
+    def respond(url, **kwargs):
+        return CallbackResult(body=BODY, headers={'Content-Type': 'image/jpeg'})
+
+    with aioresponses() as mock:
+        mock.get(URL, callback=respond)
+        [path] = await main([URL], 4, folder=str(tmp_path), ranges=POLICY)
+
+    assert open(path, 'rb').read() == BODY
+
+
+@pytest.mark.asyncio
+async def test_failed_ranged_download_resumes_missing_ranges(tmp_path):
+    folder = str(tmp_path)
+    requested = []
+    with aioresponses() as mock:
+        mock.get(URL, callback=_ranged_server(requested, fail_from=3000), repeat=True)
+        assert await main([URL], 4, folder=folder, ranges=POLICY) == [None]
+
+    partial = PartialFile(folder, URL)
+    assert partial.state is not None
+    assert [index for index in partial.missing()] == [3]
+
+    requested.clear()
+    with aioresponses() as mock:
+        mock.get(URL, callback=_ranged_server(requested), repeat=True)
+        [path] = await main([URL], 4, folder=folder, ranges=POLICY)
+
+    assert requested == ['bytes=3668-4999']
+    assert open(path, 'rb').read() == BODY
+    assert os.listdir(folder) == [os.path.basename(path)]
@@ -0,0 +1,47 @@
+from email.utils import formatdate
+import time
+
+import pytest
+
+from ..retry import RetryPolicy, parse_retry_after
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('7') == 7.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('not a date') is None
+    assert 50 < parse_retry_after(formatdate(time.time() + 60, usegmt=True)) <= 60
+
+
+def test_backoff_is_exponential_and_capped():
+    policy = RetryPolicy(backoff_base=1, backoff_max=5, jitter=0)
+    assert [policy.backoff(n) for n in range(1, 5)] == [1, 2, 4, 5]
+
+
+@pytest.mark.parametrize('attempt', [1, 2, 3, 4])
+def test_backoff_jitter_stays_within_bounds(attempt):
+    policy = RetryPolicy(backoff_base=1, jitter=0.5)
+    full = 2 ** (attempt - 1)
+    assert full / 2 <= policy.backoff(attempt) <= full
+
+
+def test_retry_delay_rules():
+    policy = RetryPolicy(max_attempts=3, jitter=0, retry_statuses={503: None, 429: 5})
+
+    assert policy.retry_delay(1) is not None
+    assert policy.retry_delay(3) is None
+    # 404 не входит в список повторяемых статусов
+    assert policy.retry_delay(1, status=404) is None
+    # Для 429 задан собственный лимит попыток
+    assert policy.retry_delay(4, status=429) is not None
+    assert policy.retry_delay(4, status=503) is None
+
+
+def test_retry_delay_honors_retry_after():
+    policy = RetryPolicy(backoff_base=0.1, jitter=0, max_retry_after=30)
+
+    assert policy.retry_delay(1, status=503, retry_after=10) == 10
+    assert policy.retry_delay(1, status=503, retry_after=60) is None
+    assert RetryPolicy(respect_retry_after=False, jitter=0).retry_delay(
+        1, status=503, retry_after=10,
+    ) == 0.5
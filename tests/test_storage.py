@@ -0,0 +1,165 @@
+import hashlib
+import os
+import tarfile
+
+import pytest
+import requests_mock
+
+from ..manifest import Manifest
+from ..multithreaded_download import main as threaded_main
+from ..storage import (ContentAddressedStorage, FileStorage, ShardStorage, member_path,
+                       read_stored, stored_exists, stored_size)
+
+JPEG = b'\xff\xd8\xff\xe0'
+
+
+def _save(storage, url, body, extension='jpg'):
+    writer = storage.open(url, extension, len(body))
+    for start in range(0, len(body), 4):
+        writer.write(body[start:start + 4])
+    return writer.commit()
+
+
+def test_file_storage_commits_atomically(tmp_path):
+    storage = FileStorage(str(tmp_path))
+    writer = storage.open('https://example.com/a.jpg', 'jpg', 100)
+    writer.write(b'short body')
+    # До commit в папке только временный файл
+    assert all(name.endswith('.part') for name in os.listdir(tmp_path))
+
+    path = writer.commit()
+    with open(path, 'rb') as file:
+        assert file.read() == b'short body'
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+
+
+def test_file_storage_abort_removes_temp_file(tmp_path):
+    writer = FileStorage(str(tmp_path)).open('https://example.com/a.jpg', 'jpg')
+    writer.write(b'partial')
+    writer.abort()
+    assert os.listdir(tmp_path) == []
+
+
+def test_content_addressed_path_is_sharded_by_digest(tmp_path):
+    storage = ContentAddressedStorage(str(tmp_path), depth=2, width=2)
+    body = b'fake image data'
+    digest = hashlib.sha256(body).hexdigest()
+
+    path = _save(storage, 'https://example.com/a.jpg', body)
+
+    assert path == os.path.join(str(tmp_path), digest[:2], digest[2:4], f'{digest}.jpg')
+    with open(path, 'rb') as file:
+        assert file.read() == body
+
+
+def test_content_addressed_deduplicates_and_indexes_urls(tmp_path):
+    storage = ContentAddressedStorage(str(tmp_path))
+    first = _save(storage, 'https://a.example.com/cat.jpg', b'same bytes')
+    second = _save(storage, 'https://b.example.com/copy.jpg', b'same bytes')
+    other = _save(storage, 'https://a.example.com/dog.jpg', b'other bytes')
+    storage.close()
+
+    assert first == second != other
+    assert storage.duplicates == 1
+    blobs = [
+        name for _, _, names in os.walk(tmp_path) for name in names
+        if name.endswith('.jpg')
+    ]
+    assert len(blobs) == 2
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.part')]
+
+    index = ContentAddressedStorage(str(tmp_path)).load_index()
+    assert (
+        index['https://a.example.com/cat.jpg'] == index['https://b.example.com/copy.jpg']
+    )
+    assert len(index) == 3
+
+
+@pytest.mark.parametrize('depth', [0, 1, 3])
+def test_content_addressed_depth(tmp_path, depth):
+    storage = ContentAddressedStorage(str(tmp_path), depth=depth, width=1)
+    path = _save(storage, 'https://example.com/a.png', b'data', 'png')
+    relative = os.path.relpath(path, tmp_path)
+    assert relative.count(os.sep) == depth
+
+
+def test_shards_roll_over_and_stay_valid_tar(tmp_path):
+    storage = ShardStorage(str(tmp_path), shard_size=4096)
+    bodies = {f'https://example.com/{n}.jpg': bytes([n]) * (700 + n) for n in range(8)}
+    paths = {url: _save(storage, url, body) for url, body in bodies.items()}
+    storage.close()
+
+    shards = sorted(name for name in os.listdir(tmp_path) if name.endswith('.tar'))
+    assert len(shards) == storage.shards > 1
+    assert all(os.path.getsize(tmp_path / name) <= 4096 + 1024 for name in shards)
+    for url, body in bodies.items():
+        assert read_stored(paths[url]) == body
+        assert stored_size(paths[url]) == len(body) and stored_exists(paths[url])
+
+    members = []
+    for name in shards:
+        with tarfile.open(tmp_path / name) as archive:
+            members += [archive.extractfile(member).read() for member in archive]
+    assert sorted(members) == sorted(bodies.values())
+
+    index = ShardStorage(str(tmp_path)).load_index()
+    assert index.keys() == bodies.keys()
+    shard, offset, length = index['https://example.com/3.jpg']
+    with open(shard, 'rb') as file:
+        file.seek(offset)
+        assert file.read(length) == bodies['https://example.com/3.jpg']
+
+
+def test_shards_adopt_files_and_keep_earlier_runs(tmp_path):
+    _save(ShardStorage(str(tmp_path)), 'https://example.com/old.jpg', b'old')
+    storage = ShardStorage(str(tmp_path), flush_members=True)
+    part = tmp_path / 'big.part'
+    part.write_bytes(b'ranged body')
+
+    path = storage.adopt('https://example.com/big.jpg', 'jpg', str(part))
+
+    # Член шарда читается до закрытия, а шард прошлого запуска не перезаписан
+    assert read_stored(path) == b'ranged body'
+    assert not part.exists()
+    storage.close()
+    assert sorted(os.listdir(tmp_path)) == [
+        'shard-000000.tar', 'shard-000001.tar', 'shard_index.jsonl',
+    ]
+    assert not stored_exists(path.replace('shard-000001', 'shard-000009'))
+
+
+def test_shards_behind_a_downloader_and_manifest(tmp_path):
+    urls = [f'https://example.com/{n}.jpg' for n in range(5)]
+    manifest = Manifest(str(tmp_path / 'manifest.sqlite'))
+    with requests_mock.Mocker() as mock:
+        for url in urls:
+            mock.get(
+                url, content=JPEG + url.encode(), headers={'Content-Type': 'image/jpeg'},
+            )
+        first = threaded_main(
+            urls, 2, folder=str(tmp_path), storage=ShardStorage(str(tmp_path)),
+            manifest=manifest,
+        )
+        second = threaded_main(
+            urls, 2, folder=str(tmp_path), storage=ShardStorage(str(tmp_path)),
+            manifest=manifest,
+        )
+        requests = mock.call_count
+
+    assert requests == len(urls)
+    assert first == second
+    assert [read_stored(path) for path in first] == [JPEG + url.encode() for url in urls]
+
+
+def test_shard_index_never_points_past_flushed_data(tmp_path):
+    storage = ShardStorage(str(tmp_path), buffer_size=4096)
+    lagged = False
+    for n in range(20):
+        _save(storage, f'https://example.com/{n}.jpg', bytes([n]) * 700)
+        # Без close, как после сбоя: индекс читается с диска как есть
+        index = ShardStorage(str(tmp_path)).load_index()
+        assert all(stored_exists(member_path(*entry)) for entry in index.values())
+        lagged = lagged or len(index) < n + 1
+    assert lagged
+    storage.close()
+    assert len(ShardStorage(str(tmp_path)).load_index()) == 20
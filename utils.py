@@ -1,14 +1,44 @@
+import itertools
 import json
 import logging
+import multiprocessing
+import os
+import sys
+import threading
 import time
 import uuid
+from contextlib import suppress
+from typing import (AsyncIterable, Iterable, Iterator, Optional, Sized,
+                    Union)
+from urllib.parse import urlsplit
 
+# Размер блока, которым тело ответа пишется на диск
+CHUNK_SIZE = 64 * 1024
+# Во сколько раз очередь URL больше числа одновременных задач
+QUEUE_SIZE_FACTOR = 2
 
-content_type_to_extension = {
-    'image/jpeg': 'jpg',
-    'image/png': 'png',
-    'image/gif': 'gif'
-}
+# Источник URL: (асинхронный) итерируемый объект, путь к файлу или '-' для stdin
+UrlSource = Union[Iterable[str], AsyncIterable[str], str, os.PathLike]
+
+
+class DownloadError(Exception):
+    """Raised when a URL answers but its response cannot be saved as an image."""
+
+    def __init__(
+        self,
+        url: str,
+        message: str,
+        status: Optional[int] = None,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__(message)
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        # Ошибка передается из процесса-воркера вместе со статусом
+        return DownloadError, (self.url, str(self), self.status, self.retry_after)
 
 
 def setup_logging():
@@ -26,14 +56,217 @@ def load_credentials(json_file: str) -> dict:
         logging.exception('Loading error credentials.json')
 
 
-class Counter:
+def iter_urls(source: Union[Iterable[str], str, os.PathLike]) -> Iterator[str]:
+    """
+    Lazily yield URLs from an iterable, a text file (one URL per line) or stdin ('-').
+
+    Blank lines and lines starting with '#' are skipped, so huge URL dumps are never
+    loaded into memory at once.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        if source == '-':
+            yield from _clean_lines(sys.stdin)
+        else:
+            with open(source, 'r') as file:
+                yield from _clean_lines(file)
+    else:
+        yield from _clean_lines(source)
+
+
+def url_host(url: str) -> str:
+    return urlsplit(url).hostname or ''
+
+
+def count_urls(source: UrlSource) -> Optional[int]:
+    """Return the number of URLs if it is known without consuming the source."""
+    if isinstance(source, Sized) and not isinstance(source, (str, os.PathLike)):
+        return len(source)
+    return None
+
+
+def _clean_lines(lines: Iterable[str]) -> Iterator[str]:
+    for line in lines:
+        url = line.strip()
+        if url and not url.startswith('#'):
+            yield url
+
+
+# Поля шарда прогресса
+STARTED, SUCCEEDED, FAILED, BYTES = range(4)
+
+
+class Progress:
+    """
+    Progress of a download run: successes, failures, bytes and in-flight count.
+
+    Every thread writes only its own shard, so the hot path takes no lock; reads sum
+    the shards. All asyncio tasks of a loop share their thread's shard. Worker processes
+    report through `SharedProgress` or send a `snapshot()` to be `merge`d.
+    """
+
+    def __init__(self):
+        self._shards = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # next() у itertools.count атомарен, поэтому номера в логе не повторяются
+        self._ordinal = itertools.count(1)
+
+    def _shard(self) -> list:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = [0, 0, 0, 0]
+            # Блокировка нужна только при первой записи из нового потока
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def start(self) -> None:
+        """Account a URL taken into work."""
+        self._shard()[STARTED] += 1
+
+    def succeed(self, size: int = 0) -> int:
+        """Account a saved file of `size` bytes; returns its unique 1-based ordinal."""
+        shard = self._shard()
+        shard[SUCCEEDED] += 1
+        shard[BYTES] += size
+        return next(self._ordinal)
+
+    def fail(self) -> None:
+        self._shard()[FAILED] += 1
+
+    def _total(self, field: int) -> int:
+        return sum(shard[field] for shard in list(self._shards))
+
+    @property
+    def started(self) -> int:
+        return self._total(STARTED)
+
+    @property
+    def succeeded(self) -> int:
+        return self._total(SUCCEEDED)
+
+    @property
+    def failed(self) -> int:
+        return self._total(FAILED)
+
+    @property
+    def bytes(self) -> int:
+        return self._total(BYTES)
+
+    @property
+    def in_flight(self) -> int:
+        return self.started - self.succeeded - self.failed
+
+    def snapshot(self) -> dict:
+        totals = [self._total(field) for field in range(4)]
+        return {
+            'started': totals[STARTED],
+            'succeeded': totals[SUCCEEDED],
+            'failed': totals[FAILED],
+            'bytes': totals[BYTES],
+        }
+
+    def merge(self, snapshot: dict) -> None:
+        """Add the counts of another process, e.g. a finished worker's `snapshot()`."""
+        shard = [snapshot['started'], snapshot['succeeded'], snapshot['failed'],
+                 snapshot['bytes']]
+        with self._lock:
+            self._shards.append(shard)
+
+    def log_summary(self) -> None:
+        snapshot = self.snapshot()
+        logging.info(
+            f'Progress | ok {snapshot["succeeded"]} | failed {snapshot["failed"]} | '
+            f'{snapshot["bytes"] / 1024 / 1024:.1f} MB',
+        )
+
+
+class SharedProgress(Progress):
+    """
+    Progress shared with worker processes through shared memory.
+
+    Each worker calls `bind(slot)` with its own slot number; it counts in its private
+    thread shards and publishes its totals into its own row after every update, so
+    processes never contend. The parent reads the live sum of all rows. A worker with
+    several threads should call `publish()` once more at the end to make its row exact.
+
+    Args:
+        slots (int): Number of worker processes.
+        context (optional): `multiprocessing` context the array is created in.
+    """
+
+    def __init__(self, slots: int, context=None):
+        super().__init__()
+        context = context or multiprocessing.get_context()
+        self._array = context.Array('q', slots * 4, lock=False)
+        self._slot = None
+
+    def __getstate__(self) -> dict:
+        # Потоковые шарды и блокировки в дочерний процесс не передаются
+        return {'array': self._array}
+
+    def __setstate__(self, state: dict) -> None:
+        Progress.__init__(self)
+        self._array = state['array']
+        self._slot = None
+
+    def bind(self, slot: int) -> 'SharedProgress':
+        """Make this process publish into row `slot`; call once in every worker."""
+        self._slot = slot
+        return self
+
+    def publish(self) -> None:
+        """Copy this process's totals into its row."""
+        if self._slot is None:
+            return
+        row = self._slot * 4
+        for field in range(4):
+            self._array[row + field] = Progress._total(self, field)
+
+    def start(self) -> None:
+        super().start()
+        self.publish()
+
+    def succeed(self, size: int = 0) -> int:
+        ordinal = super().succeed(size)
+        self.publish()
+        return ordinal
+
+    def fail(self) -> None:
+        super().fail()
+        self.publish()
+
+    def _total(self, field: int) -> int:
+        # У привязанного воркера собственные счетчики уже лежат в его строке
+        local = 0 if self._slot is not None else Progress._total(self, field)
+        return sum(self._array[field::4]) + local
+
+
+class Counter(Progress):
+    """
+    The former success counter, kept for existing callers.
+
+    `value` is the number the next saved file gets, starting from `start`, and the
+    ordinals returned by `succeed` continue from it. Counts are kept by `Progress`, so
+    a `Counter` can be passed to the downloaders as their progress.
+
+    Args:
+        start (int, optional): Number of the first saved file.
+    """
+
     def __init__(self, start: int = 1):
-        self.value = start
+        super().__init__()
+        self._first = start
+        self._ordinal = itertools.count(start)
+
+    def increment(self) -> None:
+        self.succeed()
 
-    def increment(self):
-        self.value += 1
+    @property
+    def value(self) -> int:
+        return self._first + self.succeeded
 
-    def __str__(self):
+    def __str__(self) -> str:
         return str(self.value)
 
 
@@ -41,3 +274,32 @@ def generate_unique_name() -> str:
     timestamp = int(time.time() * 1000)
     unique_id = uuid.uuid4()
     return f'{timestamp}_{unique_id}'
+
+
+def temp_path_for(file_path: str) -> str:
+    return f'{file_path}.part'
+
+
+def parse_content_length(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def preallocate(fd: int, size: Optional[int]) -> None:
+    """Reserve `size` bytes for an open file so the streamed body is written contiguously."""  # noqa: E501
+    if not size:
+        return
+    try:
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+    except OSError as error:
+        logging.debug(f'Preallocation of {size} bytes failed: {error}')
+
+
+def remove_file(file_path: str) -> None:
+    with suppress(FileNotFoundError):
+        os.remove(file_path)